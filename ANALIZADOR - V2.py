@@ -1,134 +1,17 @@
 # -*- coding: utf-8 -*-
-import asyncio
-import requests
-import json
-import os
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, filedialog
+from tkinter import ttk, scrolledtext, messagebox
 import threading
-from datetime import datetime
-from collections import defaultdict, Counter
-from decimal import Decimal, ROUND_DOWN
+import time
+import queue
+from collections import defaultdict
+from itertools import chain
 import pyperclip
+from analisis import (METODOS, RUTA_SHOCKS, AnalizadorShocks, SeleccionShocks, decimales_por_valor,
+                      formatear_volumen, guardar_shocks, precio_zona)
 
-# ---------- FUNCIONES UTILITARIAS ----------
-
-def formatear_volumen(num):
-    if num >= 1_000_000_000:
-        return f"{num / 1_000_000_000:.1f}b"
-    elif num >= 1_000_000:
-        return f"{num / 1_000_000:.1f}m"
-    elif num >= 1_000:
-        return f"{num / 1_000:.1f}k"
-    else:
-        return f"{num:.2f}"
-
-def decimales_por_valor(valor):
-    s = f"{valor:.10f}".rstrip('0')
-    return len(s.split('.')[1]) if '.' in s else 0
-
-def agrupar_precio_manual(price, agrupacion):
-    agrupado = (price // agrupacion) * agrupacion
-    decimales = decimales_por_valor(agrupacion)
-    return round(agrupado, decimales)
-
-def obtener_nivel_agrupacion_optimo(tick_size, precio_actual):
-    """Calcula la agrupación óptima basada en el precio actual"""
-    try:
-        if precio_actual is None or precio_actual <= 0:
-            return tick_size
-        
-        # Determinar agrupación base según el rango de precio
-        if precio_actual >= 100:
-            agrupacion_base = 10.0
-        elif precio_actual >= 10:
-            agrupacion_base = 1.0
-        elif precio_actual >= 1:
-            agrupacion_base = 0.1
-        elif precio_actual >= 0.1:
-            agrupacion_base = 0.01
-        elif precio_actual >= 0.01:
-            agrupacion_base = 0.001
-        elif precio_actual >= 0.001:
-            agrupacion_base = 0.0001
-        else:
-            agrupacion_base = 0.00001
-        
-        # Verificar que sea divisible por el tick_size
-        tick_decimal = Decimal(str(tick_size))
-        agrupacion_decimal = Decimal(str(agrupacion_base))
-        cociente = agrupacion_decimal / tick_decimal
-        
-        if cociente % 1 == 0:
-            return agrupacion_base
-        
-        # Si no es divisible, buscar el nivel más cercano que sí lo sea
-        niveles_posibles = [0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10, 100]
-        
-        for nivel in reversed(niveles_posibles):
-            nivel_decimal = Decimal(str(nivel))
-            cociente = nivel_decimal / tick_decimal
-            if cociente % 1 == 0 and nivel <= agrupacion_base:
-                return nivel
-        
-        return tick_size
-        
-    except Exception as e:
-        return tick_size
-
-# ---------- MÉTODOS DE CÁLCULO QUIRÚRGICO ----------
-
-def calcular_precio_moda(price_count, tick, decimales_tick):
-    """Encuentra el precio con mayor volumen"""
-    if not price_count:
-        return 0
-    precio_max = max(price_count.items(), key=lambda x: x[1])[0]
-    return round(round(precio_max / tick) * tick, decimales_tick)
-
-def calcular_precio_promedio_ponderado(price_count, tick, decimales_tick):
-    """Calcula el promedio ponderado"""
-    if not price_count:
-        return 0
-    
-    total_qty = sum(price_count.values())
-    weighted_avg = sum(p * q for p, q in price_count.items()) / total_qty
-    return round(round(weighted_avg / tick) * tick, decimales_tick)
-
-# ---------- OBTENER DATOS BINANCE ----------
-
-def obtener_precio_actual(symbol):
-    url = f"https://fapi.binance.com/fapi/v1/ticker/price?symbol={symbol}"
-    try:
-        return float(requests.get(url, timeout=5).json()['price'])
-    except Exception as e:
-        print(f"Error al obtener precio: {e}")
-        return None
-
-def obtener_tick_size(symbol):
-    url = f"https://fapi.binance.com/fapi/v1/exchangeInfo"
-    try:
-        data = requests.get(url, timeout=5).json()
-        for s in data["symbols"]:
-            if s["symbol"] == symbol:
-                for f in s["filters"]:
-                    if f["filterType"] == "PRICE_FILTER":
-                        tick_size = float(f["tickSize"])
-                        return tick_size
-        return 0.01
-    except Exception as e:
-        print(f"Error al obtener tickSize: {e}")
-        return 0.01
-
-def cargar_libro_ordenes_api(symbols, base_url="http://localhost:8000"):
-    order_books = {}
-    for symbol in symbols:
-        try:
-            resp = requests.get(f"{base_url}/orderbooks/{symbol}", timeout=5)
-            if resp.status_code == 200:
-                order_books[symbol] = resp.json()
-        except Exception as e:
-            print(f"Error al obtener libro: {e}")
-    return order_books
+# Cada cuánto el hilo de Tk revisa si el hilo de análisis dejó una pasada nueva
+INTERVALO_RENDER_MS = 100
 
 # ---------- INTERFAZ GRAFICA ----------
 
@@ -141,20 +24,26 @@ class OrderBookAnalyzerGUI:
         
         self.symbols = []
         self.selected_symbols = {}
-        self.agrupaciones = {}  # Agrupaciones en memoria (calculadas automáticamente)
-        self.agrupaciones_custom = {}  # Agrupaciones personalizadas por el usuario
-        self.tick_sizes = {}
-        self.precios_actuales = {}  # Cache de precios
+        # tickSizes, precios y agrupaciones (automáticas y personalizadas) viven en el analizador
+        self.analizador = AnalizadorShocks()
         self.is_running = False
         self.analysis_task = None
         
         self.metodo_calculo = tk.StringVar(value="promedio")
+        # Al cambiar de método se vuelve a mostrar la última pasada (trae moda y promedio)
+        self.metodo_calculo.trace_add('write', lambda *_: self.rerenderizar())
         
         self.shocks_actuales = defaultdict(lambda: {'long': [], 'short': []})
-        self.shocks_seleccionados = defaultdict(lambda: {'long': None, 'short': None})
+        self.seleccion = SeleccionShocks()
+        
+        # El hilo de análisis sólo calcula; el panel se actualiza desde el hilo de Tk
+        self.resultados = queue.Queue()
+        self.ultimo_analisis = None
+        self.renderizado = {}  # symbol -> fragmentos mostrados (para no reescribir lo que no cambió)
         
         self.setup_ui()
         self.cargar_symbols()
+        self.root.after(INTERVALO_RENDER_MS, self.procesar_resultados)
         
     def setup_ui(self):
         style = ttk.Style()
@@ -285,9 +174,7 @@ class OrderBookAnalyzerGUI:
         
     def cargar_symbols(self):
         try:
-            resp = requests.get("http://localhost:8000/symbols", timeout=5)
-            data = resp.json()
-            self.symbols = data.get("symbols", [])
+            self.symbols = self.analizador.symbols_servidor()
             self.mostrar_symbols()
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo conectar al servidor:\n{e}")
@@ -333,26 +220,14 @@ class OrderBookAnalyzerGUI:
             row += 1
     
     def cargar_datos_symbols(self):
-        """Carga los tick_sizes y calcula las agrupaciones óptimas"""
+        """Carga los tick_sizes y precios de todos los símbolos de una vez y calcula las agrupaciones óptimas"""
+        try:
+            self.analizador.cargar_metadatos(self.symbols)
+        except Exception as e:
+            print(f"Error cargando datos de los símbolos: {e}")
         for symbol in self.symbols:
-            try:
-                # Obtener tick size
-                tick = obtener_tick_size(symbol)
-                self.tick_sizes[symbol] = tick
-                
-                # Obtener precio actual
-                precio = obtener_precio_actual(symbol)
-                if precio:
-                    self.precios_actuales[symbol] = precio
-                    # Calcular agrupación óptima
-                    agrupacion_optima = obtener_nivel_agrupacion_optimo(tick, precio)
-                    self.agrupaciones[symbol] = agrupacion_optima
-                
-                # Actualizar el entry en la UI
-                self.root.after(0, lambda s=symbol: self.actualizar_entry_agrupacion(s))
-                
-            except Exception as e:
-                print(f"Error cargando datos para {symbol}: {e}")
+            # Actualizar el entry en la UI
+            self.root.after(0, lambda s=symbol: self.actualizar_entry_agrupacion(s))
     
     def actualizar_entry_agrupacion(self, symbol):
         """Actualiza el entry con la agrupación calculada"""
@@ -362,7 +237,7 @@ class OrderBookAnalyzerGUI:
                 if isinstance(widget, tk.Frame):
                     for child in widget.winfo_children():
                         if isinstance(child, tk.Entry) and hasattr(child, 'symbol') and child.symbol == symbol:
-                            agrupacion = self.agrupaciones.get(symbol, 0.01)
+                            agrupacion = self.analizador.agrupaciones.get(symbol, 0.01)
                             child.config(state='normal', fg='white')
                             child.delete(0, tk.END)
                             child.insert(0, str(agrupacion))
@@ -375,24 +250,11 @@ class OrderBookAnalyzerGUI:
         """Guarda la agrupación personalizada si el usuario la modifica"""
         try:
             valor = float(entry.get())
-            self.agrupaciones_custom[symbol] = valor
+            self.analizador.agrupaciones_custom[symbol] = valor
             # La agrupación personalizada se usa en place de la automática durante el análisis
         except ValueError:
             pass
     
-    def obtener_agrupacion_final(self, symbol):
-        """Obtiene la agrupación a usar: personalizada si existe, sino la automática"""
-        return self.agrupaciones_custom.get(symbol, self.agrupaciones.get(symbol, 0.01))
-    
-    def calcular_precio_segun_metodo(self, price_count, tick, decimales_tick, agrupacion_manual=None):
-        """Calcula el precio según el método seleccionado"""
-        metodo = self.metodo_calculo.get()
-        
-        if metodo == "moda":
-            return calcular_precio_moda(price_count, tick, decimales_tick)
-        else:  # promedio
-            return calcular_precio_promedio_ponderado(price_count, tick, decimales_tick)
-    
     def iniciar_analisis(self):
         symbols_elegidos = [sym for sym, var in self.selected_symbols.items() if var.get()]
         
@@ -405,6 +267,7 @@ class OrderBookAnalyzerGUI:
         self.stop_button.config(state='normal')
         self.status_label.config(text="Ejecutando", foreground='#22c55e')
         self.notebook.select(1)
+        self.limpiar_resultados()
         
         self.analysis_task = threading.Thread(target=self.ejecutar_analisis_loop, 
                                              args=(symbols_elegidos,), daemon=True)
@@ -420,106 +283,128 @@ class OrderBookAnalyzerGUI:
     def ejecutar_analisis_loop(self, symbols_elegidos):
         while self.is_running:
             try:
-                self.realizar_analisis(symbols_elegidos)
+                # Sin tocar Tk desde este hilo: la pasada completa se entrega de una vez
+                self.resultados.put(self.analizador.analizar(symbols_elegidos))
                 for _ in range(300):
                     if not self.is_running:
                         break
-                    import time
                     time.sleep(1)
             except Exception as e:
                 print(f"Error en analisis: {e}")
     
-    def realizar_analisis(self, symbols_elegidos):
-        self.limpiar_resultados()
-        
-        metodo_nombre = {
-            "moda": "Moda (Mayor Volumen)",
-            "promedio": "Promedio Ponderado"
-        }
-        
-        self.agregar_resultado(f"=== Analisis iniciado: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
-        self.agregar_resultado(f"Método: {metodo_nombre[self.metodo_calculo.get()]}\n\n", 'metodo')
-        
-        order_books = cargar_libro_ordenes_api(symbols_elegidos)
-        
-        if not order_books:
-            self.agregar_resultado("No hay datos disponibles.\n")
-            return
-        
-        for symbol, order_book in order_books.items():
-            agrupacion_manual = self.obtener_agrupacion_final(symbol)
-            tick = self.tick_sizes.get(symbol, 0.01)
-            decimales_tick = decimales_por_valor(tick)
-            
-            # Recolectar TODOS los precios sin pre-agrupar
-            price_count_bids = {}
-            price_count_asks = {}
-            
-            for price, qty in order_book['bids'].items():
-                price, qty = float(price), float(qty)
-                price_count_bids[price] = price_count_bids.get(price, 0) + qty
-            
-            for price, qty in order_book['asks'].items():
-                price, qty = float(price), float(qty)
-                price_count_asks[price] = price_count_asks.get(price, 0) + qty
-            
-            # Agrupar los resultados DESPUÉS de calcular
-            bid_ranges = defaultdict(lambda: {'total_qty': 0, 'price_count': {}})
-            ask_ranges = defaultdict(lambda: {'total_qty': 0, 'price_count': {}})
-            
-            for price, qty in price_count_bids.items():
-                range_key = agrupar_precio_manual(price, agrupacion_manual)
-                bid_ranges[range_key]['total_qty'] += qty
-                bid_ranges[range_key]['price_count'][price] = qty
-            
-            for price, qty in price_count_asks.items():
-                range_key = agrupar_precio_manual(price, agrupacion_manual)
-                ask_ranges[range_key]['total_qty'] += qty
-                ask_ranges[range_key]['price_count'][price] = qty
-            
-            top_bid_ranges = sorted(bid_ranges.items(), key=lambda x: x[1]['total_qty'], reverse=True)[:6]
-            top_ask_ranges = sorted(ask_ranges.items(), key=lambda x: x[1]['total_qty'], reverse=True)[:6]
-            
-            top_bid_ranges = sorted(top_bid_ranges, key=lambda x: x[0], reverse=True)
-            top_ask_ranges = sorted(top_ask_ranges, key=lambda x: x[0])
-            
-            self.agregar_resultado(f"{'='*50}\n", 'symbol')
-            self.agregar_resultado(f"{symbol}\n", 'symbol')
-            self.agregar_resultado(f"{'='*50}\n", 'symbol')
-            self.agregar_resultado(f"(Agrupacion: {agrupacion_manual}, TickSize: {tick})\n\n", 'info')
-            
-            self.agregar_resultado("Long Zones (Compra):\n", 'long')
-            long_shocks = []
-            for pr_range, data in top_bid_ranges[2:]:
-                precio_calculado = self.calcular_precio_segun_metodo(
-                    data['price_count'], tick, decimales_tick, agrupacion_manual
-                )
-                volumen_formateado = formatear_volumen(data['total_qty'])
-                long_shocks.append(precio_calculado)
-                
-                self.agregar_resultado(f"   Shock: ")
-                precio_str = f"{precio_calculado:.{decimales_tick}f}"
-                tag_id = f"{symbol}_long_{precio_calculado}"
-                self.agregar_resultado(precio_str, ('clickable', tag_id))
-                self.agregar_resultado(f" | Vol: {volumen_formateado}\n")
-            
-            self.agregar_resultado("\nShort Zones (Venta):\n", 'short')
-            short_shocks = []
-            for pr_range, data in top_ask_ranges[2:]:
-                precio_calculado = self.calcular_precio_segun_metodo(
-                    data['price_count'], tick, decimales_tick, agrupacion_manual
-                )
-                volumen_formateado = formatear_volumen(data['total_qty'])
-                short_shocks.append(precio_calculado)
-                
-                self.agregar_resultado(f"   Shock: ")
+    def procesar_resultados(self):
+        """En el hilo de Tk: muestra la pasada más reciente que haya dejado el hilo de análisis"""
+        analisis = None
+        try:
+            while True:
+                analisis = self.resultados.get_nowait()
+        except queue.Empty:
+            pass
+        if analisis is not None:
+            try:
+                self.renderizar(analisis)
+            except Exception as e:
+                print(f"Error mostrando resultados: {e}")
+        self.root.after(INTERVALO_RENDER_MS, self.procesar_resultados)
+    
+    def rerenderizar(self):
+        if self.ultimo_analisis is not None:
+            self.renderizar(self.ultimo_analisis)
+    
+    def fragmentos_symbol(self, resultado, metodo):
+        """Bloque de un símbolo como pares (texto, tags), todos con el tag del bloque"""
+        symbol = resultado['symbol']
+        tick = resultado['tick_size']
+        decimales_tick = decimales_por_valor(tick)
+        bloque = f"bloque_{symbol}"
+        
+        fragmentos = [
+            (f"{'='*50}\n{symbol}\n{'='*50}\n", ('symbol', bloque)),
+            (f"(Agrupacion: {resultado['agrupacion']}, TickSize: {tick})\n\n", ('info', bloque)),
+        ]
+        for tipo, titulo in (('long', "Long Zones (Compra):\n"), ('short', "\nShort Zones (Venta):\n")):
+            fragmentos.append((titulo, (tipo, bloque)))
+            for zona in resultado[tipo]:
+                precio_calculado = precio_zona(zona, metodo)
                 precio_str = f"{precio_calculado:.{decimales_tick}f}"
-                tag_id = f"{symbol}_short_{precio_calculado}"
-                self.agregar_resultado(precio_str, ('clickable', tag_id))
-                self.agregar_resultado(f" | Vol: {volumen_formateado}\n")
-            
-            self.shocks_actuales[symbol] = {'long': long_shocks, 'short': short_shocks}
-            self.agregar_resultado("\n\n")
+                tag_id = f"{symbol}_{tipo}_{precio_calculado}"
+                fragmentos.append(("   Shock: ", (bloque,)))
+                fragmentos.append((precio_str, ('clickable', tag_id, bloque)))
+                fragmentos.append((f" | Vol: {formatear_volumen(zona['volumen'])}\n", (bloque,)))
+        fragmentos.append(("\n\n", (bloque,)))
+        return fragmentos
+    
+    def renderizar(self, analisis):
+        """
+        Aplica una pasada al panel en un solo lote: cada bloque es un único
+        insert y sólo se reescriben los símbolos cuyas zonas cambiaron
+        (si cambió la lista de símbolos se rehace el panel entero).
+        """
+        self.ultimo_analisis = analisis
+        metodo = self.metodo_calculo.get()
+        nuevos = {r['symbol']: self.fragmentos_symbol(r, metodo) for r in analisis['resultados']}
+        completo = list(nuevos) != list(self.renderizado)
+        cambiados = [s for s, f in nuevos.items() if completo or self.renderizado.get(s) != f]
+        
+        cabecera = [
+            (f"=== Ultimo analisis: {analisis['timestamp']} ===\n", ('cabecera',)),
+            (f"Método: {METODOS[metodo]}", ('metodo', 'cabecera')),
+            (f" | Actualizados: {len(cambiados)} de {len(nuevos)}\n\n", ('info', 'cabecera')),
+        ]
+        if not nuevos:
+            cabecera.append(("No hay datos disponibles.\n", ('cabecera',)))
+        
+        if completo:
+            self.results_text.delete('1.0', tk.END)
+            self.borrar_tags_zonas(self.renderizado.values())
+            self.renderizado = {}
+            self.insertar(tk.END, cabecera)
+            for symbol in nuevos:
+                self.insertar(tk.END, nuevos[symbol])
+        else:
+            self.reemplazar('cabecera', cabecera)
+            for symbol in cambiados:
+                self.borrar_tags_zonas([self.renderizado[symbol]], conservar=nuevos[symbol])
+                self.reemplazar(f"bloque_{symbol}", nuevos[symbol])
+        
+        for symbol in cambiados:
+            self.renderizado[symbol] = nuevos[symbol]
+            self.marcar_seleccion(symbol)
+        for resultado in analisis['resultados']:
+            self.shocks_actuales[resultado['symbol']] = {
+                tipo: [precio_zona(z, metodo) for z in resultado[tipo]] for tipo in ('long', 'short')
+            }
+    
+    def insertar(self, indice, fragmentos):
+        self.results_text.insert(indice, *chain.from_iterable(fragmentos))
+    
+    def reemplazar(self, tag_bloque, fragmentos):
+        rangos = self.results_text.tag_ranges(tag_bloque)
+        if not rangos:
+            self.insertar(tk.END, fragmentos)
+            return
+        inicio = str(rangos[0])
+        self.results_text.delete(inicio, rangos[-1])
+        self.insertar(inicio, fragmentos)
+    
+    def borrar_tags_zonas(self, bloques, conservar=()):
+        """Los tags por precio de los bloques reemplazados (si no, se acumulan en el widget)"""
+        vigentes = {tags[1] for _, tags in conservar if 'clickable' in tags}
+        viejos = {tags[1] for fragmentos in bloques for _, tags in fragmentos if 'clickable' in tags}
+        if viejos - vigentes:
+            self.results_text.tag_delete(*(viejos - vigentes))
+    
+    def marcar_seleccion(self, symbol):
+        """Vuelve a resaltar los puntos elegidos de un bloque reescrito; los que ya no están se deseleccionan"""
+        for tipo in ('long', 'short'):
+            precio = self.seleccion.seleccionado(symbol, tipo)
+            if precio is None:
+                continue
+            tag_id = f"{symbol}_{tipo}_{precio}"
+            if self.results_text.tag_ranges(tag_id):
+                self.results_text.tag_add('selected', f"{tag_id}.first", f"{tag_id}.last")
+            else:
+                self.seleccion.alternar(symbol, tipo, precio)
 
     def on_shock_click(self, event):
         index = self.results_text.index(f"@{event.x},{event.y}")
@@ -542,17 +427,15 @@ class OrderBookAnalyzerGUI:
         tipo = parts[1]
         precio = float('_'.join(parts[2:]))
         
-        current_selection = self.shocks_seleccionados[symbol][tipo]
+        current_selection = self.seleccion.alternar(symbol, tipo, precio)
         
         if current_selection == precio:
-            self.shocks_seleccionados[symbol][tipo] = None
             self.results_text.tag_remove('selected', f"{tag_id}.first", f"{tag_id}.last")
         else:
             if current_selection is not None:
                 old_tag = f"{symbol}_{tipo}_{current_selection}"
                 self.results_text.tag_remove('selected', f"{old_tag}.first", f"{old_tag}.last")
             
-            self.shocks_seleccionados[symbol][tipo] = precio
             self.results_text.tag_add('selected', f"{tag_id}.first", f"{tag_id}.last")
             
             precio_str = f"{precio:.10f}".rstrip('0').rstrip('.')
@@ -563,46 +446,24 @@ class OrderBookAnalyzerGUI:
             except Exception as e:
                 print(f"Error al copiar al portapapeles: {e}")
     
-    def agregar_resultado(self, texto, tag=None):
-        if isinstance(tag, tuple):
-            self.results_text.insert(tk.END, texto, tag)
-        else:
-            self.results_text.insert(tk.END, texto, tag)
-        self.results_text.see(tk.END)
-        self.root.update()
-    
     def limpiar_resultados(self):
         self.results_text.delete('1.0', tk.END)
-        self.shocks_seleccionados.clear()
+        self.borrar_tags_zonas(self.renderizado.values())
+        self.renderizado = {}
+        self.ultimo_analisis = None
+        self.shocks_actuales.clear()
+        self.seleccion.limpiar()
     
     def guardar_analisis(self):
-        datos_a_guardar = []
-        
-        for symbol in self.shocks_actuales.keys():
-            long_price = self.shocks_seleccionados[symbol].get('long', None)
-            short_price = self.shocks_seleccionados[symbol].get('short', None)
-            
-            long_str = str(long_price) if long_price is not None else ""
-            short_str = str(short_price) if short_price is not None else ""
-            
-            if long_str or short_str:
-                linea = f"{symbol} {long_str} {short_str}"
-                datos_a_guardar.append(linea)
+        datos_a_guardar = self.seleccion.lineas(self.shocks_actuales.keys())
         
         if not datos_a_guardar:
             messagebox.showwarning("Advertencia", "Selecciona al menos un punto shock haciendo clic en los precios")
             return
         
-        # Guardar en archivo
-        ruta_shocks = "shocks_guardados.txt"
         try:
-            with open(ruta_shocks, "a", encoding='utf-8') as f:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                f.write(f"\n--- Analisis guardado: {timestamp} ---\n")
-                for linea in datos_a_guardar:
-                    f.write(f"{linea}\n")
-                f.write("\n")
-            messagebox.showinfo("Exito", f"Se guardaron {len(datos_a_guardar)} lineas en {ruta_shocks}")
+            guardar_shocks(datos_a_guardar, RUTA_SHOCKS)
+            messagebox.showinfo("Exito", f"Se guardaron {len(datos_a_guardar)} lineas en {RUTA_SHOCKS}")
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo guardar el archivo: {e}")
 
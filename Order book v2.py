@@ -1,173 +1,381 @@
 import websocket
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import threading
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import time
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Query, Request, WebSocket
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
 from binance.client import Client
-from collections import OrderedDict
+from libro_ordenes import LadoLibro, BufferEventos, CandadoMedido, vista_libro, decimales_tick, tick_a_precio
+from libro_ordenes import MEDIA_TYPE_BINARIO, codificar_libro, codificar_lote
+from libro_ordenes import CEROS, ConversorTicks, Retencion, cargar_json
+from agrupacion import AgregadoRangos, agrupar_niveles
+from grabacion import Grabador, leer_grabacion, leer_meta
+from metricas import Exposicion, MetricasSimbolo
+from frente_shards import GestorShards, crear_app_frente
+from memoria_compartida import PublicadorMemoria
+from checkpoints import GestorCheckpoints
+from universo import consultar_universo
+import functools
+import hashlib
+import signal
 import sys
 import io
+import os
+import math
+from typing import Optional
+import contextlib
 
 # Configurar encoding UTF-8 para Windows
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
+# ===== GRABACIÓN / REPRODUCCIÓN =====
+# OB_GRABAR_DIR: graba los mensajes y snapshots en crudo en ese directorio
+# OB_REPRODUCIR: reproduce una grabación (archivo o directorio) sin conectarse a Binance
+GRABAR_DIR = os.environ.get("OB_GRABAR_DIR")
+REPRODUCIR = os.environ.get("OB_REPRODUCIR")
+# 0 = lo más rápido posible, 1 = tiempo real, 2 = el doble de rápido...
+REPRODUCIR_VELOCIDAD = float(os.environ.get("OB_REPRODUCIR_VELOCIDAD", "0"))
+
+# ===== CONFIGURACIÓN STREAMS =====
+# URL base de los streams y de la API REST (se pueden apuntar a un servidor local de pruebas,
+# p. ej. simulador_binance.py: OB_WS_URL=ws://127.0.0.1:9000 OB_REST_URL=http://127.0.0.1:9000)
+REST_BINANCE = "https://fapi.binance.com"
+WS_BASE_URL = os.environ.get("OB_WS_URL", "wss://fstream.binance.com")
+REST_BASE_URL = os.environ.get("OB_REST_URL", REST_BINANCE)
+# Streams de profundidad por conexión combinada (Binance permite hasta 200)
+STREAMS_POR_CONEXION = int(os.environ.get("OB_STREAMS_POR_CONEXION", "50"))
+# Modo de ingesta: "hilos" (un hilo por conexión) o "async" (todo en un único event loop)
+MODO_INGESTA = os.environ.get("OB_MODO_INGESTA", "hilos")
+
+# Eventos que se guardan por símbolo mientras espera su snapshot (~100s a 100ms)
+BUFFER_MAX_EVENTOS = int(os.environ.get("OB_BUFFER_MAX_EVENTOS", "1000"))
+
+# Snapshots REST: descargas simultáneas y peso máximo por minuto (Binance permite 2400, dejamos margen)
+SNAPSHOT_CONCURRENCIA = int(os.environ.get("OB_SNAPSHOT_CONCURRENCIA", "8"))
+PESO_MAX_MINUTO = int(os.environ.get("OB_PESO_MAX_MINUTO", "2000"))
+# Límite de toda la IP: X-MBX-USED-WEIGHT-1M cuenta el peso de todos los procesos (en un shard, el del frente)
+PESO_MAX_IP = int(os.environ.get("OB_PESO_MAX_IP", str(PESO_MAX_MINUTO)))
+PESO_SNAPSHOT = 20  # Peso de /fapi/v1/depth con limit=1000
+
+# Retención de niveles lejanos (los diffs agregan niveles a cualquier precio y nadie los borra):
+# máximo de niveles por lado (0 = sin límite; el snapshot trae 1000) y distancia máxima al mid en % (0 = sin límite).
+# Desactivada por defecto: recortar cambia lo que devuelven /orderbooks y el streaming
+NIVELES_MAX = int(os.environ.get("OB_NIVELES_MAX", "0"))
+DISTANCIA_MAX_PCT = float(os.environ.get("OB_DISTANCIA_MAX_PCT", "0"))
+
+# Streaming: diffs pendientes por conexión antes de considerarla lenta y segundos máximos por envío
+STREAM_MAX_PENDIENTES = int(os.environ.get("OB_STREAM_MAX_PENDIENTES", "2000"))
+STREAM_TIMEOUT_ENVIO = 10
+
+# API REST (los workers de un modo multi-proceso escuchan en 127.0.0.1 y puertos consecutivos)
+HOST = os.environ.get("OB_HOST", "0.0.0.0")
+PUERTO = int(os.environ.get("OB_PUERTO", "8000"))
+# Procesos worker entre los que se reparten los símbolos (1 = todo en este proceso)
+SHARDS = int(os.environ.get("OB_SHARDS", "1"))
+# Universo fijo {"coins": [...], "tick_sizes": {...}}: lo recibe cada worker del frente
+UNIVERSO = os.environ.get("OB_UNIVERSO")
+
+# Filtro del universo: volumen de 24h (USDT) mínimo y precio máximo; se reevalúa cada
+# OB_UNIVERSO_INTERVALO segundos con altas y bajas en caliente (0 = universo fijo)
+VOLUMEN_MIN = float(os.environ.get("OB_VOLUMEN_MIN", "200000000"))
+PRECIO_MAX = float(os.environ.get("OB_PRECIO_MAX", "40"))
+UNIVERSO_INTERVALO = float(os.environ.get("OB_UNIVERSO_INTERVALO", "300"))
+# Un símbolo monitoreado sólo sale si su volumen baja de VOLUMEN_MIN * UNIVERSO_HISTERESIS
+UNIVERSO_HISTERESIS = 0.8
+
+# Memoria compartida para lectores locales (desactivada si no se indica directorio; en Linux: /dev/shm/orderbooks)
+MEMORIA_DIR = os.environ.get("OB_MEMORIA_DIR")
+MEMORIA_NIVELES = int(os.environ.get("OB_MEMORIA_NIVELES", "5000"))  # niveles publicados por lado (máximo)
+MEMORIA_INTERVALO = int(os.environ.get("OB_MEMORIA_INTERVALO_MS", "250")) / 1000
+
+# Checkpoints de los libros en disco para reinicios en caliente (desactivados si no se indica directorio)
+CHECKPOINT_DIR = os.environ.get("OB_CHECKPOINT_DIR")
+CHECKPOINT_INTERVALO = float(os.environ.get("OB_CHECKPOINT_INTERVALO", "30"))  # segundos
+
+# Reintentos de inicialización: 1s, 2s, 4s, 8s, 16s, 32s, 60s (max)
+MAX_REINTENTOS = 10
+BASE_DELAY = 1
+MAX_DELAY = 60
+
 # ===== CONFIGURACIÓN BINANCE =====
 api_key = ''
 api_secret = ''
-client = Client(api_key=api_key, api_secret=api_secret)
-
-# Lista final de monedas perpetuas válidas
+client = None
+
+def cliente_binance():
+    """Cliente de python-binance, creado al primer uso (importar el módulo no toca la red)"""
+    global client
+    if client is None:
+        # exchangeInfo y tickers salen de la misma API REST que los snapshots
+        client = Client(api_key=api_key, api_secret=api_secret, ping=REST_BASE_URL == REST_BINANCE)
+        client.FUTURES_URL = f"{REST_BASE_URL}/fapi"
+    return client
+
+# Monedas perpetuas monitoreadas y su tickSize: se llenan al arrancar (cargar_universo)
+# y las mantiene al día GestorUniverso
 coins = []
-
-# 1️⃣ Obtener información completa de contratos de futuros
-exchange_info = client.futures_exchange_info()
-
-# 2️⃣ Filtrar solo los contratos PERPETUAL activos en USDT
-perpetual_symbols = []
-for s in exchange_info['symbols']:
-    if (
-        s['contractType'] == 'PERPETUAL'
-        and s['quoteAsset'] == 'USDT'
-        and s['status'] == 'TRADING'  # activos
-    ):
-        perpetual_symbols.append(s['symbol'])
-
-# 3️⃣ Obtener los tickers y cruzar con los perpetuos válidos
-futures_info = client.futures_ticker()
-
-for el in futures_info:
-    symbol = el['symbol']
-    if (
-        symbol in perpetual_symbols
-        and float(el.get('quoteVolume', 0)) > 200_000_000
-        and float(el.get('lastPrice', 0)) < 40
-    ):
-        coins.append(symbol)
-
-print(f"✅ Se encontraron {len(coins)} monedas de Futuros PERPETUOS válidas:")
-print(coins)
-
-# Estructura mejorada para los libros de órdenes
-order_books = {
-    symbol: {
-        "bids": OrderedDict(),
-        "asks": OrderedDict(),
+tick_sizes = {}
+
+def universo_inicial():
+    """(coins, tick_sizes) de arranque: grabación, universo fijo del frente o filtro sobre Binance"""
+    if REPRODUCIR:
+        # Universo y tickSizes tal como estaban al grabar
+        return leer_meta(REPRODUCIR)
+    if UNIVERSO:
+        # Worker de un shard: sus símbolos ya vienen filtrados por el frente
+        universo = json.loads(UNIVERSO)
+        return universo["coins"], universo["tick_sizes"]
+    return consultar_universo(cliente_binance(), VOLUMEN_MIN, PRECIO_MAX)
+
+def nuevo_candado():
+    """Lock por símbolo (no-op en modo async: todo corre en el mismo event loop)"""
+    return contextlib.nullcontext() if MODO_INGESTA == "async" else CandadoMedido()
+
+def nuevo_libro(symbol):
+    """Estructura de un libro de órdenes; bids/asks ordenados por tick entero (ver libro_ordenes.LadoLibro)"""
+    tick_size = tick_sizes.get(symbol, 0.01)
+    return {
+        "bids": LadoLibro(es_bid=True),
+        "asks": LadoLibro(es_bid=False),
+        "tick_size": tick_size,
+        "decimales": decimales_tick(tick_size),
+        "a_tick": ConversorTicks(tick_size),  # precio (str) -> tick con caché
         "lastUpdateId": None,
-        "buffer": [],
+        "buffer": BufferEventos(BUFFER_MAX_EVENTOS),
         "initialized": False,
         "last_u": None,
         "retry_count": 0,  # Para retry exponencial
-        "first_event_after_snapshot": True  # Bandera para el primer evento
-    } for symbol in coins
-}
-order_book_lock = threading.Lock()
+        "first_event_after_snapshot": True,  # Bandera para el primer evento
+        "reanudable": False,  # Cargado de un checkpoint: espera un evento que encadene con last_u
+        # Concurrencia: cada símbolo tiene su propio lock; los lectores usan
+        # la vista inmutable de la versión actual (libro_ordenes.vista_libro)
+        "lock": nuevo_candado(),
+        "version": 0,
+        "vista": None,
+        "agrupados": {},  # step -> rangos cacheados para una versión del libro
+        "agregados": {},  # step registrado -> (AgregadoRangos bids, AgregadoRangos asks)
+        "metricas": MetricasSimbolo(),
+    }
 
-print(f"Monedas de futuros monitoreadas: {coins}")
+def stream_depth(symbol):
+    return f"{symbol.lower()}@depth@100ms"
+
+order_books = {}
+
+# Nombre de stream -> símbolo, precalculado para no partir el string en cada mensaje
+simbolo_por_stream = {}
+
+retencion = Retencion(NIVELES_MAX, DISTANCIA_MAX_PCT / 100) if NIVELES_MAX or DISTANCIA_MAX_PCT else None
+
+# Tareas lanzadas en modo async (referencia fuerte para que no las recoja el GC)
+tareas_async = set()
+
+grabador = Grabador(GRABAR_DIR) if GRABAR_DIR else None
+
+publicador = PublicadorMemoria(MEMORIA_DIR, order_books, vista_libro, MEMORIA_NIVELES) if MEMORIA_DIR else None
+
+# Cada worker de un shard escribe su propio archivo (al cargar se leen todos los del directorio)
+checkpoints = None
+if CHECKPOINT_DIR and not REPRODUCIR:
+    checkpoints = GestorCheckpoints(CHECKPOINT_DIR, os.environ.get("OB_SHARD_ID", "0"), order_books, vista_libro)
+
+def aplicar_universo(nuevos, nuevos_tick_sizes):
+    """
+    Lleva coins/tick_sizes/order_books al universo dado. Devuelve
+    (agregados, quitados, recreados); recreados son los símbolos cuyo
+    tickSize cambió (otra escala de ticks: el libro empieza de cero).
+    Las conexiones y los snapshots los maneja quien llama.
+    """
+    actuales = set(coins)
+    conjunto = set(nuevos)
+    agregados = [symbol for symbol in nuevos if symbol not in actuales]
+    quitados = [symbol for symbol in coins if symbol not in conjunto]
+    recreados = [
+        symbol for symbol in nuevos
+        if symbol in actuales and nuevos_tick_sizes.get(symbol, 0.01) != order_books[symbol]['tick_size']
+    ]
+
+    for symbol in quitados:
+        # Primero el stream: los mensajes que sigan llegando se ignoran
+        simbolo_por_stream.pop(stream_depth(symbol), None)
+        order_books.pop(symbol, None)
+        tick_sizes.pop(symbol, None)
+        if publicador is not None:
+            publicador.retirar(symbol)
+        # Los suscriptores de /ws reciben la baja del símbolo
+        difusor.reiniciar(symbol)
+
+    tick_sizes.update({symbol: nuevos_tick_sizes[symbol] for symbol in nuevos if symbol in nuevos_tick_sizes})
+    for symbol in agregados + recreados:
+        order_books[symbol] = nuevo_libro(symbol)
+        simbolo_por_stream[stream_depth(symbol)] = symbol
+
+    cambio = coins != list(nuevos) or recreados
+    coins[:] = nuevos
+    if grabador is not None and cambio:
+        grabador.universo(coins, tick_sizes)
+    return agregados, quitados, recreados
+
+def cargar_universo(nuevos, nuevos_tick_sizes):
+    aplicar_universo(nuevos, nuevos_tick_sizes)
+    print(f"✅ Se encontraron {len(coins)} monedas de Futuros PERPETUOS válidas:")
+    print(coins)
 
 # ===== FUNCIONES DE ORDEN BOOK =====
-def get_order_book_snapshot(symbol):
-    url = f"https://fapi.binance.com/fapi/v1/depth?symbol={symbol}&limit=1000"
-    response = requests.get(url)
-    return response.json()
-
 def process_buffer(symbol):
     """Procesa el buffer de eventos después de cargar el snapshot"""
-    with order_book_lock:
-        book = order_books[symbol]
+    book = order_books[symbol]
+    with book['lock']:
         lastUpdateId = book['lastUpdateId']
+        buffer = book['buffer']
 
         # Paso 4: Descartar eventos donde u < lastUpdateId
-        book['buffer'] = [e for e in book['buffer'] if e['u'] >= lastUpdateId]
+        buffer.descartar_hasta(lastUpdateId)
 
         # Paso 5: El primer evento debe tener U <= lastUpdateId AND u >= lastUpdateId
-        if not book['buffer']:
+        if not buffer:
             # Buffer vacío es normal en monedas de bajo volumen
             # Simplemente marcamos como inicializado y esperamos el siguiente evento
+            book['first_event_after_snapshot'] = True
             book['initialized'] = True
             book['last_u'] = lastUpdateId
+            difusor.reiniciar(symbol)
             print(f"✅ Order book inicializado (esperando eventos): {symbol}")
             return True
 
-        first_event = book['buffer'][0]
+        first_event = buffer.primero()
         if not (first_event['U'] <= lastUpdateId <= first_event['u']):
             print(f"⚠️ Secuencia incorrecta para {symbol}. U={first_event['U']}, u={first_event['u']}, lastUpdateId={lastUpdateId}")
             return False
 
-        # Procesar todos los eventos del buffer
-        for event in book['buffer']:
+        # Procesar todos los eventos del buffer (los siguientes al primero encadenados por pu)
+        apply_order_book_update(symbol, first_event)
+        for event in list(buffer)[1:]:
+            if event['pu'] != book['last_u']:
+                print(f"⚠️ Discontinuidad en el buffer de {symbol}. Esperado pu={book['last_u']}, recibido pu={event['pu']}")
+                return False
             apply_order_book_update(symbol, event)
 
-        book['buffer'] = []
+        # Los eventos en vivo ya se validan por pu contra last_u
+        buffer.clear()
+        book['first_event_after_snapshot'] = False
         book['initialized'] = True
+        difusor.reiniciar(symbol)
         print(f"✅ Order book inicializado correctamente: {symbol}")
         return True
 
 def apply_order_book_update(symbol, data):
-    """Aplica una actualización al order book"""
+    """Aplica una actualización al order book (qty 0 elimina el nivel)"""
     book = order_books[symbol]
-
-    # Actualizar bids
-    for price, qty in data['b']:
-        price_str = price
-        qty_float = float(qty)
-        if qty_float == 0:
-            book['bids'].pop(price_str, None)
-        else:
-            book['bids'][price_str] = qty
-
-    # Actualizar asks
-    for price, qty in data['a']:
-        price_str = price
-        qty_float = float(qty)
-        if qty_float == 0:
-            book['asks'].pop(price_str, None)
-        else:
-            book['asks'][price_str] = qty
+    a_tick = book['a_tick']
+
+    bids, asks = book['bids'], book['asks']
+    agregados = book['agregados']
+
+    if not agregados:
+        # Actualizar bids (los ceros se detectan sobre el string, sin convertir)
+        for price, qty in data['b']:
+            bids.actualizar(a_tick(price), 0.0 if qty in CEROS else float(qty))
+
+        # Actualizar asks
+        for price, qty in data['a']:
+            asks.actualizar(a_tick(price), 0.0 if qty in CEROS else float(qty))
+    else:
+        # Con steps registrados también se actualizan las sumas por rango
+        agregados = agregados.values()
+        for price, qty in data['b']:
+            tick, qty = a_tick(price), 0.0 if qty in CEROS else float(qty)
+            anterior = bids.actualizar(tick, qty)
+            for ag_bids, _ in agregados:
+                ag_bids.aplicar(tick, anterior, qty)
+        for price, qty in data['a']:
+            tick, qty = a_tick(price), 0.0 if qty in CEROS else float(qty)
+            anterior = asks.actualizar(tick, qty)
+            for _, ag_asks in agregados:
+                ag_asks.aplicar(tick, anterior, qty)
+
+    if retencion is not None:
+        recortar_lejanos(book)
 
     # Actualizar last_u para verificación de continuidad
     book['last_u'] = data['u']
+    book['version'] += 1
+
+def recortar_lejanos(book):
+    """Aplica la política de retención y descuenta de los agregados los niveles eliminados"""
+    eliminados_bids, eliminados_asks = retencion.recortar(book['bids'], book['asks'])
+    if eliminados_bids or eliminados_asks:
+        book['metricas'].recortados += len(eliminados_bids) + len(eliminados_asks)
+        for ag_bids, ag_asks in book['agregados'].values():
+            for tick, qty in eliminados_bids:
+                ag_bids.aplicar(tick, qty, 0.0)
+            for tick, qty in eliminados_asks:
+                ag_asks.aplicar(tick, qty, 0.0)
+
+def aplicar_evento(symbol, book, data):
+    """Aplica un evento ya validado, mide su duración y latencia y lo reparte al streaming"""
+    metricas = book['metricas']
+    t0 = time.perf_counter()
+    apply_order_book_update(symbol, data)
+    metricas.aplicacion.observar(time.perf_counter() - t0)
+    # Latencia de punta a punta: hora del evento en Binance (E, ms) -> aplicado
+    metricas.latencia.observar(time.time() - data['E'] / 1000)
+    difusor.publicar(symbol, data)
 
 def on_message_combined(ws, message):
     """Maneja mensajes de streams combinados"""
     try:
-        parsed = json.loads(message)
+        if grabador is not None:
+            grabador.mensaje(message)
+        parsed = cargar_json(message)
 
-        # Extraer símbolo del stream name: "btcusdt@depth@100ms" -> "BTCUSDT"
-        if 'stream' not in parsed:
-            return
+        # Símbolo a partir del stream name: "btcusdt@depth@100ms" -> "BTCUSDT"
+        symbol = simbolo_por_stream.get(parsed.get('stream'))
+        if symbol is None:
+            return  # Respuestas a SUBSCRIBE/UNSUBSCRIBE o símbolos ya quitados del universo
 
-        stream_name = parsed['stream']
         data = parsed['data']
-        symbol = stream_name.split('@')[0].upper()
-
-        with order_book_lock:
-            if symbol not in order_books:
-                return
+        book = order_books.get(symbol)
+        if book is None:
+            return
 
-            book = order_books[symbol]
+        with book['lock']:
+            book['metricas'].mensajes += 1
 
-            # Si no está inicializado, agregar al buffer (optimizado: consolidar eventos)
+            # Si no está inicializado, agregar al buffer acotado (O(1), descarta el más antiguo si se llena)
             if not book['initialized']:
-                # Optimización: Si ya existe un evento que cubre este rango, eliminarlo
-                # Según Binance: "Por el mismo precio, la última actualización cubre la anterior"
-                book['buffer'] = [e for e in book['buffer'] if not (e['u'] < data['U'])]
-                book['buffer'].append(data)
+                if book['reanudable']:
+                    # Primer evento tras cargar el checkpoint: sólo sirve si lo continúa exactamente
+                    book['reanudable'] = False
+                    if data['pu'] == book['last_u']:
+                        reanudar_checkpoint(symbol, book, data)
+                        return
+                buffer = book['buffer']
+                desbordado = buffer.desbordado
+                if buffer.agregar(data) and not desbordado:
+                    # Se perdieron eventos: el snapshot pedido (si lo hay) ya no enlaza, se pide otro
+                    print(f"⚠️ Buffer desbordado en {symbol} ({buffer.capacidad} eventos), solicitando resync")
+                    solicitar_resync(symbol)
                 return
 
             # Paso 6: Verificar continuidad (pu debe ser igual al u anterior)
             # Excepción: El primer evento después del snapshot puede tener pu < lastUpdateId
             if book['first_event_after_snapshot']:
                 # Primer evento: validar que U <= lastUpdateId <= u (según docs Binance)
-                if data['U'] <= book['lastUpdateId'] <= data['u']:
+                # o que continúe exactamente el snapshot (pu == lastUpdateId)
+                if data['U'] <= book['lastUpdateId'] <= data['u'] or data['pu'] == book['lastUpdateId']:
                     # Evento válido, procesar y desactivar bandera
                     book['first_event_after_snapshot'] = False
-                    apply_order_book_update(symbol, data)
+                    aplicar_evento(symbol, book, data)
                     return
                 elif data['u'] < book['lastUpdateId']:
                     # Evento antiguo, ignorar
@@ -176,8 +384,9 @@ def on_message_combined(ws, message):
                     # Evento no cubre el lastUpdateId, puede ser discontinuidad
                     print(f"⚠️ Primer evento no cubre lastUpdateId en {symbol}. U={data['U']}, u={data['u']}, lastUpdateId={book['lastUpdateId']}")
                     book['initialized'] = False
-                    book['buffer'] = [data]
-                    threading.Thread(target=reinitialize_symbol, args=(symbol,), daemon=True).start()
+                    book['buffer'].clear()
+                    book['buffer'].agregar(data)
+                    solicitar_resync(symbol)
                     return
 
             # Validación normal de continuidad para eventos subsecuentes
@@ -186,239 +395,1468 @@ def on_message_combined(ws, message):
                 # Reiniciar el proceso
                 book['initialized'] = False
                 book['first_event_after_snapshot'] = True
-                book['buffer'] = [data]
-                threading.Thread(target=reinitialize_symbol, args=(symbol,), daemon=True).start()
+                book['buffer'].clear()
+                book['buffer'].agregar(data)
+                solicitar_resync(symbol)
                 return
 
-            # Aplicar la actualización
-            apply_order_book_update(symbol, data)
+            # Aplicar la actualización y repartirla a los suscriptores de streaming
+            aplicar_evento(symbol, book, data)
 
     except Exception as e:
         print(f"💥 Error procesando mensaje: {e}")
 
-def reinitialize_symbol(symbol):
-    """Reinicializa el order book de un símbolo"""
+def solicitar_resync(symbol):
+    """Pide un nuevo snapshot para el símbolo (deduplicado por el programador)"""
     print(f"🔄 Reinicializando {symbol}...")
-    time.sleep(1)  # Esperar un poco antes de reinicializar
-    initialize_order_book(symbol)
-
-def initialize_order_book(symbol, retry_count=0):
-    """Inicializa el order book con snapshot y procesa buffer con retry exponencial"""
-    max_retries = 10
-    base_delay = 1
-    max_delay = 60
-
-    try:
-        # Esperar un poco para acumular eventos en el buffer
-        time.sleep(3)
-
-        # Paso 3: Obtener snapshot
-        snap = get_order_book_snapshot(symbol)
-
-        with order_book_lock:
-            book = order_books[symbol]
-
-            # Limpiar order book
-            book['bids'].clear()
-            book['asks'].clear()
-
-            # Cargar snapshot
-            for bid in snap['bids']:
-                book['bids'][bid[0]] = bid[1]
-            for ask in snap['asks']:
-                book['asks'][ask[0]] = ask[1]
-
-            book['lastUpdateId'] = snap['lastUpdateId']
-            book['retry_count'] = 0  # Reset en caso de éxito
-            print(f"📸 Snapshot cargado para {symbol} (lastUpdateId: {snap['lastUpdateId']}, buffer: {len(book['buffer'])} eventos)")
-
-        # Procesar buffer
-        if not process_buffer(symbol):
-            # Si falla, reintentar con backoff exponencial
-            if retry_count < max_retries:
-                delay = min(base_delay * (2 ** retry_count), max_delay)
-                print(f"🔄 Reintentando inicialización de {symbol} en {delay}s (intento {retry_count + 1}/{max_retries})...")
-                time.sleep(delay)
-                initialize_order_book(symbol, retry_count + 1)
-            else:
-                print(f"❌ Máximo de reintentos alcanzado para {symbol}")
+    order_books[symbol]['metricas'].resyncs += 1
+    programador.solicitar(symbol, espera=1)  # Esperar un poco antes de reinicializar
+
+def reemplazar_niveles(book, bids, asks):
+    """Reemplaza los niveles (tick, qty) del libro y reconstruye los agregados (con el lock tomado)"""
+    book['bids'].clear()
+    book['asks'].clear()
+    for tick, qty in bids:
+        book['bids'].actualizar(tick, qty)
+    for tick, qty in asks:
+        book['asks'].actualizar(tick, qty)
+    if retencion is not None:
+        retencion.recortar(book['bids'], book['asks'])
+
+    for ag_bids, ag_asks in book['agregados'].values():
+        ag_bids.reconstruir(book['bids'].items())
+        ag_asks.reconstruir(book['asks'].items())
+    book['version'] += 1
+
+def cargar_snapshot(symbol, snap):
+    """Reemplaza el contenido del libro por el snapshot REST (paso 3)"""
+    book = order_books[symbol]
+    with book['lock']:
+        a_tick = book['a_tick']
+        reemplazar_niveles(
+            book,
+            ((a_tick(price), float(qty)) for price, qty in snap['bids']),
+            ((a_tick(price), float(qty)) for price, qty in snap['asks']),
+        )
+        book['lastUpdateId'] = snap['lastUpdateId']
+        book['reanudable'] = False
+        book['retry_count'] = 0  # Reset en caso de éxito
+        print(f"📸 Snapshot cargado para {symbol} (lastUpdateId: {snap['lastUpdateId']}, buffer: {len(book['buffer'])} eventos)")
+
+def cargar_checkpoints():
+    """Carga los libros del último checkpoint; quedan sin inicializar hasta que el stream encadene"""
+    cargados = 0
+    for symbol, (libro, antiguedad) in checkpoints.cargar().items():
+        book = order_books.get(symbol)
+        # Un tickSize distinto cambia la escala de los ticks: ese checkpoint no sirve
+        if book is None or libro['last_u'] is None or libro['tick_size'] != book['tick_size']:
+            continue
+        with book['lock']:
+            reemplazar_niveles(
+                book,
+                zip(libro['bids_ticks'].tolist(), libro['bids_qty'].tolist()),
+                zip(libro['asks_ticks'].tolist(), libro['asks_qty'].tolist()),
+            )
+            book['lastUpdateId'] = libro['lastUpdateId']
+            book['last_u'] = libro['last_u']
+            book['reanudable'] = True
+        cargados += 1
+    print(f"💾 {cargados}/{len(coins)} libros cargados de checkpoints en {CHECKPOINT_DIR}")
+
+def reanudar_checkpoint(symbol, book, data):
+    """El stream continúa exactamente el checkpoint: se inicializa sin snapshot REST (con el lock tomado)"""
+    book['buffer'].clear()
+    book['first_event_after_snapshot'] = False
+    book['initialized'] = True
+    aplicar_evento(symbol, book, data)
+    difusor.reiniciar(symbol)
+    print(f"♻️ Order book reanudado desde checkpoint: {symbol} (last_u: {data['pu']})")
+
+def total_resyncs():
+    return sum(book['metricas'].resyncs for book in list(order_books.values()))
+
+def snapshot_recibido(symbol, contenido):
+    """Cuerpo crudo de /fapi/v1/depth: se graba (si corresponde) y se procesa"""
+    if grabador is not None:
+        grabador.snapshot(symbol, contenido)
+    return procesar_snapshot(symbol, cargar_json(contenido))
+
+def procesar_snapshot(symbol, snap):
+    """Carga el snapshot y procesa el buffer (pasos 3-5). Devuelve True si quedó inicializado"""
+    cargar_snapshot(symbol, snap)
+    return process_buffer(symbol)
+
+def delay_reintento(symbol, retry_count):
+    """Backoff exponencial; sin espera si el buffer se desbordó (hay que resincronizar ya)"""
+    buffer = order_books[symbol]['buffer']
+    if buffer.desbordado:
+        buffer.desbordado = False
+        print(f"⚠️ Buffer desbordado en {symbol} ({buffer.descartados} eventos descartados), forzando resync inmediato")
+        return 0
+    return min(BASE_DELAY * (2 ** retry_count), MAX_DELAY)
+
+# ===== SNAPSHOTS REST =====
+class CuboTokens:
+    """
+    Token bucket del peso de peticiones REST de Binance (límite por minuto).
+    reservar() descuenta el peso y devuelve cuánto hay que esperar antes de
+    usarlo, así sirve igual para hilos (time.sleep) y para asyncio.
+    """
+
+    def __init__(self, peso_por_minuto, peso_max_ip=None):
+        self.capacidad = peso_por_minuto
+        self.peso_max_ip = peso_max_ip or peso_por_minuto
+        self.por_segundo = peso_por_minuto / 60
+        self.tokens = peso_por_minuto
+        self.ultimo = time.monotonic()
+        self.pausa_hasta = 0.0
+        self.lock = threading.Lock()
+
+    def _rellenar(self, ahora):
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.por_segundo)
+        self.ultimo = ahora
+
+    def reservar(self, peso):
+        with self.lock:
+            ahora = time.monotonic()
+            self._rellenar(ahora)
+            self.tokens -= peso  # Puede quedar en negativo: es la espera acumulada
+            return max(0.0, -self.tokens / self.por_segundo, self.pausa_hasta - ahora)
+
+    def sincronizar(self, peso_usado):
+        """
+        Ajusta los tokens con el peso que informa Binance (X-MBX-USED-WEIGHT-1M).
+        El header es de toda la IP: a este cubo le toca su parte de lo que le queda.
+        """
+        with self.lock:
+            self._rellenar(time.monotonic())
+            disponible_ip = self.peso_max_ip - peso_usado
+            self.tokens = min(self.tokens, disponible_ip * self.capacidad / self.peso_max_ip)
+
+    def pausar(self, segundos):
+        """Bloquea nuevas peticiones durante 'segundos' (HTTP 429/418)"""
+        with self.lock:
+            self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + segundos)
+
+class ProgramadorSnapshots:
+    """
+    Programador central de snapshots REST:
+    - Pool de conexiones keep-alive (requests.Session)
+    - Máximo SNAPSHOT_CONCURRENCIA descargas simultáneas
+    - Token bucket con el peso de Binance (depth limit=1000 pesa PESO_SNAPSHOT)
+    - Deduplicado por símbolo: un símbolo en cola o en curso no se vuelve a encolar
+
+    Un hilo despachador saca de una cola con prioridad por hora de ejecución
+    (espera inicial y reintentos con backoff) y entrega a un pool fijo de hilos.
+    """
+
+    def __init__(self, concurrencia=SNAPSHOT_CONCURRENCIA, peso_por_minuto=PESO_MAX_MINUTO):
+        self.concurrencia = concurrencia
+        self.cubo = CuboTokens(peso_por_minuto, PESO_MAX_IP)
+        self.activos = set()  # Símbolos en cola o descargándose
+        self.cond = threading.Condition()
+        self.cola = []  # heap de (listo_en, symbol, intento)
+        self.slots = threading.Semaphore(concurrencia)
+        self.pool = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrencia)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def iniciar(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="snapshot")
+        threading.Thread(target=self.despachar, daemon=True).start()
+
+    def solicitar(self, symbol, espera=0.0):
+        """Encola un snapshot; devuelve False si el símbolo ya estaba en cola o en curso"""
+        with self.cond:
+            if symbol in self.activos:
+                return False
+            self.activos.add(symbol)
+            self._encolar(symbol, espera, 0)
+        return True
 
-    except Exception as e:
-        if retry_count < max_retries:
-            # Retry exponencial: 1s, 2s, 4s, 8s, 16s, 32s, 60s (max)
-            delay = min(base_delay * (2 ** retry_count), max_delay)
+    def pendientes(self):
+        return len(self.activos)
+
+    def _encolar(self, symbol, espera, intento):
+        heapq.heappush(self.cola, (time.monotonic() + espera, symbol, intento))
+        self.cond.notify()
+
+    def despachar(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.cola:
+                        self.cond.wait()
+                        continue
+                    espera = self.cola[0][0] - time.monotonic()
+                    if espera <= 0:
+                        break
+                    self.cond.wait(espera)
+                _, symbol, intento = heapq.heappop(self.cola)
+                if symbol not in order_books:
+                    # Salió del universo mientras esperaba en la cola
+                    self.activos.discard(symbol)
+                    continue
+
+            self.slots.acquire()
+            time.sleep(self.cubo.reservar(PESO_SNAPSHOT))
+            self.pool.submit(self.ejecutar, symbol, intento)
+
+    def ejecutar(self, symbol, intento):
+        ok, delay = False, None
+        try:
+            url = f"{REST_BASE_URL}/fapi/v1/depth?symbol={symbol}&limit=1000"
+            t0 = time.perf_counter()
+            response = self.session.get(url, timeout=10)
+            order_books[symbol]['metricas'].snapshot.observar(time.perf_counter() - t0)
+            self.registrar_respuesta(response.status_code, response.headers)
+            response.raise_for_status()
+            ok = snapshot_recibido(symbol, response.content)
+            if not ok:
+                delay = delay_reintento(symbol, intento)
+        except Exception as e:
             print(f"💥 Error inicializando {symbol}: {e}")
-            print(f"🔄 Reintentando en {delay}s (intento {retry_count + 1}/{max_retries})...")
-            time.sleep(delay)
-            initialize_order_book(symbol, retry_count + 1)
-        else:
-            print(f"❌ Error crítico en {symbol} después de {max_retries} intentos: {e}")
+            delay = min(BASE_DELAY * (2 ** intento), MAX_DELAY)
+        finally:
+            self.slots.release()
+
+        with self.cond:
+            espera = self.reprogramar(symbol, intento, ok, delay)
+            if espera is not None:
+                self._encolar(symbol, espera, intento + 1)
+
+    def registrar_respuesta(self, status_code, headers):
+        """Sincroniza el token bucket con los headers de peso y los rechazos por límite"""
+        usado = headers.get('X-MBX-USED-WEIGHT-1M')
+        if usado is not None:
+            self.cubo.sincronizar(int(usado))
+        if status_code in (418, 429):
+            segundos = int(headers.get('Retry-After', 60))
+            print(f"🚫 Límite de peso de Binance alcanzado (HTTP {status_code}), pausando snapshots {segundos}s")
+            self.cubo.pausar(segundos)
+
+    def reprogramar(self, symbol, intento, ok, delay):
+        """Devuelve la espera para el siguiente intento o None si el símbolo terminó"""
+        if ok or symbol not in order_books:
+            self.activos.discard(symbol)
+            return None
+        if intento >= MAX_REINTENTOS:
+            print(f"❌ Máximo de reintentos alcanzado para {symbol}")
+            self.activos.discard(symbol)
+            return None
+        print(f"🔄 Reintentando inicialización de {symbol} en {delay}s (intento {intento + 1}/{MAX_REINTENTOS})...")
+        return delay
+
+class ProgramadorSnapshotsAsync(ProgramadorSnapshots):
+    """Versión async: una tarea por símbolo, httpx.AsyncClient compartido y asyncio.Semaphore"""
+
+    def __init__(self, concurrencia=SNAPSHOT_CONCURRENCIA, peso_por_minuto=PESO_MAX_MINUTO):
+        self.concurrencia = concurrencia
+        self.cubo = CuboTokens(peso_por_minuto, PESO_MAX_IP)
+        self.activos = set()  # Sólo se toca desde el event loop
+        self.slots = None
+        self.cliente = None
+
+    def iniciar(self):
+        """Debe llamarse desde el event loop"""
+        import httpx
+
+        self.slots = asyncio.Semaphore(self.concurrencia)
+        limites = httpx.Limits(max_connections=self.concurrencia, max_keepalive_connections=self.concurrencia)
+        self.cliente = httpx.AsyncClient(timeout=10, limits=limites)
+
+    def solicitar(self, symbol, espera=0.0):
+        if symbol in self.activos:
+            return False
+        self.activos.add(symbol)
+        lanzar_tarea(self.ejecutar_async(symbol, espera))
+        return True
 
-def start_individual_websockets():
-    """Inicia WebSockets individuales para cada símbolo"""
-    print(f"🚀 Iniciando WebSockets individuales para {len(coins)} símbolos...")
+    async def ejecutar_async(self, symbol, espera):
+        intento = 0
+        while True:
+            await asyncio.sleep(espera)
+            if symbol not in order_books:
+                # Salió del universo mientras esperaba
+                self.activos.discard(symbol)
+                return
+            ok, delay = False, None
+            async with self.slots:
+                await asyncio.sleep(self.cubo.reservar(PESO_SNAPSHOT))
+                try:
+                    url = f"{REST_BASE_URL}/fapi/v1/depth?symbol={symbol}&limit=1000"
+                    t0 = time.perf_counter()
+                    response = await self.cliente.get(url)
+                    order_books[symbol]['metricas'].snapshot.observar(time.perf_counter() - t0)
+                    self.registrar_respuesta(response.status_code, response.headers)
+                    response.raise_for_status()
+                    ok = snapshot_recibido(symbol, response.content)
+                    if not ok:
+                        delay = delay_reintento(symbol, intento)
+                except Exception as e:
+                    print(f"💥 Error inicializando {symbol}: {e}")
+                    delay = min(BASE_DELAY * (2 ** intento), MAX_DELAY)
+
+            espera = self.reprogramar(symbol, intento, ok, delay)
+            if espera is None:
+                return
+            intento += 1
+
+# ===== MODO ASYNC =====
+# Streams, snapshots REST y la API comparten un único event loop (OB_MODO_INGESTA=async).
+# Requiere: pip install websockets httpx
+def lanzar_tarea(coro):
+    """Crea una tarea en el event loop actual y conserva su referencia"""
+    tarea = asyncio.get_running_loop().create_task(coro)
+    tareas_async.add(tarea)
+    tarea.add_done_callback(tareas_async.discard)
+    return tarea
+
+programador = ProgramadorSnapshotsAsync() if MODO_INGESTA == "async" else ProgramadorSnapshots()
+
+class GestorConexiones:
+    """
+    Agrupa todos los símbolos en pocas conexiones de streams combinados:
+    /stream?streams=a@depth@100ms/b@depth@100ms/...
+
+    Cada conexión corre en su propio hilo y se reconecta por separado. Al caer
+    una conexión sólo se resincronizan los símbolos que viajaban en ella.
+    Los símbolos que entran o salen del universo se suscriben o desuscriben
+    en la conexión abierta (SUBSCRIBE/UNSUBSCRIBE), sin reconectar.
+    """
+
+    def __init__(self, symbols, streams_por_conexion=STREAMS_POR_CONEXION, base_url=WS_BASE_URL):
+        self.base_url = base_url.rstrip('/')
+        self.streams_por_conexion = streams_por_conexion
+        self.grupos = [
+            symbols[i:i + streams_por_conexion]
+            for i in range(0, len(symbols), streams_por_conexion)
+        ]
+        self.conexiones = {}  # índice de grupo -> WebSocketApp activo
+        self.suscritos = {}   # índice de grupo -> streams de la conexión abierta
+        self.activas = set()  # grupos con su hilo/tarea de conexión corriendo
+        self.asincrono = False
+        self.siguiente_id = 0
+        self.lock = threading.Lock()
+
+    def url_grupo(self, idx):
+        """URL del grupo tal como está ahora y los streams que incluye"""
+        with self.lock:
+            streams = [stream_depth(symbol) for symbol in self.grupos[idx]]
+        return f"{self.base_url}/stream?streams={'/'.join(streams)}", set(streams)
+
+    def iniciar(self):
+        """Lanza un hilo por conexión combinada"""
+        print(f"🚀 Iniciando {len(self.grupos)} conexiones combinadas para {sum(map(len, self.grupos))} símbolos...")
+        for idx in range(len(self.grupos)):
+            self.activas.add(idx)
+            self.lanzar(idx)
+            time.sleep(0.1)  # Pequeña pausa para evitar sobrecarga al inicio
+
+    def lanzar(self, idx):
+        if self.asincrono:
+            lanzar_tarea(self.run_conexion_async(idx))
+        else:
+            threading.Thread(target=self.run_conexion, args=(idx,), daemon=True).start()
+
+    def terminar_si_vacio(self, idx):
+        """El grupo se quedó sin símbolos: la conexión no se reabre (agregar() la relanza)"""
+        with self.lock:
+            if self.grupos[idx]:
+                return False
+            self.activas.discard(idx)
+        print(f"🔌 [WS {idx + 1}/{len(self.grupos)}] Sin símbolos, conexión cerrada", flush=True)
+        return True
 
-    for symbol in coins:
-        threading.Thread(
-            target=run_individual_websocket,
-            args=(symbol,),
-            daemon=True
-        ).start()
-        time.sleep(0.1)  # Pequeña pausa para evitar sobrecarga al inicio
+    def run_conexion(self, idx):
+        """Mantiene viva la conexión combinada idx, reconectando cuando se cae"""
+        etiqueta = f"WS {idx + 1}/{len(self.grupos)}"
+        conexion_numero = 0
+
+        while not self.terminar_si_vacio(idx):
+            conexion_numero += 1
+            try:
+                url, streams = self.url_grupo(idx)
+                if conexion_numero == 1:
+                    print(f"🔌 [{etiqueta}] Iniciando WebSocket con {len(streams)} streams...", flush=True)
+                else:
+                    print(f"🔄 [{etiqueta}] Reconectando WebSocket (intento #{conexion_numero})...", flush=True)
+
+                def on_open_handler(_, reconexion=conexion_numero > 1, streams=streams):
+                    print(f"✅ [{etiqueta}] WebSocket conectado exitosamente", flush=True)
+                    with self.lock:
+                        self.suscritos[idx] = streams
+                    # Altas o bajas que llegaron mientras se conectaba
+                    self.sincronizar(idx)
+                    if reconexion:
+                        # Resincronizar sólo los símbolos de esta conexión
+                        self.resincronizar_grupo(idx)
+
+                def on_error_handler(_, error):
+                    print(f"⚠️ [{etiqueta}] Error WS: {error}", flush=True)
+
+                def on_close_handler(*args):
+                    close_code = args[1] if len(args) > 1 else 'N/A'
+                    print(f"❌ [{etiqueta}] WebSocket desconectado (código: {close_code})", flush=True)
+
+                ws = websocket.WebSocketApp(
+                    url,
+                    on_open=on_open_handler,
+                    on_message=on_message_combined,
+                    on_error=on_error_handler,
+                    on_close=on_close_handler,
+                )
+                self.conexiones[idx] = ws
+                # Sin ping/pong - Binance maneja keep-alive automáticamente
+                ws.run_forever()
+            except Exception as e:
+                print(f"💥 [{etiqueta}] Excepción en WebSocket: {e}")
+
+            with self.lock:
+                self.suscritos.pop(idx, None)
+            if self.terminar_si_vacio(idx):
+                return
 
-def run_individual_websocket(symbol):
-    """Ejecuta un WebSocket individual para un símbolo específico"""
-    conexion_numero = 0
+            # Marcar los símbolos de esta conexión como no inicializados
+            self.marcar_grupo_no_inicializado(idx)
+
+            print(f"⏳ [{etiqueta}] Esperando 5 segundos antes de reconectar...", flush=True)
+            time.sleep(5)
+
+    def resincronizar_grupo(self, idx):
+        """Pide snapshot para cada símbolo de la conexión idx (el programador limita el ritmo)"""
+        grupo = list(self.grupos[idx])
+        print(f"🔄 [WS {idx + 1}/{len(self.grupos)}] Solicitando snapshots de {len(grupo)} símbolos...", flush=True)
+        for symbol in grupo:
+            programador.solicitar(symbol, espera=1)
+
+    def marcar_grupo_no_inicializado(self, idx):
+        for symbol in list(self.grupos[idx]):
+            book = order_books.get(symbol)
+            if book is None:
+                continue
+            with book['lock']:
+                book['initialized'] = False
+                book['buffer'].clear()
+                book['first_event_after_snapshot'] = True
 
-    while True:
-        conexion_numero += 1
+    # ---------- ALTAS Y BAJAS EN CALIENTE ----------
+
+    def agregar(self, symbols):
+        """Reparte los símbolos en grupos con lugar (o nuevos) y los suscribe"""
+        afectados, nuevos = set(), []
+        with self.lock:
+            for symbol in symbols:
+                idx = next((i for i, g in enumerate(self.grupos) if len(g) < self.streams_por_conexion), None)
+                if idx is None:
+                    self.grupos.append([])
+                    idx = len(self.grupos) - 1
+                self.grupos[idx].append(symbol)
+                if idx in self.activas:
+                    afectados.add(idx)
+                elif idx not in nuevos:
+                    self.activas.add(idx)
+                    nuevos.append(idx)
+        for idx in nuevos:
+            self.lanzar(idx)
+        for idx in afectados:
+            self.sincronizar(idx)
+
+    def quitar(self, symbols):
+        """Saca los símbolos de sus grupos y los desuscribe"""
+        fuera = set(symbols)
+        afectados = set()
+        with self.lock:
+            for idx, grupo in enumerate(self.grupos):
+                if fuera.intersection(grupo):
+                    grupo[:] = [symbol for symbol in grupo if symbol not in fuera]
+                    if idx in self.activas:
+                        afectados.add(idx)
+        for idx in afectados:
+            self.sincronizar(idx)
+
+    def mensajes_pendientes(self, idx):
+        """SUBSCRIBE/UNSUBSCRIBE que llevan la conexión abierta idx a su grupo actual"""
+        with self.lock:
+            suscritos = self.suscritos.get(idx)
+            if suscritos is None:
+                return []  # Sin conexión abierta: el grupo actual se usa al (re)conectar
+            deseados = {stream_depth(symbol) for symbol in self.grupos[idx]}
+            mensajes = []
+            # Primero las bajas: la conexión nunca supera el máximo de streams
+            for metodo, streams in (("UNSUBSCRIBE", suscritos - deseados), ("SUBSCRIBE", deseados - suscritos)):
+                if streams:
+                    self.siguiente_id += 1
+                    mensajes.append(json.dumps({"method": metodo, "params": sorted(streams), "id": self.siguiente_id}))
+            self.suscritos[idx] = deseados
+            return mensajes
+
+    def sincronizar(self, idx):
+        if self.asincrono:
+            lanzar_tarea(self.sincronizar_async(idx))
+            return
+        ws = self.conexiones.get(idx)
         try:
-            # Crear stream individual: "btcusdt@depth@100ms"
-            url = f"wss://fstream.binance.com/stream?streams={symbol.lower()}@depth@100ms"
-
-            if conexion_numero == 1:
-                print(f"🔌 [{symbol}] Iniciando WebSocket (conexión #{conexion_numero})...", flush=True)
-            else:
-                print(f"🔄 [{symbol}] Reconectando WebSocket (intento #{conexion_numero})...", flush=True)
-
-            def on_open_handler(_):
-                print(f"✅ [{symbol}] WebSocket conectado exitosamente", flush=True)
-
-            def on_error_handler(_, error):
-                print(f"⚠️ [{symbol}] Error WS: {error}", flush=True)
-
-            def on_close_handler(*args):
-                close_code = args[1] if len(args) > 1 else 'N/A'
-                print(f"❌ [{symbol}] WebSocket desconectado (código: {close_code})", flush=True)
-
-            ws = websocket.WebSocketApp(
-                url,
-                on_open=on_open_handler,
-                on_message=lambda _, msg: on_message_combined(_, msg),
-                on_error=on_error_handler,
-                on_close=on_close_handler,
-            )
-            # Sin ping/pong - Binance maneja keep-alive automáticamente
-            ws.run_forever()
+            for mensaje in self.mensajes_pendientes(idx):
+                ws.send(mensaje)
+            if not self.grupos[idx] and ws is not None:
+                ws.close()
         except Exception as e:
-            print(f"💥 [{symbol}] Excepción en WebSocket: {e}")
-
-        # Marcar el símbolo como no inicializado
-        with order_book_lock:
-            order_books[symbol]['initialized'] = False
-            order_books[symbol]['buffer'] = []
-            order_books[symbol]['first_event_after_snapshot'] = True
+            # La conexión se está cayendo: al reconectar se usa el grupo actual
+            print(f"⚠️ [WS {idx + 1}/{len(self.grupos)}] No se pudo actualizar la suscripción: {e}")
 
-        print(f"⏳ [{symbol}] Esperando 5 segundos antes de reconectar...", flush=True)
-        time.sleep(5)
-
-        # Esperar a que el WebSocket se reconecte y acumule eventos
-        print(f"📡 [{symbol}] Acumulando eventos del buffer...", flush=True)
-        time.sleep(3)
+    async def sincronizar_async(self, idx):
+        ws = self.conexiones.get(idx)
+        try:
+            for mensaje in self.mensajes_pendientes(idx):
+                await ws.send(mensaje)
+            if not self.grupos[idx] and ws is not None:
+                await ws.close()
+        except Exception as e:
+            print(f"⚠️ [WS {idx + 1}/{len(self.grupos)}] No se pudo actualizar la suscripción: {e}")
+
+    # ---------- MODO ASYNC ----------
+
+    async def iniciar_async(self):
+        """Lanza una tarea por conexión combinada en el event loop actual"""
+        self.asincrono = True
+        print(f"🚀 Iniciando {len(self.grupos)} conexiones combinadas (async) para {sum(map(len, self.grupos))} símbolos...")
+        for idx in range(len(self.grupos)):
+            self.activas.add(idx)
+            self.lanzar(idx)
+            await asyncio.sleep(0.1)
+
+    async def run_conexion_async(self, idx):
+        """Versión async de run_conexion: los mensajes se aplican en el propio event loop"""
+        import websockets
+
+        etiqueta = f"WS {idx + 1}/{len(self.grupos)}"
+        conexion_numero = 0
+
+        while not self.terminar_si_vacio(idx):
+            conexion_numero += 1
+            try:
+                url, streams = self.url_grupo(idx)
+                if conexion_numero == 1:
+                    print(f"🔌 [{etiqueta}] Iniciando WebSocket con {len(streams)} streams...", flush=True)
+                else:
+                    print(f"🔄 [{etiqueta}] Reconectando WebSocket (intento #{conexion_numero})...", flush=True)
+
+                async with websockets.connect(url, max_size=None) as ws:
+                    print(f"✅ [{etiqueta}] WebSocket conectado exitosamente", flush=True)
+                    self.conexiones[idx] = ws
+                    self.suscritos[idx] = streams
+                    await self.sincronizar_async(idx)
+                    if conexion_numero > 1:
+                        # Resincronizar sólo los símbolos de esta conexión
+                        self.resincronizar_grupo(idx)
+                    async for message in ws:
+                        on_message_combined(ws, message)
+                print(f"❌ [{etiqueta}] WebSocket desconectado", flush=True)
+            except Exception as e:
+                print(f"💥 [{etiqueta}] Excepción en WebSocket: {e}")
+
+            self.suscritos.pop(idx, None)
+            if self.terminar_si_vacio(idx):
+                return
 
-        # Reinicializar el símbolo después de reconectar
-        print(f"🔄 [{symbol}] Solicitando snapshot y reinicializando...", flush=True)
-        threading.Thread(target=initialize_order_book, args=(symbol,), daemon=True).start()
+            self.marcar_grupo_no_inicializado(idx)
+
+            print(f"⏳ [{etiqueta}] Esperando 5 segundos antes de reconectar...", flush=True)
+            await asyncio.sleep(5)
+
+class GestorUniverso:
+    """
+    Reevalúa el filtro de volumen/precio cada UNIVERSO_INTERVALO segundos y
+    aplica los cambios sin reiniciar: crea o libera libros, suscribe o
+    desuscribe sus streams en las conexiones abiertas y pide los snapshots
+    de los que entran.
+    """
+
+    def __init__(self, conexiones, intervalo=UNIVERSO_INTERVALO):
+        self.conexiones = conexiones
+        self.intervalo = intervalo
+        self.cambios = 0
+
+    def consultar(self):
+        """Bloqueante (dos peticiones REST): en modo async corre en un hilo"""
+        return consultar_universo(cliente_binance(), VOLUMEN_MIN, PRECIO_MAX, list(coins), UNIVERSO_HISTERESIS)
+
+    def aplicar(self, nuevos, nuevos_tick_sizes):
+        agregados, quitados, recreados = aplicar_universo(nuevos, nuevos_tick_sizes)
+        if quitados:
+            self.conexiones.quitar(quitados)
+        if agregados:
+            self.conexiones.agregar(agregados)
+        # Se espera un poco para que el buffer junte eventos antes del snapshot
+        for symbol in agregados + recreados:
+            programador.solicitar(symbol, espera=2)
+        if agregados or quitados or recreados:
+            self.cambios += 1
+            print(f"🌐 Universo actualizado: {len(coins)} símbolos | +{len(agregados)} {agregados} | "
+                  f"-{len(quitados)} {quitados} | tickSize cambiado: {recreados}", flush=True)
+
+    def vigilar(self):
+        """Hilo del modo hilos"""
+        print(f"🌐 Reevaluando el universo cada {self.intervalo:g}s")
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.aplicar(*self.consultar())
+            except Exception as e:
+                print(f"💥 Error actualizando el universo: {e}")
+
+    async def vigilar_async(self):
+        """Los libros se crean y liberan en el event loop (en modo async no tienen lock)"""
+        print(f"🌐 Reevaluando el universo cada {self.intervalo:g}s")
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                self.aplicar(*await asyncio.to_thread(self.consultar))
+            except Exception as e:
+                print(f"💥 Error actualizando el universo: {e}")
+
+def universo_dinamico():
+    """El universo se reevalúa salvo en reproducción y en los workers de un shard (universo fijo)"""
+    return UNIVERSO_INTERVALO > 0 and not REPRODUCIR and not UNIVERSO
 
 # ===== API LOCAL (FastAPI) =====
 app = FastAPI()
 
+def recortar_libro(book, depth=None, min_price=None, max_price=None, bps=None):
+    """
+    Devuelve (bids, asks, lastUpdateId, last_u) con sólo el tramo pedido, ordenado
+    desde el mejor precio. Sin filtros devuelve la vista inmutable completa.
+
+    - depth: máximo de niveles por lado
+    - min_price / max_price: rango de precios (inclusive)
+    - bps: ventana de +/- bps alrededor del mid (se combina con min/max)
+    """
+    if depth is None and min_price is None and max_price is None and bps is None:
+        vista = vista_libro(book)
+        return vista.bids, vista.asks, vista.lastUpdateId, vista.last_u
+
+    tick_size = book['tick_size']
+    tick_min = math.ceil(min_price / tick_size - 1e-9) if min_price is not None else None
+    tick_max = math.floor(max_price / tick_size + 1e-9) if max_price is not None else None
+
+    # Sólo se recorre el tramo pedido: O(log n + k) bajo el lock del símbolo
+    with book['lock']:
+        if bps is not None:
+            mejor_bid, mejor_ask = book['bids'].mejor(), book['asks'].mejor()
+            # Con un lado vacío no hay mid: sin ventana (el lado que hay sale completo o hasta depth)
+            if mejor_bid and mejor_ask:
+                mid = (mejor_bid[0] + mejor_ask[0]) / 2
+                ventana_min = math.ceil(mid * (1 - bps / 10_000))
+                ventana_max = math.floor(mid * (1 + bps / 10_000))
+                tick_min = ventana_min if tick_min is None else max(tick_min, ventana_min)
+                tick_max = ventana_max if tick_max is None else min(tick_max, ventana_max)
+
+        if tick_min is None and tick_max is None and depth is not None:
+            bids, asks = book['bids'].top(depth), book['asks'].top(depth)
+        else:
+            bids = book['bids'].rango(tick_min, tick_max, depth)
+            asks = book['asks'].rango(tick_min, tick_max, depth)
+        return bids, asks, book['lastUpdateId'], book['last_u']
+
+def serializar_libro(symbol, book, depth=None, min_price=None, max_price=None, bps=None):
+    """Libro (o tramo) en el formato JSON de /orderbooks/{symbol}"""
+    t0 = time.perf_counter()
+    bids, asks, lastUpdateId, last_u = recortar_libro(book, depth, min_price, max_price, bps)
+
+    # Convertir a diccionarios para compatibilidad con el bot de análisis
+    # (ya ordenados desde el mejor precio)
+    tick_size, decimales = book['tick_size'], book['decimales']
+    libro = {
+        "symbol": symbol,
+        "bids": {tick_a_precio(t, tick_size, decimales): q for t, q in bids},
+        "asks": {tick_a_precio(t, tick_size, decimales): q for t, q in asks},
+        "lastUpdateId": lastUpdateId,
+        "last_u": last_u
+    }
+    book['metricas'].serializacion.observar(time.perf_counter() - t0)
+    return libro
+
+def libro_binario(book, depth=None, min_price=None, max_price=None, bps=None):
+    """Libro (o tramo) en el formato binario de libro_ordenes (ticks enteros + qty float64)"""
+    t0 = time.perf_counter()
+    bids, asks, lastUpdateId, last_u = recortar_libro(book, depth, min_price, max_price, bps)
+    datos = codificar_libro(book['tick_size'], bids, asks, lastUpdateId, last_u)
+    book['metricas'].serializacion.observar(time.perf_counter() - t0)
+    return datos
+
+def acepta_binario(request):
+    return MEDIA_TYPE_BINARIO in request.headers.get('accept', '')
+
+def segun_modo_ingesta(handler):
+    """
+    Handlers REST escritos como funciones normales. En modo hilos FastAPI los
+    corre en su threadpool: los locks por símbolo, las copias y la serialización
+    no frenan el event loop (ni /ws ni /sse). En modo async se ejecutan en el
+    loop, el mismo que escribe los libros (sin locks).
+    """
+    if MODO_INGESTA != "async":
+        return handler
+
+    @functools.wraps(handler)
+    async def en_loop(*args, **kwargs):
+        return handler(*args, **kwargs)
+    return en_loop
+
 @app.get("/orderbooks/{symbol}")
-def get_orderbook(symbol: str):
+@segun_modo_ingesta
+def get_orderbook(request: Request, symbol: str, depth: Optional[int] = Query(None, ge=0),
+                  min_price: Optional[float] = None, max_price: Optional[float] = None,
+                  bps: Optional[float] = Query(None, gt=0)):
+    """
+    Libro completo o, con depth / min_price / max_price / bps, sólo el tramo pedido.
+    Con 'Accept: application/x-orderbook' se responde en formato binario.
+    """
     symbol = symbol.upper()
     if symbol not in order_books:
         return JSONResponse({"error": "Símbolo no monitoreado"}, status_code=404)
 
-    with order_book_lock:
-        book = order_books[symbol]
-        if not book['initialized']:
-            return JSONResponse({"error": "Order book aún no inicializado"}, status_code=503)
+    book = order_books[symbol]
+    if not book['initialized']:
+        return JSONResponse({"error": "Order book aún no inicializado"}, status_code=503)
+
+    # La serialización se hace fuera del lock
+    if acepta_binario(request):
+        return Response(libro_binario(book, depth, min_price, max_price, bps), media_type=MEDIA_TYPE_BINARIO)
+    return JSONResponse(serializar_libro(symbol, book, depth, min_price, max_price, bps))
+
+@app.get("/orderbooks")
+@segun_modo_ingesta
+def get_orderbooks(request: Request, symbols: str, depth: Optional[int] = Query(None, ge=0),
+                   bps: Optional[float] = Query(None, gt=0)):
+    """
+    Varios libros en una sola respuesta: /orderbooks?symbols=BTCUSDT,ETHUSDT
+    Cada libro es un snapshot consistente (su propia vista inmutable).
+    Con 'Accept: application/x-orderbook' se responde un lote binario (sin los errores).
+    """
+    binario = acepta_binario(request)
+    orderbooks, errores = {}, {}
+    for symbol in symbols.upper().split(','):
+        symbol = symbol.strip()
+        if not symbol:
+            continue
+        book = order_books.get(symbol)
+        if book is None:
+            errores[symbol] = "Símbolo no monitoreado"
+        elif not book['initialized']:
+            errores[symbol] = "Order book aún no inicializado"
+        elif binario:
+            orderbooks[symbol] = libro_binario(book, depth, bps=bps)
+        else:
+            orderbooks[symbol] = serializar_libro(symbol, book, depth, bps=bps)
+
+    if binario:
+        return Response(codificar_lote(orderbooks), media_type=MEDIA_TYPE_BINARIO)
+    return JSONResponse({"orderbooks": orderbooks, "errores": errores})
+
+def agrupar_libro(book, step):
+    """Rangos de bids y asks para 'step', cacheados mientras no cambie la versión del libro"""
+    vista = vista_libro(book)
+    cache = book['agrupados']
+    entrada = cache.get(step)
+    if entrada is not None and entrada[0] == vista.version:
+        return entrada
+
+    tick_size = book['tick_size']
+    entrada = (
+        vista.version,
+        agrupar_niveles(vista.bids, tick_size, step),
+        agrupar_niveles(vista.asks, tick_size, step),
+        vista.lastUpdateId,
+        vista.last_u,
+    )
+    if len(cache) >= 16:  # Pocos steps por símbolo en la práctica
+        cache.clear()
+    cache[step] = entrada
+    return entrada
+
+@app.get("/orderbooks/{symbol}/grouped")
+@segun_modo_ingesta
+def get_orderbook_grouped(symbol: str, step: float = Query(..., gt=0), top: int = Query(6, ge=1)):
+    """
+    Rangos de precio de tamaño 'step' con su volumen total, precio moda y
+    promedio ponderado (mismos cálculos que el analizador), los 'top' de
+    mayor volumen por lado ordenados por volumen.
+    """
+    symbol = symbol.upper()
+    if symbol not in order_books:
+        return JSONResponse({"error": "Símbolo no monitoreado"}, status_code=404)
+    if step <= 0:
+        return JSONResponse({"error": "step debe ser mayor que 0"}, status_code=400)
+
+    book = order_books[symbol]
+    if not book['initialized']:
+        return JSONResponse({"error": "Order book aún no inicializado"}, status_code=503)
+
+    if step in book['agregados']:
+        # Step registrado: top K directo de las sumas incrementales
+        ag_bids, ag_asks = book['agregados'][step]
+        with book['lock']:
+            bids = ag_bids.top(top, book['bids'])
+            asks = ag_asks.top(top, book['asks'])
+            lastUpdateId, last_u = book['lastUpdateId'], book['last_u']
+    else:
+        _, bids, asks, lastUpdateId, last_u = agrupar_libro(book, step)
+
+    return JSONResponse({
+        "symbol": symbol,
+        "step": step,
+        "tick_size": book['tick_size'],
+        "bids": bids[:top],
+        "asks": asks[:top],
+        "lastUpdateId": lastUpdateId,
+        "last_u": last_u
+    })
+
+@app.post("/orderbooks/{symbol}/steps")
+@segun_modo_ingesta
+def registrar_step(symbol: str, step: float):
+    """
+    Registra un step de agrupación: desde ahora sus sumas por rango se mantienen
+    en cada diff y /grouped con ese step devuelve el top K sin reagrupar el libro.
+    """
+    symbol = symbol.upper()
+    if symbol not in order_books:
+        return JSONResponse({"error": "Símbolo no monitoreado"}, status_code=404)
+    if step <= 0:
+        return JSONResponse({"error": "step debe ser mayor que 0"}, status_code=400)
+
+    book = order_books[symbol]
+    with book['lock']:
+        if step not in book['agregados']:
+            ag_bids = AgregadoRangos(book['tick_size'], step, es_bid=True)
+            ag_asks = AgregadoRangos(book['tick_size'], step, es_bid=False)
+            ag_bids.reconstruir(book['bids'].items())
+            ag_asks.reconstruir(book['asks'].items())
+            book['agregados'][step] = (ag_bids, ag_asks)
+        steps = list(book['agregados'])
+
+    return {"symbol": symbol, "steps": steps}
+
+@app.delete("/orderbooks/{symbol}/steps")
+@segun_modo_ingesta
+def eliminar_step(symbol: str, step: float):
+    symbol = symbol.upper()
+    if symbol not in order_books:
+        return JSONResponse({"error": "Símbolo no monitoreado"}, status_code=404)
 
-        # Convertir a diccionarios para compatibilidad con el bot de análisis
-        bids_dict = {price: qty for price, qty in book['bids'].items()}
-        asks_dict = {price: qty for price, qty in book['asks'].items()}
+    book = order_books[symbol]
+    with book['lock']:
+        book['agregados'].pop(step, None)
+        steps = list(book['agregados'])
 
-        return JSONResponse({
-            "symbol": symbol,
-            "bids": bids_dict,
-            "asks": asks_dict,
-            "lastUpdateId": book['lastUpdateId'],
-            "last_u": book['last_u']
-        })
+    return {"symbol": symbol, "steps": steps}
 
 @app.get("/symbols")
+@segun_modo_ingesta
 def get_symbols():
-    with order_book_lock:
-        initialized = [s for s, b in order_books.items() if b['initialized']]
-        pending = [s for s, b in order_books.items() if not b['initialized']]
+    initialized = [s for s, b in list(order_books.items()) if b['initialized']]
+    pending = [s for s, b in list(order_books.items()) if not b['initialized']]
+
+    # Ocupación de los buffers previos al snapshot
+    buffers = {
+        s: {
+            "ocupacion": len(b['buffer']),
+            "capacidad": b['buffer'].capacidad,
+            "descartados": b['buffer'].descartados,
+        }
+        for s, b in list(order_books.items())
+    }
 
     return {
         "symbols": list(order_books.keys()),
         "initialized": initialized,
-        "pending": pending
+        "pending": pending,
+        "buffers": buffers
+    }
+
+def metadatos_libro(book):
+    """tickSize y precio medio entre el mejor bid y el mejor ask (None sin libro)"""
+    mid = None
+    if book['initialized']:
+        with book['lock']:
+            mejor_bid, mejor_ask = book['bids'].mejor(), book['asks'].mejor()
+        if mejor_bid is not None and mejor_ask is not None:
+            mid = round((mejor_bid[0] + mejor_ask[0]) * book['tick_size'] / 2, book['decimales'] + 1)
+    return {"tick_size": book['tick_size'], "mid": mid, "initialized": book['initialized']}
+
+@app.get("/symbols/metadata")
+@segun_modo_ingesta
+def get_symbols_metadata():
+    """tickSize y mid de todos los símbolos en una sola respuesta (evita exchangeInfo y un ticker por símbolo)"""
+    return {"symbols": {s: metadatos_libro(b) for s, b in list(order_books.items())}}
+
+@app.get("/contencion")
+@segun_modo_ingesta
+def get_contencion():
+    """Contención de los locks por símbolo (vacío en modo async, donde no hay locks)"""
+    return {
+        symbol: book['lock'].estadisticas()
+        for symbol, book in list(order_books.items())
+        if isinstance(book['lock'], CandadoMedido)
+    }
+
+def memoria_libro(book):
+    with book['lock']:
+        return book['bids'].memoria() + book['asks'].memoria()
+
+@app.get("/metrics")
+@segun_modo_ingesta
+def get_metrics():
+    """Métricas de ingesta por símbolo en formato de texto de Prometheus"""
+    exp = Exposicion()
+    for symbol, book in list(order_books.items()):
+        m = book['metricas']
+        exp.valor("ob_mensajes_total", "counter", "Mensajes de profundidad recibidos", m.mensajes, symbol)
+        exp.valor("ob_resyncs_total", "counter", "Resyncs por discontinuidad en la secuencia", m.resyncs, symbol)
+        exp.valor("ob_inicializado", "gauge", "1 si el libro está sincronizado", int(book['initialized']), symbol)
+        exp.valor("ob_buffer_eventos", "gauge", "Eventos en el buffer previo al snapshot", len(book['buffer']), symbol)
+        exp.valor("ob_buffer_descartados_total", "counter", "Eventos perdidos por desborde del buffer", book['buffer'].descartados, symbol)
+        exp.valor("ob_niveles", "gauge", "Niveles en el libro (bids + asks)", len(book['bids']) + len(book['asks']), symbol)
+        exp.valor("ob_niveles_recortados_total", "counter", "Niveles lejanos eliminados por la política de retención", m.recortados, symbol)
+        exp.valor("ob_memoria_libro_bytes", "gauge", "Memoria aproximada de los niveles del libro", memoria_libro(book), symbol)
+        lock = book['lock']
+        if isinstance(lock, CandadoMedido):
+            exp.valor("ob_lock_adquisiciones_total", "counter", "Adquisiciones del lock del símbolo", lock.adquisiciones, symbol)
+            exp.valor("ob_lock_contendidas_total", "counter", "Adquisiciones que tuvieron que esperar", lock.contendidas, symbol)
+            exp.valor("ob_lock_espera_segundos_total", "counter", "Tiempo total esperando el lock", lock.espera_total, symbol)
+        exp.histograma("ob_latencia_evento_segundos", "Desde la hora del evento (E) hasta aplicarlo", m.latencia, symbol)
+        exp.histograma("ob_aplicacion_segundos", "Duración de aplicar un diff al libro", m.aplicacion, symbol)
+        exp.histograma("ob_snapshot_segundos", "Duración de la descarga del snapshot REST", m.snapshot, symbol)
+        exp.histograma("ob_serializacion_segundos", "Duración de pasar el libro a JSON/binario en la API", m.serializacion, symbol)
+    exp.valor("ob_snapshots_pendientes", "gauge", "Snapshots en cola o en curso", programador.pendientes())
+    exp.valor("ob_simbolos", "gauge", "Símbolos monitoreados", len(order_books))
+    return Response(exp.texto(), media_type="text/plain; version=0.0.4")
+
+# ===== STREAMING (WebSocket / SSE) =====
+class Suscriptor:
+    """
+    Cola de diffs pendientes de una conexión de streaming. encolar() se llama
+    desde la ingesta (cualquier hilo) y nunca bloquea: si la cola se llena, el
+    consumidor es lento y se descartan sus diffs pendientes; en su lugar se le
+    manda un snapshot nuevo de cada símbolo (coalescencia).
+    """
+
+    def __init__(self, loop, max_pendientes=STREAM_MAX_PENDIENTES):
+        self.loop = loop
+        self.max_pendientes = max_pendientes
+        self.pendientes = deque()  # (symbol, data)
+        self.resync = set()  # Símbolos que necesitan snapshot antes de seguir con diffs
+        self.symbols = set()
+        self.lock = threading.Lock()
+        self.evento = asyncio.Event()
+
+    def _despertar(self):
+        self.loop.call_soon_threadsafe(self.evento.set)
+
+    def encolar(self, symbol, data):
+        with self.lock:
+            if symbol in self.resync:
+                return  # Ya va a recibir un snapshot más nuevo
+            if len(self.pendientes) >= self.max_pendientes:
+                self.pendientes.clear()
+                self.resync.update(self.symbols)
+            else:
+                self.pendientes.append((symbol, data))
+            if len(self.pendientes) <= 1:
+                self._despertar()
+
+    def pedir_snapshot(self, symbol):
+        with self.lock:
+            self.resync.add(symbol)
+        self._despertar()
+
+    def tomar(self):
+        """Devuelve (símbolos a resincronizar, diffs pendientes) y vacía la cola"""
+        with self.lock:
+            resync, self.resync = self.resync, set()
+            pendientes = list(self.pendientes)
+            self.pendientes.clear()
+        return resync, pendientes
+
+class DifusorLibros:
+    """Reparte los diffs ya aplicados entre los suscriptores de cada símbolo"""
+
+    def __init__(self):
+        self.suscriptores = {}  # symbol -> set(Suscriptor)
+        self.lock = threading.Lock()
+
+    def suscribir(self, sub, symbols):
+        with self.lock:
+            for symbol in symbols:
+                self.suscriptores.setdefault(symbol, set()).add(sub)
+                sub.symbols.add(symbol)
+        for symbol in symbols:
+            sub.pedir_snapshot(symbol)
+
+    def desuscribir(self, sub, symbols=None):
+        with self.lock:
+            for symbol in list(sub.symbols if symbols is None else symbols):
+                self.suscriptores.get(symbol, set()).discard(sub)
+                sub.symbols.discard(symbol)
+
+    def publicar(self, symbol, data):
+        """Llamado desde la ingesta tras aplicar un diff (con el lock del símbolo tomado)"""
+        subs = self.suscriptores.get(symbol)
+        if subs:
+            for sub in tuple(subs):
+                sub.encolar(symbol, data)
+
+    def reiniciar(self, symbol):
+        """El libro se recargó desde un snapshot: los suscriptores necesitan uno nuevo"""
+        subs = self.suscriptores.get(symbol)
+        if subs:
+            for sub in tuple(subs):
+                sub.pedir_snapshot(symbol)
+
+difusor = DifusorLibros()
+
+def mensaje_snapshot(symbol, book, depth=None):
+    """Snapshot (o top N) del libro para streaming: seq = last_u"""
+    tick_size, decimales = book['tick_size'], book['decimales']
+    bids, asks, lastUpdateId, last_u = recortar_libro(book, depth)
+    return {
+        "tipo": "snapshot" if depth is None else "top",
+        "symbol": symbol,
+        "seq": last_u,
+        "bids": [[tick_a_precio(t, tick_size, decimales), q] for t, q in bids],
+        "asks": [[tick_a_precio(t, tick_size, decimales), q] for t, q in asks],
     }
 
+def mensaje_baja(symbol):
+    """El símbolo salió del universo: el cliente queda desuscrito de él"""
+    return {"tipo": "unsubscribed", "symbol": symbol, "error": "Símbolo no monitoreado"}
+
+async def enviar(websocket, mensaje):
+    # Un consumidor que no acepta datos en STREAM_TIMEOUT_ENVIO se desconecta
+    await asyncio.wait_for(websocket.send_text(json.dumps(mensaje)), STREAM_TIMEOUT_ENVIO)
+
+async def enviar_deltas(websocket, sub):
+    """Snapshot inicial y luego los diffs secuenciados (U/u/pu de Binance) de cada símbolo"""
+    ultimo_seq = {}
+    while True:
+        await sub.evento.wait()
+        sub.evento.clear()
+        resync, pendientes = sub.tomar()
+
+        for symbol in resync:
+            book = order_books.get(symbol)
+            if book is None:
+                difusor.desuscribir(sub, [symbol])
+                await enviar(websocket, mensaje_baja(symbol))
+                continue
+            if not book['initialized']:
+                continue  # Llegará otro snapshot cuando termine de inicializarse
+            mensaje = mensaje_snapshot(symbol, book)
+            ultimo_seq[symbol] = mensaje['seq']
+            await enviar(websocket, mensaje)
+
+        for symbol, data in pendientes:
+            seq = ultimo_seq.get(symbol)
+            if seq is None or data['u'] <= seq:
+                continue  # Sin snapshot todavía o ya incluido en el snapshot enviado
+            ultimo_seq[symbol] = data['u']
+            await enviar(websocket, {
+                "tipo": "delta", "symbol": symbol,
+                "U": data['U'], "u": data['u'], "pu": data['pu'],
+                "b": data['b'], "a": data['a'],
+            })
+
+async def enviar_tops(websocket, symbols, depth, intervalo):
+    """Top N de cada símbolo como mucho una vez por intervalo y sólo si cambió"""
+    versiones = {}
+    while True:
+        for symbol in list(symbols):
+            book = order_books.get(symbol)
+            if book is None:
+                symbols.discard(symbol)
+                await enviar(websocket, mensaje_baja(symbol))
+                continue
+            if book['initialized'] and versiones.get(symbol) != book['version']:
+                versiones[symbol] = book['version']
+                await enviar(websocket, mensaje_snapshot(symbol, book, depth))
+        await asyncio.sleep(intervalo)
+
+@app.websocket("/ws")
+async def ws_libros(websocket: WebSocket):
+    """
+    Streaming de libros por WebSocket. El cliente envía:
+      {"op": "subscribe", "symbols": ["BTCUSDT", ...], "modo": "delta"}
+      {"op": "subscribe", "symbols": [...], "modo": "top", "depth": 50, "intervalo_ms": 250}
+      {"op": "unsubscribe", "symbols": [...]}
+
+    Modo delta: un snapshot por símbolo y después diffs con U/u/pu; si pu no
+    coincide con el u anterior el cliente perdió datos. Si el cliente se atrasa
+    se descartan sus diffs y recibe un snapshot nuevo en su lugar.
+    Modo top: top N por símbolo, como mucho una vez por intervalo (depth e
+    intervalo son de la conexión: un subscribe con otros valores los cambia
+    para todos sus símbolos en modo top).
+    Si un símbolo sale del universo se recibe {"tipo": "unsubscribed", ...}.
+    """
+    await websocket.accept()
+    sub = Suscriptor(asyncio.get_running_loop())
+    tops = set()
+    deltas = asyncio.ensure_future(enviar_deltas(websocket, sub))
+    tarea_tops, parametros_tops = None, None
+
+    try:
+        while True:
+            pedido = await websocket.receive_json()
+            symbols = [s.upper() for s in pedido.get('symbols', []) if s.upper() in order_books]
+            if pedido.get('op') == 'unsubscribe':
+                difusor.desuscribir(sub, symbols)
+                tops.difference_update(symbols)
+                if not tops and tarea_tops is not None:
+                    tarea_tops.cancel()
+                    tarea_tops, parametros_tops = None, None
+            elif pedido.get('modo') == 'top':
+                tops.update(symbols)
+                parametros = (int(pedido.get('depth', 50)), max(int(pedido.get('intervalo_ms', 250)), 50) / 1000)
+                # Una sola tarea por conexión: se reinicia si cambian depth o intervalo
+                if tarea_tops is None or tarea_tops.done() or parametros != parametros_tops:
+                    if tarea_tops is not None:
+                        tarea_tops.cancel()
+                    tarea_tops = asyncio.ensure_future(enviar_tops(websocket, tops, *parametros))
+                    parametros_tops = parametros
+            else:
+                difusor.suscribir(sub, symbols)
+    except Exception:
+        pass  # Desconexión del cliente o envío demasiado lento
+    finally:
+        difusor.desuscribir(sub)
+        deltas.cancel()
+        if tarea_tops is not None:
+            tarea_tops.cancel()
+
+@app.get("/sse/orderbooks/{symbol}")
+async def sse_orderbook(symbol: str, depth: int = Query(50, ge=0), intervalo_ms: int = 250):
+    """Server-Sent Events con el top N del símbolo, como mucho una vez por intervalo"""
+    symbol = symbol.upper()
+    if symbol not in order_books:
+        return JSONResponse({"error": "Símbolo no monitoreado"}, status_code=404)
+
+    intervalo = max(intervalo_ms, 50) / 1000
+
+    async def eventos():
+        version = None
+        book = order_books[symbol]
+        while True:
+            if order_books.get(symbol) is not book:
+                yield f"event: unsubscribed\ndata: {json.dumps(mensaje_baja(symbol))}\n\n"
+                return
+            if book['initialized'] and book['version'] != version:
+                version = book['version']
+                mensaje = mensaje_snapshot(symbol, book, depth)
+                yield f"id: {mensaje['seq']}\ndata: {json.dumps(mensaje)}\n\n"
+            await asyncio.sleep(intervalo)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
+
 # ===== MAIN =====
+ultimo_estado = {"mensajes": 0, "t": None}
+
+def publicar_memoria():
+    """Hilo que publica en memoria compartida los libros que cambiaron"""
+    print(f"🧠 Publicando libros en memoria compartida: {MEMORIA_DIR} ({MEMORIA_NIVELES} niveles por lado)")
+    while True:
+        try:
+            publicador.publicar_cambiados()
+        except Exception as e:
+            print(f"💥 Error publicando en memoria compartida: {e}")
+        time.sleep(MEMORIA_INTERVALO)
+
+async def publicar_memoria_async():
+    """Igual que publicar_memoria pero en el event loop (en modo async los libros no tienen lock)"""
+    print(f"🧠 Publicando libros en memoria compartida: {MEMORIA_DIR} ({MEMORIA_NIVELES} niveles por lado)")
+    while True:
+        try:
+            publicador.publicar_cambiados()
+        except Exception as e:
+            print(f"💥 Error publicando en memoria compartida: {e}")
+        await asyncio.sleep(MEMORIA_INTERVALO)
+
+def guardar_checkpoints():
+    """Hilo que guarda el checkpoint de los libros cada CHECKPOINT_INTERVALO segundos"""
+    print(f"💾 Checkpoints de los libros cada {CHECKPOINT_INTERVALO:g}s en {checkpoints.ruta}")
+    while True:
+        time.sleep(CHECKPOINT_INTERVALO)
+        try:
+            checkpoints.guardar()
+        except Exception as e:
+            print(f"💥 Error guardando checkpoint: {e}")
+
+async def guardar_checkpoints_async():
+    """Igual que guardar_checkpoints: se codifica en el event loop y se escribe en un hilo"""
+    print(f"💾 Checkpoints de los libros cada {CHECKPOINT_INTERVALO:g}s en {checkpoints.ruta}")
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVALO)
+        try:
+            datos, _ = checkpoints.codificar()
+            await asyncio.to_thread(checkpoints.escribir, datos)
+        except Exception as e:
+            print(f"💥 Error guardando checkpoint: {e}")
+
+def checkpoint_final():
+    """Último checkpoint al salir: con el last_u exacto es más probable reanudar sin snapshot"""
+    try:
+        n = checkpoints.guardar()
+        print(f"💾 Checkpoint final guardado ({n} libros)")
+    except Exception as e:
+        print(f"💥 Error guardando el checkpoint final: {e}")
+
+def preparar_checkpoints():
+    """
+    Carga los checkpoints antes de conectar y guarda uno al recibir SIGTERM/SIGINT,
+    con las conexiones todavía vivas; después la señal sigue su curso normal.
+    """
+    cargar_checkpoints()
+
+    def al_salir(signum, frame):
+        signal.signal(signum, anteriores[signum])
+        checkpoint_final()
+        signal.raise_signal(signum)
+
+    anteriores = {}
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        anteriores[signum] = signal.getsignal(signum)
+        signal.signal(signum, al_salir)
+
+def solicitar_snapshots_pendientes():
+    """Pide snapshot para los símbolos que no se pudieron reanudar desde su checkpoint"""
+    pendientes = [symbol for symbol in coins if not order_books[symbol]['initialized']]
+    if checkpoints is not None:
+        print(f"♻️ Reanudados sin snapshot: {len(coins) - len(pendientes)}/{len(coins)}")
+    for symbol in pendientes:
+        programador.solicitar(symbol)
+
+def imprimir_estado():
+    """Muestra el resumen de estado del sistema"""
+    # Recopilar estadísticas detalladas
+    initialized_count = sum(1 for b in list(order_books.values()) if b['initialized'])
+    pending_count = len(coins) - initialized_count
+
+    # Contar símbolos con datos
+    symbols_con_datos = []
+    symbols_pendientes = []
+    for symbol, book in list(order_books.items()):
+        if book['initialized']:
+            symbols_con_datos.append(symbol)
+        else:
+            symbols_pendientes.append(symbol)
+
+    # Mostrar resumen de estado claro
+    porcentaje = (initialized_count / len(coins) * 100) if len(coins) > 0 else 0
+
+    print("\n" + "="*80, flush=True)
+    print(f"📊 ESTADO DEL SISTEMA - {time.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
+    print("="*80, flush=True)
+    print(f"✅ Order books inicializados: {initialized_count}/{len(coins)} ({porcentaje:.1f}%)", flush=True)
+    print(f"⏳ Pendientes de inicializar: {pending_count} (snapshots en cola/en curso: {programador.pendientes()})", flush=True)
+    print(f"🔄 Resyncs desde el arranque: {total_resyncs()}", flush=True)
+
+    # Tamaño de los libros (acotado por la política de retención)
+    libros = list(order_books.values())
+    niveles = sum(len(b['bids']) + len(b['asks']) for b in libros)
+    memoria = sum(memoria_libro(b) for b in libros)
+    recortados = sum(b['metricas'].recortados for b in libros)
+    print(f"🧮 Niveles: {niveles:,} | Memoria de los libros: {memoria / 1e6:.1f} MB | Recortados por retención: {recortados:,}", flush=True)
+
+    # Ritmo de ingesta desde el último resumen (para ver cuándo se satura el proceso)
+    mensajes = sum(b['metricas'].mensajes for b in list(order_books.values()))
+    ahora = time.time()
+    if ultimo_estado["t"] is not None:
+        tasa = (mensajes - ultimo_estado["mensajes"]) / (ahora - ultimo_estado["t"])
+        print(f"📨 Mensajes/s: {tasa:,.0f}", flush=True)
+    ultimo_estado.update(mensajes=mensajes, t=ahora)
+
+    if initialized_count == len(coins):
+        print(f"🟢 SISTEMA OPERATIVO AL 100% - Todos los order books funcionando correctamente", flush=True)
+    elif initialized_count > 0:
+        print(f"🟡 SISTEMA PARCIALMENTE OPERATIVO", flush=True)
+        if pending_count <= 5 and pending_count > 0:
+            print(f"   Símbolos pendientes: {', '.join(symbols_pendientes)}", flush=True)
+    else:
+        print(f"🔴 SISTEMA NO OPERATIVO - Ningún order book inicializado", flush=True)
+
+    print(f"🌐 API REST: http://localhost:{PUERTO}/orderbooks/{{symbol}}", flush=True)
+    print("="*80 + "\n", flush=True)
+
+def huella_libros():
+    """Hash del contenido de todos los libros: la misma grabación debe dar siempre la misma huella"""
+    h = hashlib.sha1()
+    for symbol in sorted(order_books):
+        vista = vista_libro(order_books[symbol])
+        h.update(repr((symbol, vista.lastUpdateId, vista.last_u, vista.bids, vista.asks)).encode())
+    return h.hexdigest()
+
+def reproducir(ruta, velocidad=0.0):
+    """
+    Pasa una grabación por la misma ingesta que los datos en vivo
+    (on_message_combined / snapshot_recibido) y devuelve el resumen.
+    velocidad 0 = lo más rápido posible; 1 = respetando los tiempos grabados.
+    """
+    latencias = []
+    snapshots = 0
+    t0_grabacion = t0_real = None
+    inicio = time.perf_counter()
+
+    for t, tipo, symbol, payload in leer_grabacion(ruta):
+        if velocidad > 0:
+            if t0_grabacion is None:
+                t0_grabacion, t0_real = t, time.perf_counter()
+            espera = t0_real + (t - t0_grabacion) / velocidad - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+
+        if tipo == "ws":
+            t_msg = time.perf_counter()
+            on_message_combined(None, payload)
+            latencias.append(time.perf_counter() - t_msg)
+        elif tipo == "snap":
+            snapshot_recibido(symbol, payload)
+            snapshots += 1
+        elif tipo == "meta":
+            # El universo cambió durante la grabación
+            meta = json.loads(payload)
+            aplicar_universo(meta["coins"], meta["tick_sizes"])
+
+    duracion = time.perf_counter() - inicio
+    latencias.sort()
+
+    def percentil(p):
+        return latencias[min(int(len(latencias) * p), len(latencias) - 1)] * 1e6 if latencias else 0.0
+
+    return {
+        "mensajes": len(latencias),
+        "snapshots": snapshots,
+        "segundos": round(duracion, 3),
+        "mensajes_por_segundo": round(len(latencias) / duracion, 1) if duracion > 0 else 0.0,
+        "latencia_us": {"p50": round(percentil(0.50), 1), "p99": round(percentil(0.99), 1), "max": round(percentil(1.0), 1)},
+        "inicializados": sum(1 for b in list(order_books.values()) if b['initialized']),
+        "resyncs": total_resyncs(),
+        "huella": huella_libros(),
+    }
+
+def main_reproduccion():
+    cargar_universo(*universo_inicial())
+    print(f"▶️ Reproduciendo {REPRODUCIR} ({len(coins)} símbolos, velocidad {REPRODUCIR_VELOCIDAD or 'máxima'})...")
+    resumen = reproducir(REPRODUCIR, REPRODUCIR_VELOCIDAD)
+    lat = resumen["latencia_us"]
+    print("\n" + "="*80)
+    print("📼 REPRODUCCIÓN TERMINADA")
+    print("="*80)
+    print(f"📨 Mensajes: {resumen['mensajes']:,} | Snapshots: {resumen['snapshots']} | {resumen['segundos']}s")
+    print(f"⚡ Throughput: {resumen['mensajes_por_segundo']:,.0f} msg/s")
+    print(f"⏱️ Latencia por mensaje: p50 {lat['p50']}µs | p99 {lat['p99']}µs | máx {lat['max']}µs")
+    print(f"✅ Inicializados: {resumen['inicializados']}/{len(coins)} | 🔄 Resyncs: {resumen['resyncs']}")
+    print(f"🔑 Huella de los libros: {resumen['huella']}")
+    print("="*80 + "\n")
+
 async def main():
-    # Iniciar WebSockets individuales (1 conexión por símbolo)
-    print("🚀 Iniciando WebSockets individuales...")
-    start_individual_websockets()
+    cargar_universo(*universo_inicial())
+    if grabador is not None:
+        grabador.iniciar()
+
+    if checkpoints is not None:
+        preparar_checkpoints()
+
+    # Iniciar conexiones combinadas (STREAMS_POR_CONEXION símbolos por conexión)
+    print("🚀 Iniciando WebSockets combinados...")
+    conexiones = GestorConexiones(coins)
+    conexiones.iniciar()
 
     # Esperar para que empiecen a llegar eventos y se acumulen en el buffer
     print("⏳ Esperando acumulación de eventos...")
     await asyncio.sleep(5)
 
-    # Cargar snapshots e inicializar (pasos 2-5)
-    for symbol in coins:
-        threading.Thread(target=initialize_order_book, args=(symbol,), daemon=True).start()
-        await asyncio.sleep(0.2)  # Escalonar las peticiones
+    # Cargar snapshots e inicializar (pasos 2-5) al ritmo que permite el límite de peso
+    programador.iniciar()
+    solicitar_snapshots_pendientes()
 
     # Iniciar la API en otro hilo independiente
     def start_api():
-        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+        uvicorn.run(app, host=HOST, port=PUERTO, log_level="info")
 
     threading.Thread(target=start_api, daemon=True).start()
 
-    print("🚀 API de OrderBooks corriendo en http://localhost:8000")
+    if publicador is not None:
+        threading.Thread(target=publicar_memoria, daemon=True).start()
+
+    if checkpoints is not None:
+        threading.Thread(target=guardar_checkpoints, daemon=True).start()
+
+    if universo_dinamico():
+        threading.Thread(target=GestorUniverso(conexiones).vigilar, daemon=True).start()
+
+    print(f"🚀 API de OrderBooks corriendo en http://localhost:{PUERTO}")
 
     # Mantener vivo el proceso principal y mostrar estado cada 60 segundos
     while True:
         await asyncio.sleep(60)
+        imprimir_estado()
 
-        # Recopilar estadísticas detalladas
-        with order_book_lock:
-            initialized_count = sum(1 for b in order_books.values() if b['initialized'])
-            pending_count = len(coins) - initialized_count
-
-            # Contar símbolos con datos
-            symbols_con_datos = []
-            symbols_pendientes = []
-            for symbol, book in order_books.items():
-                if book['initialized']:
-                    symbols_con_datos.append(symbol)
-                else:
-                    symbols_pendientes.append(symbol)
-
-        # Mostrar resumen de estado claro
-        porcentaje = (initialized_count / len(coins) * 100) if len(coins) > 0 else 0
-
-        print("\n" + "="*80, flush=True)
-        print(f"📊 ESTADO DEL SISTEMA - {time.strftime('%Y-%m-%d %H:%M:%S')}", flush=True)
-        print("="*80, flush=True)
-        print(f"✅ Order books inicializados: {initialized_count}/{len(coins)} ({porcentaje:.1f}%)", flush=True)
-        print(f"⏳ Pendientes de inicializar: {pending_count}", flush=True)
-
-        if initialized_count == len(coins):
-            print(f"🟢 SISTEMA OPERATIVO AL 100% - Todos los order books funcionando correctamente", flush=True)
-        elif initialized_count > 0:
-            print(f"🟡 SISTEMA PARCIALMENTE OPERATIVO", flush=True)
-            if pending_count <= 5 and pending_count > 0:
-                print(f"   Símbolos pendientes: {', '.join(symbols_pendientes)}", flush=True)
-        else:
-            print(f"🔴 SISTEMA NO OPERATIVO - Ningún order book inicializado", flush=True)
+async def main_async():
+    """Ingesta totalmente async: streams, snapshots y API en un único event loop"""
+    cargar_universo(*await asyncio.to_thread(universo_inicial))
+    if grabador is not None:
+        grabador.iniciar()
+
+    if checkpoints is not None:
+        preparar_checkpoints()
+
+    print("🚀 Iniciando WebSockets combinados (modo async)...")
+    conexiones = GestorConexiones(coins)
+    await conexiones.iniciar_async()
+
+    # Esperar para que empiecen a llegar eventos y se acumulen en el buffer
+    print("⏳ Esperando acumulación de eventos...")
+    await asyncio.sleep(5)
+
+    # Cargar snapshots e inicializar (pasos 2-5) al ritmo que permite el límite de peso
+    programador.iniciar()
+    solicitar_snapshots_pendientes()
+
+    # La API corre en el mismo event loop
+    servidor = uvicorn.Server(uvicorn.Config(app, host=HOST, port=PUERTO, log_level="info"))
+    lanzar_tarea(servidor.serve())
+
+    if publicador is not None:
+        lanzar_tarea(publicar_memoria_async())
+
+    if checkpoints is not None:
+        lanzar_tarea(guardar_checkpoints_async())
 
-        print(f"🌐 API REST: http://localhost:8000/orderbooks/{{symbol}}", flush=True)
-        print("="*80 + "\n", flush=True)
+    if universo_dinamico():
+        lanzar_tarea(GestorUniverso(conexiones).vigilar_async())
+
+    print(f"🚀 API de OrderBooks corriendo en http://localhost:{PUERTO}")
+
+    while True:
+        await asyncio.sleep(60)
+        imprimir_estado()
+
+def main_shards():
+    """Frente del modo multi-proceso: lanza un worker por shard y enruta la API"""
+    # Universo fijo: se reparte una vez entre los workers
+    coins_frente, tick_sizes_frente = universo_inicial()
+    print(f"✅ Se encontraron {len(coins_frente)} monedas de Futuros PERPETUOS válidas")
+    gestor = GestorShards(os.path.abspath(__file__), coins_frente, tick_sizes_frente, SHARDS, PUERTO + 1,
+                          PESO_MAX_MINUTO, SNAPSHOT_CONCURRENCIA)
+    gestor.iniciar()
+    print(f"🚀 API unificada de {SHARDS} shards en http://localhost:{PUERTO}")
+    uvicorn.run(crear_app_frente(gestor), host=HOST, port=PUERTO, log_level="info")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if REPRODUCIR:
+        main_reproduccion()
+    elif SHARDS > 1:
+        main_shards()
+    else:
+        asyncio.run(main_async() if MODO_INGESTA == "async" else main())
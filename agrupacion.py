@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Agrupación del libro en rangos de precio (mismos cálculos que el analizador)."""
+import math
+
+from sortedcontainers import SortedList
+
+# numpy (opcional) agrupa los libros del analizador con operaciones sobre arrays
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from libro_ordenes import decimales_tick
+
+def redondear_a_tick(precio, tick_size, dec_tick):
+    return round(round(precio / tick_size) * tick_size, dec_tick)
+
+def agrupar_niveles(niveles, tick_size, step):
+    """
+    Agrupa niveles (tick, qty) ordenados desde el mejor precio en rangos de 'step'.
+
+    Como el libro ya viene ordenado, cada rango es un tramo contiguo y basta
+    una sola pasada. Devuelve los rangos ordenados por volumen total (desc)
+    como dicts con los mismos valores que el cálculo original del analizador
+    (referencia en tests/test_agrupacion.py):
+    - precio: inicio del rango (precio // step * step)
+    - total_qty: volumen total del rango
+    - moda: precio con más volumen
+    - vwap: promedio ponderado por volumen
+    """
+    dec_tick = decimales_tick(tick_size)
+    dec_step = decimales_tick(step)
+    rangos = []
+    clave_actual = None
+    total = suma_pq = 0
+    precio_moda, qty_moda = None, None
+
+    def cerrar_rango():
+        rangos.append({
+            "precio": clave_actual,
+            "total_qty": total,
+            "moda": redondear_a_tick(precio_moda, tick_size, dec_tick),
+            "vwap": redondear_a_tick(suma_pq / total, tick_size, dec_tick),
+        })
+
+    for tick, qty in niveles:
+        precio = round(tick * tick_size, dec_tick)
+        clave = round((precio // step) * step, dec_step)
+        if clave != clave_actual:
+            if clave_actual is not None:
+                cerrar_rango()
+            clave_actual = clave
+            total = suma_pq = 0
+            precio_moda, qty_moda = None, None
+        total += qty
+        suma_pq += precio * qty
+        if qty_moda is None or qty > qty_moda:
+            precio_moda, qty_moda = precio, qty
+
+    if clave_actual is not None:
+        cerrar_rango()
+
+    # sorted es estable: ante empates se mantiene el orden desde el mejor precio
+    return sorted(rangos, key=lambda r: r["total_qty"], reverse=True)
+
+# ---------- AGREGADOS INCREMENTALES ----------
+
+# Las cantidades de Binance traen como mucho 8 decimales: en unidades de 1e-8 son enteros exactos
+ESCALA_QTY = 10 ** 8
+
+def qty_a_unidades(qty):
+    return round(qty * ESCALA_QTY)
+
+class AgregadoRangos:
+    """
+    Sumas por rango de 'step' de un lado del libro, mantenidas en cada diff:
+    qty total, qty·tick (para el promedio ponderado) y niveles por rango,
+    más un ranking ordenado por volumen para leer el top K en O(K).
+
+    Las sumas son enteras (qty en unidades de ESCALA_QTY, precio en ticks):
+    después de cualquier cantidad de diffs valen exactamente lo mismo que
+    reconstruir() y un rango vacío queda en cero, sin restos de redondeo.
+
+    La moda no se mantiene incrementalmente: se calcula al leer, recorriendo
+    sólo los niveles de los K rangos pedidos.
+    """
+
+    def __init__(self, tick_size, step, es_bid):
+        self.tick_size = tick_size
+        self.step = step
+        self.es_bid = es_bid
+        self.dec_tick = decimales_tick(tick_size)
+        self.dec_step = decimales_tick(step)
+        self.rangos = {}  # índice de rango -> [qty (unidades), qty*tick (unidades), niveles]
+        # (-qty, desempate, índice): ante empates primero el rango más cercano al mejor precio
+        self.ranking = SortedList()
+
+    def _clave_ranking(self, idx, entrada):
+        return (-entrada[0], -idx if self.es_bid else idx, idx)
+
+    def aplicar(self, tick, qty_anterior, qty_nueva):
+        """Registra el cambio de un nivel de qty_anterior a qty_nueva"""
+        if qty_anterior == qty_nueva:
+            return
+        precio = round(tick * self.tick_size, self.dec_tick)
+        idx = precio // self.step
+        delta = qty_a_unidades(qty_nueva) - qty_a_unidades(qty_anterior)
+
+        entrada = self.rangos.get(idx)
+        if entrada is None:
+            entrada = self.rangos[idx] = [0, 0, 0]
+        else:
+            self.ranking.remove(self._clave_ranking(idx, entrada))
+
+        entrada[0] += delta
+        entrada[1] += delta * tick
+        entrada[2] += (qty_nueva != 0) - (qty_anterior != 0)
+
+        if entrada[2] == 0:
+            del self.rangos[idx]
+        else:
+            self.ranking.add(self._clave_ranking(idx, entrada))
+
+    def reconstruir(self, niveles):
+        """Recalcula desde cero a partir de los niveles (tick, qty) del lado"""
+        self.rangos.clear()
+        self.ranking.clear()
+        for tick, qty in niveles:
+            precio = round(tick * self.tick_size, self.dec_tick)
+            idx = precio // self.step
+            entrada = self.rangos.get(idx)
+            if entrada is None:
+                entrada = self.rangos[idx] = [0, 0, 0]
+            unidades = qty_a_unidades(qty)
+            entrada[0] += unidades
+            entrada[1] += unidades * tick
+            entrada[2] += 1
+        self.ranking.update(self._clave_ranking(idx, e) for idx, e in self.rangos.items())
+
+    def top(self, k, lado=None):
+        """
+        Los k rangos de mayor volumen (mismo formato que agrupar_niveles).
+        Si se pasa el LadoLibro también se calcula la moda de cada rango.
+        """
+        tick_size, dec_tick = self.tick_size, self.dec_tick
+        resultado = []
+        for _, _, idx in self.ranking.islice(0, k):
+            unidades, suma_ticks, _ = self.rangos[idx]
+            rango = {
+                "precio": round(idx * self.step, self.dec_step),
+                "total_qty": unidades / ESCALA_QTY,
+                "moda": None,
+                "vwap": redondear_a_tick(suma_ticks / unidades * tick_size, tick_size, dec_tick),
+            }
+            if lado is not None:
+                rango["moda"] = self._moda(idx, lado)
+            resultado.append(rango)
+        return resultado
+
+    def _moda(self, idx, lado):
+        tick_size, dec_tick, step = self.tick_size, self.dec_tick, self.step
+        # Margen de un tick a cada lado por el redondeo del precio; se filtra por índice exacto
+        tick_min = math.floor(idx * step / tick_size) - 1
+        tick_max = math.ceil((idx + 1) * step / tick_size) + 1
+        precio_moda, qty_moda = None, None
+        for tick, qty in lado.rango(tick_min, tick_max):
+            precio = round(tick * tick_size, dec_tick)
+            if precio // step != idx:
+                continue
+            if qty_moda is None or qty > qty_moda:
+                precio_moda, qty_moda = precio, qty
+        return redondear_a_tick(precio_moda, tick_size, dec_tick) if precio_moda is not None else None
+
+# ---------- AGRUPACIÓN VECTORIZADA (ANALIZADOR) ----------
+
+class LadoAgrupable:
+    """
+    Un lado del libro tal como lo recibe el analizador ({precio: qty}, en el
+    orden del servidor) convertido una sola vez a arrays, para agruparlo en
+    varios steps sin volver a recorrerlo en Python.
+
+    Los rangos son los mismos que en el analizador original (precio // step,
+    misma división de floats que hace numpy) y los resultados son idénticos a
+    su moda y su promedio ponderado (tests/test_agrupacion.py): las sumas de
+    bincount se acumulan en el orden del dict, la moda es el primer nivel con
+    la qty máxima del rango y los empates de volumen se resuelven por orden
+    de aparición, como el sorted estable del analizador.
+
+    Sin numpy agrupa con el mismo bucle por nivel que el analizador.
+    """
+
+    def __init__(self, niveles, tick_size):
+        self.tick_size = tick_size
+        self.dec_tick = decimales_tick(tick_size)
+        if np is not None:
+            n = len(niveles)
+            self.precios = np.fromiter(niveles.keys(), dtype=np.float64, count=n)
+            self.qtys = np.fromiter(niveles.values(), dtype=np.float64, count=n)
+            self.pq = self.precios * self.qtys
+        else:
+            self.niveles = {float(p): float(q) for p, q in niveles.items()}
+
+    def agrupar(self, step, top=None):
+        """Rangos ordenados por volumen total (desc), en el formato de agrupar_niveles"""
+        if np is None:
+            return self._agrupar_python(step, top)
+        if not len(self.precios):
+            return []
+
+        # Índice de rango de cada nivel (valores enteros en float64) y rango compacto 0..n-1
+        indices, primero, rango = np.unique(np.floor_divide(self.precios, step),
+                                            return_index=True, return_inverse=True)
+        totales = np.bincount(rango, weights=self.qtys, minlength=len(indices))
+        sumas_pq = np.bincount(rango, weights=self.pq, minlength=len(indices))
+
+        # Primer nivel (en orden del dict) con la qty máxima de su rango
+        maximos = np.full(len(indices), -np.inf)
+        np.maximum.at(maximos, rango, self.qtys)
+        candidatos = np.flatnonzero(self.qtys == maximos[rango])
+        _, pos = np.unique(rango[candidatos], return_index=True)
+        moda = candidatos[pos]
+
+        # Top K por volumen: argpartition acota los candidatos y lexsort desempata por aparición
+        elegidos = np.arange(len(indices))
+        if top is not None and top < len(indices):
+            k = len(indices) - top
+            umbral = totales[np.argpartition(totales, k)[k]]
+            elegidos = np.flatnonzero(totales >= umbral)
+        orden = elegidos[np.lexsort((primero[elegidos], -totales[elegidos]))]
+        if top is not None:
+            orden = orden[:top]
+
+        # Sólo los rangos elegidos vuelven a floats de Python (round de Python, no el de numpy)
+        dec_step = decimales_tick(step)
+        tick_size, dec_tick = self.tick_size, self.dec_tick
+        return [
+            {
+                "precio": round(indice * step, dec_step),
+                "total_qty": total,
+                "moda": redondear_a_tick(precio_moda, tick_size, dec_tick),
+                "vwap": redondear_a_tick(suma_pq / total, tick_size, dec_tick),
+            }
+            for indice, total, suma_pq, precio_moda in zip(
+                indices[orden].tolist(), totales[orden].tolist(),
+                sumas_pq[orden].tolist(), self.precios[moda[orden]].tolist())
+        ]
+
+    def _agrupar_python(self, step, top):
+        dec_step = decimales_tick(step)
+        rangos = {}
+        for precio, qty in self.niveles.items():
+            clave = round((precio // step) * step, dec_step)
+            entrada = rangos.get(clave)
+            if entrada is None:
+                entrada = rangos[clave] = [0, 0, precio, qty]  # total, suma p*q, moda, qty de la moda
+            entrada[0] += qty
+            entrada[1] += precio * qty
+            if qty > entrada[3]:
+                entrada[2], entrada[3] = precio, qty
+
+        tick_size, dec_tick = self.tick_size, self.dec_tick
+        resultado = [
+            {
+                "precio": clave,
+                "total_qty": total,
+                "moda": redondear_a_tick(precio_moda, tick_size, dec_tick),
+                "vwap": redondear_a_tick(suma_pq / total, tick_size, dec_tick),
+            }
+            for clave, (total, suma_pq, precio_moda, _) in rangos.items()
+        ]
+        resultado.sort(key=lambda r: r["total_qty"], reverse=True)
+        return resultado[:top] if top is not None else resultado
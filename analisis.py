@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+Análisis de zonas de shock (long/short) sin interfaz gráfica.
+
+Carga los libros del servidor de order books (memoria compartida, batch
+binario o JSON), los agrupa por símbolo con la agrupación óptima según el
+precio (o la indicada) y elige las zonas: de los 6 rangos de mayor volumen
+por lado se descartan los 2 más cercanos al precio. Lo usa la GUI ("ANALIZADOR
+- V2.py") y se puede correr desde la línea de comandos en un servidor:
+
+    python analisis.py --formato json
+    python analisis.py --symbols BTCUSDT,ETHUSDT --metodo moda --formato csv --salida zonas.csv --intervalo 300
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from agrupacion import LadoAgrupable
+from libro_ordenes import MEDIA_TYPE_BINARIO, decodificar_libro, decodificar_lote
+from memoria_compartida import LectorLibros, LibroNoDisponible
+from metadatos import CacheMetadatos
+
+# ---------- FUNCIONES UTILITARIAS ----------
+
+def formatear_volumen(num):
+    if num >= 1_000_000_000:
+        return f"{num / 1_000_000_000:.1f}b"
+    elif num >= 1_000_000:
+        return f"{num / 1_000_000:.1f}m"
+    elif num >= 1_000:
+        return f"{num / 1_000:.1f}k"
+    else:
+        return f"{num:.2f}"
+
+def decimales_por_valor(valor):
+    s = f"{valor:.10f}".rstrip('0')
+    return len(s.split('.')[1]) if '.' in s else 0
+
+def obtener_nivel_agrupacion_optimo(tick_size, precio_actual):
+    """Calcula la agrupación óptima basada en el precio actual"""
+    try:
+        if precio_actual is None or precio_actual <= 0:
+            return tick_size
+        
+        # Determinar agrupación base según el rango de precio
+        if precio_actual >= 100:
+            agrupacion_base = 10.0
+        elif precio_actual >= 10:
+            agrupacion_base = 1.0
+        elif precio_actual >= 1:
+            agrupacion_base = 0.1
+        elif precio_actual >= 0.1:
+            agrupacion_base = 0.01
+        elif precio_actual >= 0.01:
+            agrupacion_base = 0.001
+        elif precio_actual >= 0.001:
+            agrupacion_base = 0.0001
+        else:
+            agrupacion_base = 0.00001
+        
+        # Verificar que sea divisible por el tick_size
+        tick_decimal = Decimal(str(tick_size))
+        agrupacion_decimal = Decimal(str(agrupacion_base))
+        cociente = agrupacion_decimal / tick_decimal
+        
+        if cociente % 1 == 0:
+            return agrupacion_base
+        
+        # Si no es divisible, buscar el nivel más cercano que sí lo sea
+        niveles_posibles = [0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10, 100]
+        
+        for nivel in reversed(niveles_posibles):
+            nivel_decimal = Decimal(str(nivel))
+            cociente = nivel_decimal / tick_decimal
+            if cociente % 1 == 0 and nivel <= agrupacion_base:
+                return nivel
+        
+        return tick_size
+        
+    except Exception as e:
+        return tick_size
+
+# ---------- OBTENER DATOS BINANCE ----------
+
+# Sesión compartida con el servidor de order books (conexiones keep-alive)
+MAX_DESCARGAS_PARALELAS = 8
+sesion_api = requests.Session()
+sesion_api.mount("http://", HTTPAdapter(pool_maxsize=MAX_DESCARGAS_PARALELAS))
+
+# tickSizes y precios: del servidor o, si falta, exchangeInfo cacheado en disco y el ticker de todos los símbolos
+metadatos = CacheMetadatos(sesion=sesion_api)
+
+# Si el servidor corre en esta máquina con OB_MEMORIA_DIR, los libros se leen de la memoria compartida
+MEMORIA_DIR = os.environ.get("OB_MEMORIA_DIR", "")
+lector_memoria = LectorLibros(MEMORIA_DIR) if MEMORIA_DIR else None
+
+# Se pide el formato binario; un servidor que no lo soporte responde JSON
+CABECERAS_LIBRO = {"Accept": f"{MEDIA_TYPE_BINARIO}, application/json;q=0.9"}
+
+def libro_binario_a_dict(libro):
+    """Libro binario -> {'bids': {precio: qty}, 'asks': {...}} con floats, sin parsear strings"""
+    tick = libro["tick_size"]
+    decimales = decimales_por_valor(tick)
+    return {
+        "bids": {round(t * tick, decimales): q for t, q in zip(libro["bids_ticks"], libro["bids_qty"])},
+        "asks": {round(t * tick, decimales): q for t, q in zip(libro["asks_ticks"], libro["asks_qty"])},
+        "lastUpdateId": libro["lastUpdateId"],
+        "last_u": libro["last_u"],
+    }
+
+def es_binario(resp):
+    return resp.headers.get("Content-Type", "").startswith(MEDIA_TYPE_BINARIO)
+
+def cargar_libro_ordenes_symbol(symbol, base_url):
+    try:
+        resp = sesion_api.get(f"{base_url}/orderbooks/{symbol}", headers=CABECERAS_LIBRO, timeout=5)
+        if resp.status_code == 200:
+            if es_binario(resp):
+                return libro_binario_a_dict(decodificar_libro(resp.content)[0])
+            return resp.json()
+    except Exception as e:
+        print(f"Error al obtener libro: {e}")
+    return None
+
+def cargar_libro_ordenes_memoria(symbols):
+    """Libros publicados por el servidor en memoria compartida (sin HTTP ni parseo)"""
+    order_books = {}
+    for symbol in symbols:
+        try:
+            order_books[symbol] = libro_binario_a_dict(lector_memoria.leer(symbol))
+        except LibroNoDisponible:
+            pass
+    return order_books
+
+def cargar_libro_ordenes_api(symbols, base_url="http://localhost:8000"):
+    """
+    Lee los libros de la memoria compartida si está disponible; el resto los
+    descarga en una sola petición batch o, si el servidor no la soporta, en paralelo
+    """
+    order_books = cargar_libro_ordenes_memoria(symbols) if lector_memoria is not None else {}
+    faltantes = [s for s in symbols if s not in order_books]
+    if not faltantes:
+        return order_books
+
+    try:
+        resp = sesion_api.get(f"{base_url}/orderbooks", params={"symbols": ",".join(faltantes)},
+                              headers=CABECERAS_LIBRO, timeout=15)
+        if resp.status_code == 200:
+            if es_binario(resp):
+                order_books.update((s, libro_binario_a_dict(l)) for s, l in decodificar_lote(resp.content).items())
+            else:
+                order_books.update(resp.json()["orderbooks"])
+            return order_books
+    except Exception as e:
+        print(f"Error al obtener libros (batch): {e}")
+
+    with ThreadPoolExecutor(max_workers=MAX_DESCARGAS_PARALELAS) as pool:
+        for symbol, libro in zip(faltantes, pool.map(lambda s: cargar_libro_ordenes_symbol(s, base_url), faltantes)):
+            if libro is not None:
+                order_books[symbol] = libro
+    return order_books
+
+# ---------- ZONAS DE SHOCK ----------
+
+SERVIDOR_URL = os.environ.get("OB_SERVIDOR_URL", "http://localhost:8000")
+MAX_ANALISIS_PARALELOS = 8
+METODOS = {
+    "moda": "Moda (Mayor Volumen)",
+    "promedio": "Promedio Ponderado",
+}
+
+def precio_zona(zona, metodo):
+    """Precio de la zona según el método (moda o promedio ponderado)"""
+    return zona['moda'] if metodo == "moda" else zona['vwap']
+
+def zonas_lado(rangos, metodo, es_bid, saltar=2):
+    """
+    Zonas de un lado a partir de sus rangos de mayor volumen: se ordenan por
+    precio desde el más cercano al mercado y se descartan los 'saltar' primeros
+    """
+    rangos = sorted(rangos, key=lambda r: r['precio'], reverse=es_bid)
+    return [
+        {
+            "precio": precio_zona(r, metodo),
+            "moda": r['moda'],
+            "vwap": r['vwap'],
+            "volumen": r['total_qty'],
+            "rango": r['precio'],
+        }
+        for r in rangos[saltar:]
+    ]
+
+def analizar_libro(symbol, order_book, tick, agrupacion, metodo="promedio", top=6, saltar=2):
+    """Zonas long (bids) y short (asks) de un libro {'bids': {precio: qty}, 'asks': {...}}"""
+    # Cada lado se convierte una vez a arrays y se agrupa sin recorrerlo nivel por nivel
+    top_bid_ranges = LadoAgrupable(order_book['bids'], tick).agrupar(agrupacion, top=top)
+    top_ask_ranges = LadoAgrupable(order_book['asks'], tick).agrupar(agrupacion, top=top)
+    return {
+        "symbol": symbol,
+        "agrupacion": agrupacion,
+        "tick_size": tick,
+        "long": zonas_lado(top_bid_ranges, metodo, es_bid=True, saltar=saltar),
+        "short": zonas_lado(top_ask_ranges, metodo, es_bid=False, saltar=saltar),
+    }
+
+class AnalizadorShocks:
+    """
+    Estado del análisis compartido por la GUI y la CLI: tickSizes, precios,
+    agrupaciones automáticas y personalizadas por símbolo. analizar() hace una
+    pasada completa y devuelve un dict serializable a JSON.
+    """
+
+    def __init__(self, base_url=SERVIDOR_URL, metodo="promedio", top=6, saltar=2,
+                 max_paralelos=MAX_ANALISIS_PARALELOS):
+        self.base_url = base_url
+        self.metodo = metodo
+        self.top = top
+        self.saltar = saltar
+        self.max_paralelos = max_paralelos
+        self.tick_sizes = {}
+        self.precios_actuales = {}
+        self.agrupaciones = {}  # Calculadas automáticamente según el precio
+        self.agrupaciones_custom = {}  # Indicadas por el usuario
+
+    def symbols_servidor(self):
+        resp = sesion_api.get(f"{self.base_url}/symbols", timeout=5)
+        return resp.json().get("symbols", [])
+
+    def cargar_metadatos(self, symbols):
+        """tickSize, precio y agrupación óptima de los símbolos (una petición al servidor)"""
+        tick_sizes, precios = metadatos.cargar(symbols, self.base_url)
+        for symbol in symbols:
+            tick = tick_sizes.get(symbol, 0.01)
+            self.tick_sizes[symbol] = tick
+            precio = precios.get(symbol)
+            if precio:
+                self.precios_actuales[symbol] = precio
+                self.agrupaciones[symbol] = obtener_nivel_agrupacion_optimo(tick, precio)
+
+    def agrupacion(self, symbol):
+        """Agrupación a usar: personalizada si existe, sino la automática"""
+        return self.agrupaciones_custom.get(symbol, self.agrupaciones.get(symbol, 0.01))
+
+    def analizar(self, symbols, metodo=None):
+        metodo = metodo or self.metodo
+        t0 = time.perf_counter()
+        faltantes = [s for s in symbols if s not in self.tick_sizes]
+        if faltantes:
+            self.cargar_metadatos(faltantes)
+        t1 = time.perf_counter()
+        order_books = cargar_libro_ordenes_api(symbols, self.base_url)
+        t2 = time.perf_counter()
+
+        def analizar_symbol(symbol):
+            return analizar_libro(symbol, order_books[symbol], self.tick_sizes.get(symbol, 0.01),
+                                  self.agrupacion(symbol), metodo, self.top, self.saltar)
+
+        # En el orden de los símbolos pedidos (el de la GUI)
+        con_libro = [s for s in symbols if s in order_books]
+        with ThreadPoolExecutor(max_workers=self.max_paralelos) as pool:
+            resultados = list(pool.map(analizar_symbol, con_libro))
+        t3 = time.perf_counter()
+
+        return {
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "metodo": metodo,
+            "resultados": resultados,
+            "sin_datos": [s for s in symbols if s not in order_books],
+            "tiempos": {"metadatos": t1 - t0, "libros": t2 - t1, "analisis": t3 - t2},
+        }
+
+# ---------- SELECCIÓN Y GUARDADO ----------
+
+RUTA_SHOCKS = "shocks_guardados.txt"
+
+class SeleccionShocks:
+    """Un punto long y uno short elegido por símbolo"""
+
+    def __init__(self):
+        self.puntos = defaultdict(lambda: {'long': None, 'short': None})
+
+    def alternar(self, symbol, tipo, precio):
+        """Selecciona el precio (o lo deselecciona si ya lo estaba); devuelve el seleccionado anterior"""
+        anterior = self.puntos[symbol][tipo]
+        self.puntos[symbol][tipo] = None if anterior == precio else precio
+        return anterior
+
+    def seleccionado(self, symbol, tipo):
+        return self.puntos[symbol][tipo] if symbol in self.puntos else None
+
+    def limpiar(self):
+        self.puntos.clear()
+
+    def lineas(self, symbols):
+        """'SYMBOL long short' de los símbolos con algún punto elegido"""
+        lineas = []
+        for symbol in symbols:
+            long_price = self.seleccionado(symbol, 'long')
+            short_price = self.seleccionado(symbol, 'short')
+
+            long_str = str(long_price) if long_price is not None else ""
+            short_str = str(short_price) if short_price is not None else ""
+
+            if long_str or short_str:
+                lineas.append(f"{symbol} {long_str} {short_str}")
+        return lineas
+
+def guardar_shocks(lineas, ruta=RUTA_SHOCKS):
+    """Agrega las líneas al archivo con la fecha del guardado"""
+    with open(ruta, "a", encoding='utf-8') as f:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        f.write(f"\n--- Analisis guardado: {timestamp} ---\n")
+        for linea in lineas:
+            f.write(f"{linea}\n")
+        f.write("\n")
+
+# ---------- SALIDA ----------
+
+COLUMNAS_CSV = ["timestamp", "symbol", "lado", "precio", "moda", "vwap", "volumen", "rango", "agrupacion", "tick_size"]
+
+def filas_csv(analisis):
+    for resultado in analisis["resultados"]:
+        for lado in ("long", "short"):
+            for zona in resultado[lado]:
+                yield {
+                    "timestamp": analisis["timestamp"],
+                    "symbol": resultado["symbol"],
+                    "lado": lado,
+                    **zona,
+                    "agrupacion": resultado["agrupacion"],
+                    "tick_size": resultado["tick_size"],
+                }
+
+def escribir_salida(analisis, formato, destino, encabezado):
+    """JSON: un documento por línea (una línea por pasada). CSV: una fila por zona"""
+    if formato == "json":
+        destino.write(json.dumps(analisis, ensure_ascii=False) + "\n")
+    else:
+        escritor = csv.DictWriter(destino, fieldnames=COLUMNAS_CSV)
+        if encabezado:
+            escritor.writeheader()
+        escritor.writerows(filas_csv(analisis))
+    destino.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Zonas de shock long/short de los order books (sin GUI)")
+    parser.add_argument("--symbols", default="", help="lista separada por comas (por defecto todos los del servidor)")
+    parser.add_argument("--base-url", default=SERVIDOR_URL)
+    parser.add_argument("--metodo", choices=list(METODOS), default="promedio")
+    parser.add_argument("--agrupacion", action="append", default=[], metavar="SYMBOL=VALOR",
+                        help="agrupación personalizada (se puede repetir)")
+    parser.add_argument("--formato", choices=["json", "csv"], default="json")
+    parser.add_argument("--salida", default="-", help="archivo (se agrega al final) o - para stdout")
+    parser.add_argument("--intervalo", type=float, default=0, help="segundos entre pasadas (0 = una sola)")
+    parser.add_argument("--paralelos", type=int, default=MAX_ANALISIS_PARALELOS)
+    args = parser.parse_args()
+
+    analizador = AnalizadorShocks(args.base_url, args.metodo, max_paralelos=args.paralelos)
+    for item in args.agrupacion:
+        symbol, _, valor = item.partition("=")
+        analizador.agrupaciones_custom[symbol.upper()] = float(valor)
+
+    # Los avisos (print) van a stderr para no mezclarse con el JSON/CSV de stdout
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    if args.salida == "-":
+        destino = stdout
+        encabezado = True
+    else:
+        encabezado = not os.path.exists(args.salida) or os.path.getsize(args.salida) == 0
+        destino = open(args.salida, "a", encoding="utf-8", newline="")
+
+    try:
+        while True:
+            try:
+                symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()] or analizador.symbols_servidor()
+                analisis = analizador.analizar(symbols)
+                escribir_salida(analisis, args.formato, destino, encabezado)
+                encabezado = False
+                t = analisis["tiempos"]
+                print(f"⏱️ {len(analisis['resultados'])} símbolos | metadatos {t['metadatos'] * 1e3:.1f} ms | "
+                      f"libros {t['libros'] * 1e3:.1f} ms | análisis {t['analisis'] * 1e3:.1f} ms"
+                      + (f" | sin datos: {len(analisis['sin_datos'])}" if analisis['sin_datos'] else ""), flush=True)
+            except Exception as e:
+                # Una pasada fallida no detiene el modo periódico; con una sola pasada el error sale tal cual
+                if args.intervalo <= 0:
+                    raise
+                print(f"❌ Error en la pasada: {e}", flush=True)
+            if args.intervalo <= 0:
+                break
+            time.sleep(args.intervalo)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if destino is not stdout:
+            destino.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de contención de locks con carga sintética (sin red).
+
+Compara el esquema anterior (un lock global y lectores que copian el libro
+completo bajo ese lock) contra locks por símbolo + vistas inmutables
+versionadas (libro_ordenes.vista_libro).
+
+Uso:
+    python bench_contencion.py --simbolos 60 --escritores 4 --lectores 8 --segundos 5 --pausa-lector 0.001
+"""
+import argparse
+import random
+import threading
+import time
+
+from libro_ordenes import LadoLibro, CandadoMedido, vista_libro
+
+NIVELES_POR_LADO = 1000
+
+def crear_libro(lock):
+    book = {
+        "bids": LadoLibro(es_bid=True),
+        "asks": LadoLibro(es_bid=False),
+        "lastUpdateId": 1,
+        "last_u": 1,
+        "lock": lock,
+        "version": 0,
+        "vista": None,
+    }
+    for i in range(NIVELES_POR_LADO):
+        book['bids'].actualizar(100_000 - i, 1.0 + i)
+        book['asks'].actualizar(100_001 + i, 1.0 + i)
+    return book
+
+def escritor(books, detener, contador):
+    """Aplica diffs de 10 niveles sin pausa a sus símbolos, como una conexión saturada"""
+    rnd = random.Random()
+    aplicados = 0
+    while not detener.is_set():
+        book = rnd.choice(books)
+        with book['lock']:
+            for _ in range(10):
+                tick = 100_000 + rnd.randint(-NIVELES_POR_LADO, NIVELES_POR_LADO)
+                lado = book['bids'] if tick <= 100_000 else book['asks']
+                lado.actualizar(tick, rnd.choice((0, rnd.random() * 100)))
+            book['last_u'] += 1
+            book['version'] += 1
+        aplicados += 1
+    contador.append(aplicados)
+
+def lector_global(books, detener, contador, pausa):
+    """Lector al estilo anterior: copia el libro entero bajo el lock global"""
+    rnd = random.Random()
+    lecturas = 0
+    while not detener.is_set():
+        book = rnd.choice(books)
+        with book['lock']:
+            # Sólo importa el costo de la copia, no el resultado
+            _ = {t: q for t, q in book['bids'].items()}, {t: q for t, q in book['asks'].items()}
+        lecturas += 1
+        time.sleep(pausa)  # Resto de la petición HTTP
+    contador.append(lecturas)
+
+def lector_vista(books, detener, contador, pausa):
+    """Lector nuevo: usa la vista inmutable de la versión actual"""
+    rnd = random.Random()
+    lecturas = 0
+    while not detener.is_set():
+        vista_libro(rnd.choice(books))
+        lecturas += 1
+        time.sleep(pausa)  # Resto de la petición HTTP
+    contador.append(lecturas)
+
+def ejecutar(modo, n_simbolos, n_escritores, n_lectores, segundos, pausa):
+    if modo == "global":
+        lock_global = CandadoMedido()
+        books = [crear_libro(lock_global) for _ in range(n_simbolos)]
+        locks = [lock_global]
+        lector = lector_global
+    else:
+        books = [crear_libro(CandadoMedido()) for _ in range(n_simbolos)]
+        locks = [b['lock'] for b in books]
+        lector = lector_vista
+
+    detener = threading.Event()
+    escrituras, lecturas = [], []
+    # Cada escritor maneja su propio grupo de símbolos (igual que GestorConexiones)
+    hilos = [threading.Thread(target=escritor, args=(books[i::n_escritores], detener, escrituras)) for i in range(n_escritores)]
+    hilos += [threading.Thread(target=lector, args=(books, detener, lecturas, pausa)) for _ in range(n_lectores)]
+
+    for h in hilos:
+        h.start()
+    time.sleep(segundos)
+    detener.set()
+    for h in hilos:
+        h.join()
+
+    adquisiciones = sum(l.adquisiciones for l in locks)
+    contendidas = sum(l.contendidas for l in locks)
+    espera = sum(l.espera_total for l in locks)
+    print(f"\n📊 Modo: {modo}")
+    print(f"   Updates/s:            {sum(escrituras) / segundos:,.0f}")
+    print(f"   Lecturas/s:           {sum(lecturas) / segundos:,.0f}")
+    print(f"   Adquisiciones lock:   {adquisiciones:,}")
+    print(f"   Con espera:           {contendidas:,} ({contendidas / max(adquisiciones, 1) * 100:.1f}%)")
+    print(f"   Espera total:         {espera * 1000:,.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de contención de locks del order book")
+    parser.add_argument("--simbolos", type=int, default=60)
+    parser.add_argument("--escritores", type=int, default=4)
+    parser.add_argument("--lectores", type=int, default=8)
+    parser.add_argument("--segundos", type=float, default=5)
+    parser.add_argument("--pausa-lector", type=float, default=0.001, help="segundos entre lecturas de cada lector")
+    args = parser.parse_args()
+
+    print(f"🚀 {args.simbolos} símbolos, {args.escritores} escritores, {args.lectores} lectores, {args.segundos}s por modo")
+    for modo in ("global", "por_simbolo"):
+        ejecutar(modo, args.simbolos, args.escritores, args.lectores, args.segundos, args.pausa_lector)
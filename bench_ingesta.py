@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark del camino caliente de ingesta (sin red, un solo hilo = un core).
+
+Compara tres versiones del procesamiento de cada mensaje combinado:
+
+- base: el código original (json.loads, split del stream name, float(qty) en
+  cada nivel y OrderedDict de precios string sin ordenar; el orden se pagaba
+  después, al ordenar el libro entero en cada lectura)
+- sorteddict: la escalera ordenada por tick antes de optimizar la ingesta
+  (json.loads, split, float(qty) y precio -> tick en cada nivel, siempre por
+  los métodos de SortedDict)
+- nuevo: el camino actual (cargar_json, tabla stream -> símbolo, CEROS,
+  ConversorTicks y LadoLibro.actualizar)
+
+La mejora de la optimización de la ingesta es nuevo contra sorteddict; contra
+base el nuevo camino además mantiene el libro ordenado, que base no hacía.
+
+Uso:
+    python bench_ingesta.py --simbolos 60 --mensajes 50000 --niveles 20
+"""
+import argparse
+import json
+import random
+import time
+from collections import OrderedDict
+
+from libro_ordenes import CEROS, ConversorTicks, LadoLibro, cargar_json, decimales_tick, precio_a_tick
+
+TICK_SIZE = 0.0001
+
+def generar_mensajes(simbolos, n_mensajes, niveles_por_mensaje):
+    """Diffs sintéticos alrededor del mid, con ~30% de niveles en cero como en Binance"""
+    rnd = random.Random(1)
+    dec = decimales_tick(TICK_SIZE)
+    mensajes = []
+    for i in range(n_mensajes):
+        symbol = rnd.choice(simbolos)
+        b = [[f"{(10_000 - rnd.randint(1, 200)) * TICK_SIZE:.{dec}f}",
+              "0.000" if rnd.random() < 0.3 else f"{rnd.random() * 1000:.3f}"] for _ in range(niveles_por_mensaje // 2)]
+        a = [[f"{(10_000 + rnd.randint(0, 200)) * TICK_SIZE:.{dec}f}",
+              "0.000" if rnd.random() < 0.3 else f"{rnd.random() * 1000:.3f}"] for _ in range(niveles_por_mensaje // 2)]
+        data = {"e": "depthUpdate", "E": i, "T": i, "s": symbol, "U": i, "u": i, "pu": i - 1, "b": b, "a": a}
+        mensajes.append(json.dumps({"stream": f"{symbol.lower()}@depth@100ms", "data": data}))
+    return mensajes
+
+def crear_libros(simbolos):
+    return {s: {"bids": LadoLibro(es_bid=True), "asks": LadoLibro(es_bid=False),
+                "tick_size": TICK_SIZE, "a_tick": ConversorTicks(TICK_SIZE)} for s in simbolos}
+
+def procesar_base(mensajes, books):
+    """Camino del código original: libros OrderedDict de precio (str) -> qty (str)"""
+    for message in mensajes:
+        parsed = json.loads(message)
+        if 'stream' not in parsed:
+            continue
+        data = parsed['data']
+        symbol = parsed['stream'].split('@')[0].upper()
+        if symbol not in books:
+            continue
+        book = books[symbol]
+        for price, qty in data['b']:
+            if float(qty) == 0:
+                book['bids'].pop(price, None)
+            else:
+                book['bids'][price] = qty
+        for price, qty in data['a']:
+            if float(qty) == 0:
+                book['asks'].pop(price, None)
+            else:
+                book['asks'][price] = qty
+
+def actualizar_anterior(lado, tick, qty):
+    """LadoLibro.actualizar tal como era antes (siempre por los métodos de SortedDict)"""
+    if qty == 0:
+        return lado.niveles.pop(tick, 0)
+    anterior = lado.niveles.get(tick, 0)
+    lado.niveles[tick] = qty
+    return anterior
+
+def procesar_sorteddict(mensajes, books):
+    for message in mensajes:
+        parsed = json.loads(message)
+        if 'stream' not in parsed:
+            continue
+        data = parsed['data']
+        book = books.get(parsed['stream'].split('@')[0].upper())
+        if book is None:
+            continue
+        tick_size = book['tick_size']
+        for price, qty in data['b']:
+            actualizar_anterior(book['bids'], precio_a_tick(price, tick_size), float(qty))
+        for price, qty in data['a']:
+            actualizar_anterior(book['asks'], precio_a_tick(price, tick_size), float(qty))
+
+def procesar_nuevo(mensajes, books, simbolo_por_stream):
+    for message in mensajes:
+        parsed = cargar_json(message)
+        symbol = simbolo_por_stream.get(parsed.get('stream'))
+        if symbol is None:
+            continue
+        data = parsed['data']
+        book = books[symbol]
+        a_tick, bids, asks = book['a_tick'], book['bids'], book['asks']
+        for price, qty in data['b']:
+            bids.actualizar(a_tick(price), 0.0 if qty in CEROS else float(qty))
+        for price, qty in data['a']:
+            asks.actualizar(a_tick(price), 0.0 if qty in CEROS else float(qty))
+
+def medir(nombre, funcion, mensajes, repeticiones):
+    mejor = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion(mensajes)
+        t = time.perf_counter() - t0
+        mejor = t if mejor is None else min(mejor, t)
+    tasa = len(mensajes) / mejor
+    print(f"   {nombre:<12} {tasa:>12,.0f} msg/s   ({mejor / len(mensajes) * 1e6:.2f} µs/msg)")
+    return tasa
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la ingesta de diffs")
+    parser.add_argument("--simbolos", type=int, default=60)
+    parser.add_argument("--mensajes", type=int, default=50_000)
+    parser.add_argument("--niveles", type=int, default=20, help="niveles por mensaje (bids + asks)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    simbolos = [f"SYM{i}USDT" for i in range(args.simbolos)]
+    mensajes = generar_mensajes(simbolos, args.mensajes, args.niveles)
+    simbolo_por_stream = {f"{s.lower()}@depth@100ms": s for s in simbolos}
+
+    print(f"🚀 {args.mensajes:,} mensajes, {args.simbolos} símbolos, {args.niveles} niveles por mensaje")
+    print(f"   Parser: {cargar_json.__module__ or 'json'}")
+    base = medir("base", lambda m: procesar_base(m, {s: {"bids": OrderedDict(), "asks": OrderedDict()} for s in simbolos}),
+                 mensajes, args.repeticiones)
+    anterior = medir("sorteddict", lambda m: procesar_sorteddict(m, crear_libros(simbolos)), mensajes, args.repeticiones)
+    nuevo = medir("nuevo", lambda m: procesar_nuevo(m, crear_libros(simbolos), simbolo_por_stream), mensajes, args.repeticiones)
+    print(f"📊 nuevo vs sorteddict (optimización de la ingesta): x{nuevo / anterior:.2f} por core")
+    print(f"📊 nuevo vs base (código original, sin libro ordenado): x{nuevo / base:.2f} por core")
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la política de retención de niveles (sin red, un solo hilo).
+
+Alimenta un libro con los diffs del simulador (random walk del mid, niveles
+nuevos alrededor del precio) partiendo de su snapshot, como en una sesión
+larga de un símbolo. Compara sin recorte, con máximo de niveles por lado y
+con distancia máxima al mid: niveles y memoria al final, costo por diff y
+tiempo de serializar el libro completo a JSON y a binario.
+
+Uso:
+    python bench_retencion.py --diffs 100000 --max-niveles 1000 --distancia-pct 2
+"""
+import argparse
+import json
+import random
+import time
+
+from libro_ordenes import CEROS, ConversorTicks, LadoLibro, Retencion, codificar_libro, tick_a_precio
+from simulador_binance import SimboloSimulado
+
+TICK_SIZE = 0.001
+
+def simular(n_diffs, niveles_por_diff, retencion, semilla):
+    """Misma semilla = misma secuencia de diffs para todas las políticas"""
+    sim = SimboloSimulado("BENCHUSDT", TICK_SIZE, random.Random(semilla))
+    a_tick = ConversorTicks(TICK_SIZE)
+    bids, asks = LadoLibro(es_bid=True), LadoLibro(es_bid=False)
+    snap = sim.snapshot(1000)
+    for price, qty in snap['bids']:
+        bids.actualizar(a_tick(price), float(qty))
+    for price, qty in snap['asks']:
+        asks.actualizar(a_tick(price), float(qty))
+
+    recortados = 0
+    t_aplicar = 0.0
+    for _ in range(n_diffs):
+        data = sim.siguiente_diff(niveles_por_diff)
+        t0 = time.perf_counter()
+        for price, qty in data['b']:
+            bids.actualizar(a_tick(price), 0.0 if qty in CEROS else float(qty))
+        for price, qty in data['a']:
+            asks.actualizar(a_tick(price), 0.0 if qty in CEROS else float(qty))
+        if retencion is not None:
+            eliminados_bids, eliminados_asks = retencion.recortar(bids, asks)
+            recortados += len(eliminados_bids) + len(eliminados_asks)
+        t_aplicar += time.perf_counter() - t0
+    return bids, asks, t_aplicar / n_diffs, recortados
+
+def medir_serializacion(bids, asks, repeticiones):
+    decimales = 3
+    t0 = time.perf_counter()
+    for _ in range(repeticiones):
+        json.dumps({
+            "bids": {tick_a_precio(t, TICK_SIZE, decimales): q for t, q in bids.items()},
+            "asks": {tick_a_precio(t, TICK_SIZE, decimales): q for t, q in asks.items()},
+        })
+    t_json = (time.perf_counter() - t0) / repeticiones
+
+    t0 = time.perf_counter()
+    for _ in range(repeticiones):
+        codificar_libro(TICK_SIZE, bids.items(), asks.items(), 0, 0)
+    t_binario = (time.perf_counter() - t0) / repeticiones
+    return t_json, t_binario
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la retención de niveles lejanos")
+    parser.add_argument("--diffs", type=int, default=100_000, help="diffs aplicados (864.000 = un día a 100ms)")
+    parser.add_argument("--niveles", type=int, default=10, help="niveles cambiados por diff")
+    parser.add_argument("--max-niveles", type=int, default=1000)
+    parser.add_argument("--distancia-pct", type=float, default=2.0)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    politicas = [
+        ("sin recorte", None),
+        (f"máx. {args.max_niveles} niveles", Retencion(args.max_niveles, 0.0)),
+        (f"distancia {args.distancia_pct:g}%", Retencion(0, args.distancia_pct / 100)),
+    ]
+    print(f"{args.diffs:,} diffs de {args.niveles} niveles sobre un snapshot de 1000 por lado\n")
+    print(f"{'política':<22}{'niveles':>10}{'memoria':>12}{'µs/diff':>10}{'recortados':>12}{'JSON ms':>10}{'binario ms':>12}")
+    for nombre, retencion in politicas:
+        bids, asks, t_diff, recortados = simular(args.diffs, args.niveles, retencion, args.semilla)
+        t_json, t_binario = medir_serializacion(bids, asks, args.repeticiones)
+        niveles = len(bids) + len(asks)
+        memoria = bids.memoria() + asks.memoria()
+        print(f"{nombre:<22}{niveles:>10,}{memoria / 1e3:>9,.0f} KB{t_diff * 1e6:>10.2f}{recortados:>12,}"
+              f"{t_json * 1e3:>10.2f}{t_binario * 1e3:>12.3f}")
+
+if __name__ == "__main__":
+    main()
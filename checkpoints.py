@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints periódicos de los libros en disco para reinicios en caliente.
+
+Un archivo por proceso (checkpoint_<id>.obk, un lote en el formato binario
+de la API: libro_ordenes.codificar_lote) con los niveles completos, el
+lastUpdateId y el last_u de cada libro inicializado. Se escribe en un
+temporal y se reemplaza con os.replace, así nunca queda uno a medias.
+
+Al arrancar se cargan todos los checkpoint_*.obk del directorio (el más
+nuevo gana por símbolo; los shards pueden cambiar de reparto entre
+reinicios). El libro cargado sólo se da por bueno si el primer evento del
+stream encadena con su last_u (pu == last_u): Binance no reenvía diffs
+pasados, así que si hubo cambios durante la parada hace falta el snapshot.
+"""
+import glob
+import os
+import struct
+import time
+
+from libro_ordenes import codificar_libro, codificar_lote, decodificar_lote
+
+PATRON_ARCHIVO = "checkpoint_*.obk"
+
+class GestorCheckpoints:
+    """Guarda y carga los checkpoints de los libros de este proceso"""
+
+    def __init__(self, directorio, nombre, order_books, vista_libro):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.ruta = os.path.join(directorio, f"checkpoint_{nombre}.obk")
+        self.order_books = order_books
+        self.vista_libro = vista_libro
+        self.guardados = 0
+
+    def codificar(self):
+        """Lote con los libros inicializados (la vista inmutable no retiene el lock del símbolo)"""
+        libros = {}
+        for symbol, book in list(self.order_books.items()):
+            if not book['initialized']:
+                continue
+            vista = self.vista_libro(book)
+            libros[symbol] = codificar_libro(book['tick_size'], vista.bids, vista.asks, vista.lastUpdateId, vista.last_u)
+        return codificar_lote(libros), len(libros)
+
+    def escribir(self, datos):
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'wb') as f:
+            f.write(datos)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+        self.guardados += 1
+
+    def guardar(self):
+        datos, n = self.codificar()
+        self.escribir(datos)
+        return n
+
+    def cargar(self):
+        """Devuelve dict symbol -> (libro decodificado, antigüedad en segundos)"""
+        libros = {}
+        archivos = sorted(glob.glob(os.path.join(self.directorio, PATRON_ARCHIVO)), key=os.path.getmtime)
+        for archivo in archivos:
+            try:
+                with open(archivo, 'rb') as f:
+                    datos = f.read()
+                antiguedad = time.time() - os.path.getmtime(archivo)
+                for symbol, libro in decodificar_lote(datos).items():
+                    libros[symbol] = (libro, antiguedad)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"⚠️ Checkpoint ilegible {archivo}: {e}")
+        return libros
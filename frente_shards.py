@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Modo multi-proceso (OB_SHARDS=N): reparte los símbolos entre N procesos
+worker, cada uno con sus propias conexiones de streams, sus libros y su API
+en un puerto local, y expone en el puerto público una API única que enruta
+cada petición al shard del símbolo.
+
+Cada worker es el mismo "Order book v2.py" arrancado con:
+- OB_UNIVERSO: símbolos y tickSizes del shard (no vuelve a consultar a Binance)
+- OB_HOST / OB_PUERTO: su API en 127.0.0.1, puerto base + índice
+- OB_PESO_MAX_MINUTO / OB_SNAPSHOT_CONCURRENCIA: su parte del límite de
+  peso, que Binance cuenta por IP y no por proceso
+- OB_PESO_MAX_IP: el límite de toda la IP, para interpretar el peso usado
+  que informa Binance (X-MBX-USED-WEIGHT-1M suma el de todos los workers)
+
+El frente habla con los workers por HTTP keep-alive en loopback (httpx);
+el streaming (/ws, /sse) se consume directamente del shard (ver /shards).
+Requiere: pip install httpx
+"""
+import asyncio
+import atexit
+import contextlib
+import json
+import os
+import signal
+import subprocess
+import sys
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from libro_ordenes import MEDIA_TYPE_BINARIO, unir_lotes
+
+class Shard:
+    __slots__ = ('idx', 'symbols', 'puerto', 'proceso', 'reinicios')
+
+    def __init__(self, idx, symbols, puerto):
+        self.idx = idx
+        self.symbols = symbols
+        self.puerto = puerto
+        self.proceso = None
+        self.reinicios = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.puerto}"
+
+class GestorShards:
+    """Lanza, vigila y relanza los procesos worker"""
+
+    def __init__(self, script, coins, tick_sizes, n_shards, puerto_base, peso_max_minuto, concurrencia):
+        self.script = script
+        self.tick_sizes = tick_sizes
+        self.peso_max_minuto = peso_max_minuto
+        self.concurrencia = concurrencia
+        # Reparto round-robin: coins viene ordenado como los tickers, así cada shard recibe una mezcla parecida
+        self.shards = [Shard(i, coins[i::n_shards], puerto_base + i) for i in range(n_shards)]
+        self.shard_de = {symbol: shard for shard in self.shards for symbol in shard.symbols}
+
+    def entorno(self, shard):
+        n = len(self.shards)
+        env = dict(os.environ)
+        env.update(
+            OB_SHARDS="1",
+            OB_SHARD_ID=str(shard.idx),
+            OB_UNIVERSO=json.dumps({
+                "coins": shard.symbols,
+                "tick_sizes": {s: self.tick_sizes[s] for s in shard.symbols if s in self.tick_sizes},
+            }),
+            OB_HOST="127.0.0.1",
+            OB_PUERTO=str(shard.puerto),
+            OB_PESO_MAX_MINUTO=str(max(self.peso_max_minuto // n, 20)),
+            OB_PESO_MAX_IP=str(self.peso_max_minuto),
+            OB_SNAPSHOT_CONCURRENCIA=str(max(self.concurrencia // n, 1)),
+        )
+        # Cada worker graba en su propio subdirectorio
+        if env.get("OB_GRABAR_DIR"):
+            env["OB_GRABAR_DIR"] = os.path.join(env["OB_GRABAR_DIR"], f"shard_{shard.idx}")
+        return env
+
+    def lanzar(self, shard):
+        shard.proceso = subprocess.Popen([sys.executable, self.script], env=self.entorno(shard))
+        print(f"🧩 Shard {shard.idx}: {len(shard.symbols)} símbolos en {shard.url} (pid {shard.proceso.pid})")
+
+    def iniciar(self):
+        for shard in self.shards:
+            self.lanzar(shard)
+        atexit.register(self.detener)
+        # Con el manejador por defecto SIGTERM mata el proceso sin pasar por atexit (uvicorn
+        # lo vuelve a emitir tras su apagado): como salida normal, los workers se detienen
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    def detener(self):
+        for shard in self.shards:
+            if shard.proceso is not None and shard.proceso.poll() is None:
+                shard.proceso.terminate()
+        for shard in self.shards:
+            if shard.proceso is not None:
+                try:
+                    shard.proceso.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    shard.proceso.kill()
+
+    async def vigilar(self, cada=5):
+        """Relanza los workers que terminaron (sus símbolos se resincronizan desde cero)"""
+        while True:
+            await asyncio.sleep(cada)
+            for shard in self.shards:
+                codigo = shard.proceso.poll()
+                if codigo is not None:
+                    shard.reinicios += 1
+                    print(f"💀 Shard {shard.idx} terminó (código {codigo}), relanzando (reinicio {shard.reinicios})...")
+                    self.lanzar(shard)
+
+def _fusionar_metricas(textos):
+    """Une los /metrics de los shards: un HELP/TYPE por familia y etiqueta shard en las globales"""
+    familias = {}
+    for idx, texto in textos:
+        actual = None
+        for linea in texto.splitlines():
+            if linea.startswith("# HELP ") or linea.startswith("# TYPE "):
+                nombre = linea.split(" ", 3)[2]
+                actual = familias.setdefault(nombre, {"HELP": None, "TYPE": None, "muestras": []})
+                actual[linea[2:6]] = linea
+            elif linea and actual is not None:
+                nombre, valor = linea.rsplit(" ", 1)
+                if "{" not in nombre:
+                    nombre = f'{nombre}{{shard="{idx}"}}'
+                actual["muestras"].append(f"{nombre} {valor}")
+    partes = []
+    for familia in familias.values():
+        partes += [familia["HELP"], familia["TYPE"], *familia["muestras"]]
+    return "\n".join(partes) + "\n"
+
+def crear_app_frente(gestor):
+    import httpx
+
+    estado = {}
+
+    @contextlib.asynccontextmanager
+    async def ciclo_de_vida(app):
+        n = len(gestor.shards)
+        estado["cliente"] = httpx.AsyncClient(
+            timeout=10, limits=httpx.Limits(max_connections=32 * n, max_keepalive_connections=16 * n))
+        vigilancia = asyncio.create_task(gestor.vigilar())
+        yield
+        vigilancia.cancel()
+        await estado["cliente"].aclose()
+
+    app = FastAPI(lifespan=ciclo_de_vida)
+
+    def respuesta(resp):
+        return Response(resp.content, status_code=resp.status_code,
+                        media_type=resp.headers.get("content-type"))
+
+    async def reenviar(request, symbol):
+        """Pasa la petición tal cual al shard del símbolo"""
+        shard = gestor.shard_de.get(symbol.upper())
+        if shard is None:
+            return JSONResponse({"error": "Símbolo no monitoreado"}, status_code=404)
+        try:
+            resp = await estado["cliente"].request(
+                request.method, shard.url + request.url.path, params=request.query_params,
+                headers={"accept": request.headers.get("accept", "*/*")})
+        except httpx.HTTPError:
+            return JSONResponse({"error": f"Shard {shard.idx} no disponible"}, status_code=503)
+        return respuesta(resp)
+
+    async def de_todos(ruta, params=None, headers=None):
+        """GET a todos los shards en paralelo; devuelve [(shard, respuesta o None)]"""
+        async def pedir(shard):
+            try:
+                return shard, await estado["cliente"].get(shard.url + ruta, params=params, headers=headers)
+            except httpx.HTTPError:
+                return shard, None
+        return await asyncio.gather(*(pedir(shard) for shard in gestor.shards))
+
+    @app.get("/orderbooks/{symbol}")
+    async def get_orderbook(request: Request, symbol: str):
+        return await reenviar(request, symbol)
+
+    @app.get("/orderbooks/{symbol}/grouped")
+    async def get_orderbook_grouped(request: Request, symbol: str):
+        return await reenviar(request, symbol)
+
+    @app.post("/orderbooks/{symbol}/steps")
+    async def registrar_step(request: Request, symbol: str):
+        return await reenviar(request, symbol)
+
+    @app.delete("/orderbooks/{symbol}/steps")
+    async def eliminar_step(request: Request, symbol: str):
+        return await reenviar(request, symbol)
+
+    @app.get("/orderbooks")
+    async def get_orderbooks(request: Request, symbols: str):
+        """
+        Parte el lote por shard, lo pide en paralelo y une las respuestas: los
+        lotes binarios se concatenan tal cual, el JSON se parsea para fusionarlo
+        """
+        por_shard, errores = {}, {}
+        for symbol in symbols.upper().split(','):
+            symbol = symbol.strip()
+            if not symbol:
+                continue
+            shard = gestor.shard_de.get(symbol)
+            if shard is None:
+                errores[symbol] = "Símbolo no monitoreado"
+            else:
+                por_shard.setdefault(shard, []).append(symbol)
+
+        binario = MEDIA_TYPE_BINARIO in request.headers.get("accept", "")
+        headers = {"accept": MEDIA_TYPE_BINARIO if binario else "application/json"}
+
+        async def pedir(shard, lista):
+            params = dict(request.query_params)
+            params["symbols"] = ",".join(lista)
+            try:
+                return shard, lista, await estado["cliente"].get(shard.url + "/orderbooks", params=params, headers=headers)
+            except httpx.HTTPError:
+                return shard, lista, None
+
+        orderbooks, lotes = {}, []
+        for shard, lista, resp in await asyncio.gather(*(pedir(s, l) for s, l in por_shard.items())):
+            if resp is None or resp.status_code != 200:
+                for symbol in lista:
+                    errores[symbol] = f"Shard {shard.idx} no disponible"
+            elif binario:
+                lotes.append(resp.content)
+            else:
+                datos = resp.json()
+                orderbooks.update(datos["orderbooks"])
+                errores.update(datos["errores"])
+
+        if binario:
+            return Response(unir_lotes(lotes), media_type=MEDIA_TYPE_BINARIO)
+        return JSONResponse({"orderbooks": orderbooks, "errores": errores})
+
+    @app.get("/symbols")
+    async def get_symbols():
+        symbols, initialized, pending, buffers = [], [], [], {}
+        for shard, resp in await de_todos("/symbols"):
+            if resp is None or resp.status_code != 200:
+                symbols += shard.symbols
+                pending += shard.symbols
+                continue
+            datos = resp.json()
+            symbols += datos["symbols"]
+            initialized += datos["initialized"]
+            pending += datos["pending"]
+            buffers.update(datos["buffers"])
+        return {"symbols": symbols, "initialized": initialized, "pending": pending, "buffers": buffers}
+
+    @app.get("/symbols/metadata")
+    async def get_symbols_metadata():
+        symbols = {}
+        for shard, resp in await de_todos("/symbols/metadata"):
+            if resp is not None and resp.status_code == 200:
+                symbols.update(resp.json()["symbols"])
+            else:
+                symbols.update({s: {"tick_size": gestor.tick_sizes.get(s), "mid": None, "initialized": False}
+                                for s in shard.symbols})
+        return {"symbols": symbols}
+
+    @app.get("/contencion")
+    async def get_contencion():
+        resultado = {}
+        for _, resp in await de_todos("/contencion"):
+            if resp is not None and resp.status_code == 200:
+                resultado.update(resp.json())
+        return resultado
+
+    @app.get("/metrics")
+    async def get_metrics():
+        textos = [(shard.idx, resp.text) for shard, resp in await de_todos("/metrics")
+                  if resp is not None and resp.status_code == 200]
+        return Response(_fusionar_metricas(textos), media_type="text/plain; version=0.0.4")
+
+    @app.get("/shards")
+    async def get_shards():
+        """Shard de cada símbolo (para conectarse directo a /ws y /sse del worker)"""
+        return {
+            "shards": [
+                {"shard": s.idx, "url": s.url, "symbols": s.symbols, "activo": s.proceso.poll() is None, "reinicios": s.reinicios}
+                for s in gestor.shards
+            ],
+        }
+
+    return app
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Grabación y lectura de los streams de profundidad en crudo.
+
+Archivos gzip append-only, uno por hora (grabacion_AAAAMMDD_HH.tsv.gz), con
+una línea por evento separada por tabs:
+
+    timestamp  tipo  symbol  payload
+
+- meta: al abrir cada archivo y cuando cambia el universo; payload = {"coins": [...], "tick_sizes": {...}}
+- ws:   mensaje combinado tal como llegó del websocket (symbol vacío)
+- snap: cuerpo de la respuesta REST de /fapi/v1/depth
+
+Así cada archivo se puede reproducir por sí solo.
+"""
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+
+FORMATO_ARCHIVO = "grabacion_%Y%m%d_%H.tsv.gz"
+
+class Grabador:
+    """
+    Graba mensajes y snapshots desde un hilo propio: la ingesta sólo toma el
+    timestamp y encola, la compresión y la escritura no la frenan.
+    """
+
+    def __init__(self, directorio, coins=(), tick_sizes=None):
+        self.directorio = directorio
+        self.meta = json.dumps({"coins": list(coins), "tick_sizes": dict(tick_sizes or {})})
+        self.cola = queue.SimpleQueue()
+        self.archivo = None
+        self.nombre = None
+        self.grabados = 0
+
+    def iniciar(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        threading.Thread(target=self.escribir, daemon=True).start()
+        print(f"🎙️ Grabando streams y snapshots en {self.directorio}")
+
+    def universo(self, coins, tick_sizes):
+        """Nuevo universo: va en la cabecera de los próximos archivos y, si ya hay uno abierto, como línea meta"""
+        self.meta = json.dumps({"coins": list(coins), "tick_sizes": dict(tick_sizes)})
+        if self.nombre is not None:
+            self.cola.put((time.time(), "meta", "", self.meta))
+
+    def mensaje(self, raw):
+        self.cola.put((time.time(), "ws", "", raw))
+
+    def snapshot(self, symbol, contenido):
+        if isinstance(contenido, bytes):
+            contenido = contenido.decode('utf-8')
+        self.cola.put((time.time(), "snap", symbol, contenido))
+
+    def _archivo_para(self, t):
+        nombre = time.strftime(FORMATO_ARCHIVO, time.gmtime(t))
+        if nombre != self.nombre:
+            if self.archivo is not None:
+                self.archivo.close()
+            # 'at' agrega un nuevo miembro gzip si el archivo ya existía
+            self.archivo = gzip.open(os.path.join(self.directorio, nombre), 'at', encoding='utf-8')
+            self.nombre = nombre
+            self.archivo.write(f"{t:.6f}\tmeta\t\t{self.meta}\n")
+        return self.archivo
+
+    def escribir(self):
+        ultimo_flush = time.time()
+        while True:
+            try:
+                t, tipo, symbol, payload = self.cola.get(timeout=1)
+            except queue.Empty:
+                t = None
+            else:
+                self._archivo_para(t).write(f"{t:.6f}\t{tipo}\t{symbol}\t{payload}\n")
+                self.grabados += 1
+            # Flush cada segundo para que lo grabado sea legible aunque el proceso muera
+            ahora = time.time()
+            if self.archivo is not None and ahora - ultimo_flush >= 1:
+                self.archivo.flush()
+                ultimo_flush = ahora
+
+def archivos_grabacion(ruta):
+    """Un archivo o todos los de un directorio, en orden cronológico"""
+    if os.path.isdir(ruta):
+        return sorted(glob.glob(os.path.join(ruta, "grabacion_*.tsv.gz")))
+    return [ruta]
+
+def leer_grabacion(ruta):
+    """Genera (timestamp, tipo, symbol, payload) de los archivos de la grabación"""
+    for archivo in archivos_grabacion(ruta):
+        try:
+            with gzip.open(archivo, 'rt', encoding='utf-8') as f:
+                for linea in f:
+                    if not linea.endswith('\n'):
+                        break  # Última línea cortada por un cierre abrupto
+                    t, tipo, symbol, payload = linea[:-1].split('\t', 3)
+                    yield float(t), tipo, symbol, payload
+        except (EOFError, gzip.BadGzipFile):
+            # El proceso que grababa murió a mitad de un bloque: se usa lo leído
+            print(f"⚠️ {archivo} termina incompleto, se reproduce hasta donde se pudo leer")
+
+def leer_meta(ruta):
+    """Devuelve (coins, tick_sizes) del primer archivo de la grabación"""
+    for _, tipo, _, payload in leer_grabacion(ruta):
+        if tipo == "meta":
+            meta = json.loads(payload)
+            return meta["coins"], meta["tick_sizes"]
+    raise ValueError(f"No se encontró la cabecera meta en {ruta}")
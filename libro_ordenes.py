@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""Estructuras del libro de órdenes: un lado del libro ordenado por tick entero."""
+import json
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import deque, namedtuple
+from itertools import islice
+from sortedcontainers import SortedDict
+
+# orjson (opcional) parsea los mensajes del stream bastante más rápido que json
+try:
+    import orjson
+    cargar_json = orjson.loads
+except ImportError:
+    cargar_json = json.loads
+
+# ---------- CONVERSIÓN DE PRECIOS ----------
+
+def decimales_tick(tick_size):
+    """Cantidad de decimales de un tickSize ("0.00010" -> 4)"""
+    s = f"{float(tick_size):.10f}".rstrip('0')
+    return len(s.split('.')[1]) if '.' in s else 0
+
+def precio_a_tick(precio, tick_size):
+    """Convierte un precio (str o float) a su índice de tick entero"""
+    return int(round(float(precio) / tick_size))
+
+def tick_a_precio(tick, tick_size, decimales):
+    """Convierte un índice de tick al string de precio con los decimales del símbolo"""
+    return f"{tick * tick_size:.{decimales}f}"
+
+# Cantidades cero tal como llegan en los diffs ("0", "0.0", ..., "0.0000000000").
+# 'qty in CEROS' sólo hashea el string: no crea un float por nivel eliminado.
+CEROS = frozenset(["0"] + ["0." + "0" * n for n in range(1, 11)])
+
+class ConversorTicks:
+    """
+    Convierte los strings de precio de un símbolo a tick entero una sola vez.
+    Los precios cerca del mid se repiten en casi todos los diffs, así que la
+    conversión se cachea; al llenarse la caché se vacía y se vuelve a poblar.
+    """
+    __slots__ = ('tick_size', 'cache', 'capacidad')
+
+    def __init__(self, tick_size, capacidad=8192):
+        self.tick_size = tick_size
+        self.cache = {}  # precio (str) -> tick
+        self.capacidad = capacidad
+
+    def __call__(self, precio):
+        tick = self.cache.get(precio)
+        if tick is None:
+            cache = self.cache
+            if len(cache) >= self.capacidad:
+                cache.clear()
+            tick = cache[precio] = int(round(float(precio) / self.tick_size))
+        return tick
+
+# ---------- LADO DEL LIBRO ----------
+
+# Acceso directo al dict de SortedDict para los niveles que ya existen
+_dict_get = dict.get
+_dict_setitem = dict.__setitem__
+
+class LadoLibro:
+    """
+    Un lado del libro (bids o asks) con los niveles ordenados por tick entero.
+
+    - Actualizaciones en O(log n)
+    - Mejor precio en O(1)
+    - Top N y rangos de precio sin reordenar el libro
+
+    Todos los recorridos devuelven los niveles desde el mejor precio:
+    de mayor a menor en bids y de menor a mayor en asks.
+    """
+    __slots__ = ('niveles', 'es_bid')
+
+    def __init__(self, es_bid):
+        self.niveles = SortedDict()  # tick -> qty (float)
+        self.es_bid = es_bid
+
+    def __len__(self):
+        return len(self.niveles)
+
+    def actualizar(self, tick, qty):
+        """Fija la cantidad de un nivel (qty == 0 lo elimina); devuelve la cantidad anterior"""
+        niveles = self.niveles
+        anterior = _dict_get(niveles, tick)
+        if anterior is None:
+            if qty == 0:
+                return 0
+            niveles[tick] = qty  # Nivel nuevo: también entra en la lista ordenada
+            return 0
+        if qty == 0:
+            del niveles[tick]
+        else:
+            # Nivel existente: sólo cambia la cantidad, el orden no se toca
+            _dict_setitem(niveles, tick, qty)
+        return anterior
+
+    def clear(self):
+        self.niveles.clear()
+
+    def mejor(self):
+        """Devuelve (tick, qty) del mejor nivel o None si el lado está vacío"""
+        if not self.niveles:
+            return None
+        return self.niveles.peekitem(-1 if self.es_bid else 0)
+
+    def top(self, n):
+        """Los n mejores niveles como lista de (tick, qty)"""
+        niveles = self.niveles
+        if self.es_bid:
+            ticks = niveles.islice(-n, None, reverse=True) if n > 0 else ()
+        else:
+            ticks = niveles.islice(0, n)
+        return [(t, niveles[t]) for t in ticks]
+
+    def rango(self, tick_min=None, tick_max=None, limite=None):
+        """Niveles con tick_min <= tick <= tick_max (None = sin límite), como mucho 'limite' niveles"""
+        niveles = self.niveles
+        ticks = islice(niveles.irange(tick_min, tick_max, reverse=self.es_bid), limite)
+        return [(t, niveles[t]) for t in ticks]
+
+    def items(self):
+        """Todos los niveles como lista de (tick, qty) desde el mejor precio"""
+        niveles = self.niveles
+        ticks = reversed(niveles) if self.es_bid else niveles
+        return [(t, niveles[t]) for t in ticks]
+
+    def recortar(self, max_niveles=0, tick_limite=None):
+        """
+        Elimina los niveles más alejados del mejor precio: los que sobran por
+        encima de max_niveles (0 = sin límite) y los que quedan más allá de
+        tick_limite (por debajo en bids, por encima en asks).
+        Devuelve la lista de (tick, qty) eliminados.
+        """
+        niveles = self.niveles
+        peor = 0 if self.es_bid else -1
+        eliminados = []
+        if max_niveles:
+            while len(niveles) > max_niveles:
+                eliminados.append(niveles.popitem(peor))
+        if tick_limite is not None:
+            while niveles:
+                tick = niveles.peekitem(peor)[0]
+                if (tick >= tick_limite) if self.es_bid else (tick <= tick_limite):
+                    break
+                eliminados.append(niveles.popitem(peor))
+        return eliminados
+
+    def memoria(self):
+        """
+        Bytes aproximados del lado: tabla hash del dict, listas internas de
+        SortedList y los objetos int (tick) y float (qty) de cada nivel.
+        """
+        niveles = self.niveles
+        lista = niveles._list
+        total = sys.getsizeof(niveles) + sys.getsizeof(lista._lists) + sys.getsizeof(lista._maxes)
+        total += sum(sys.getsizeof(sublista) for sublista in lista._lists)
+        return total + len(niveles) * (_BYTES_INT + _BYTES_FLOAT)
+
+_BYTES_INT = sys.getsizeof(10 ** 9)
+_BYTES_FLOAT = sys.getsizeof(1.0)
+
+class Retencion:
+    """
+    Política de retención de niveles lejanos del mid. Los diffs de Binance
+    agregan cualquier nivel que cambie, también muy lejos del precio, y nadie
+    los vuelve a borrar: sin recorte el libro crece toda la sesión.
+
+    - max_niveles: niveles máximos por lado (0 = sin límite)
+    - distancia: fracción máxima de distancia al mid (0.05 = 5%; 0 = sin límite)
+
+    Se aplica una vez por mensaje: con el libro dentro del límite cuesta un
+    len() y, con distancia, un peekitem por lado.
+    """
+    __slots__ = ('max_niveles', 'distancia')
+
+    def __init__(self, max_niveles=0, distancia=0.0):
+        self.max_niveles = max_niveles
+        self.distancia = distancia
+
+    def recortar(self, bids, asks):
+        """Devuelve (bids eliminados, asks eliminados) como listas de (tick, qty)"""
+        limite_bid = limite_ask = None
+        if self.distancia:
+            mejor_bid, mejor_ask = bids.mejor(), asks.mejor()
+            if mejor_bid is not None and mejor_ask is not None:
+                mid = (mejor_bid[0] + mejor_ask[0]) / 2
+                limite_bid = mid * (1 - self.distancia)
+                limite_ask = mid * (1 + self.distancia)
+        return bids.recortar(self.max_niveles, limite_bid), asks.recortar(self.max_niveles, limite_ask)
+
+# ---------- BUFFER DE EVENTOS ----------
+
+class BufferEventos:
+    """
+    Buffer circular acotado con los eventos de profundidad recibidos mientras
+    el símbolo espera su snapshot. Append y recorte por 'u' en O(1) amortizado.
+
+    Política de desborde: se descarta el evento más antiguo y se marca
+    'desbordado'; la ingesta pide un resync al desbordarse y la inicialización
+    reintenta sin espera si ya no se puede enlazar el snapshot con los eventos
+    que quedan.
+    """
+    __slots__ = ('eventos', 'capacidad', 'desbordado', 'descartados')
+
+    def __init__(self, capacidad):
+        self.eventos = deque()
+        self.capacidad = capacidad
+        self.desbordado = False
+        self.descartados = 0  # total histórico de eventos perdidos por desborde
+
+    def __len__(self):
+        return len(self.eventos)
+
+    def __iter__(self):
+        return iter(self.eventos)
+
+    def agregar(self, evento):
+        """Agrega un evento; devuelve True si hubo que descartar el más antiguo"""
+        eventos = self.eventos
+        eventos.append(evento)
+        if len(eventos) > self.capacidad:
+            eventos.popleft()
+            self.descartados += 1
+            self.desbordado = True
+            return True
+        return False
+
+    def descartar_hasta(self, u):
+        """Descarta del inicio los eventos con e['u'] < u"""
+        eventos = self.eventos
+        while eventos and eventos[0]['u'] < u:
+            eventos.popleft()
+
+    def primero(self):
+        return self.eventos[0] if self.eventos else None
+
+    def clear(self):
+        self.eventos.clear()
+        self.desbordado = False
+
+# ---------- CONCURRENCIA ----------
+
+class CandadoMedido:
+    """
+    Lock por símbolo que mide la contención: cuántas veces hubo que esperar
+    y cuánto tiempo en total. El camino sin contención sólo cuesta un
+    acquire no bloqueante.
+    """
+    __slots__ = ('_lock', 'adquisiciones', 'contendidas', 'espera_total')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.adquisiciones = 0
+        self.contendidas = 0
+        self.espera_total = 0.0  # segundos
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            t0 = time.perf_counter()
+            self._lock.acquire()
+            self.espera_total += time.perf_counter() - t0
+            self.contendidas += 1
+        self.adquisiciones += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+    def estadisticas(self):
+        return {
+            "adquisiciones": self.adquisiciones,
+            "contendidas": self.contendidas,
+            "espera_total_ms": round(self.espera_total * 1000, 3),
+        }
+
+# Snapshot inmutable de un libro: niveles como tuplas de (tick, qty) desde el mejor precio
+VistaLibro = namedtuple('VistaLibro', 'version bids asks lastUpdateId last_u')
+
+def vista_libro(book):
+    """
+    Devuelve la vista inmutable del libro para lectores. Se reutiliza mientras
+    no cambie book['version'], así que con muchos lectores sólo el primero de
+    cada versión copia el libro (bajo el lock del símbolo) y el resto no toca
+    el lock: los lectores nunca frenan la ingesta de otros símbolos.
+    """
+    vista = book['vista']
+    if vista is not None and vista.version == book['version']:
+        return vista
+    with book['lock']:
+        vista = VistaLibro(
+            book['version'],
+            tuple(book['bids'].items()),
+            tuple(book['asks'].items()),
+            book['lastUpdateId'],
+            book['last_u'],
+        )
+        book['vista'] = vista
+    return vista
+
+# ---------- FORMATO BINARIO ----------
+# Libro empaquetado en arrays little-endian alineados a 8 bytes:
+#   cabecera (40 bytes): magic 'OBK1', reservado u32, tick_size f64,
+#                        lastUpdateId i64, last_u i64 (-1 = None), n_bids u32, n_asks u32
+#   cuerpo: ticks bids i64[n_bids], qty bids f64[n_bids], ticks asks i64[n_asks], qty asks f64[n_asks]
+# Niveles ordenados desde el mejor precio; precio = tick * tick_size.
+#
+# Lote de varios libros: 'OBKB' + cantidad u32, y por cada libro el símbolo
+# (32 bytes ASCII rellenos con \0) seguido de su libro.
+
+MEDIA_TYPE_BINARIO = "application/x-orderbook"
+
+_CABECERA = struct.Struct('<4sIdqqII')
+_CABECERA_LOTE = struct.Struct('<4sI')
+_NOMBRE = struct.Struct('<32s')
+
+def _arrays_lado(niveles):
+    ticks = array('q', (t for t, _ in niveles))
+    qtys = array('d', (q for _, q in niveles))
+    if sys.byteorder != 'little':
+        ticks.byteswap()
+        qtys.byteswap()
+    return ticks.tobytes(), qtys.tobytes()
+
+def codificar_libro(tick_size, bids, asks, lastUpdateId, last_u):
+    """Empaqueta niveles (tick, qty) en el formato binario"""
+    cabecera = _CABECERA.pack(
+        b'OBK1', 0, tick_size,
+        lastUpdateId if lastUpdateId is not None else -1,
+        last_u if last_u is not None else -1,
+        len(bids), len(asks),
+    )
+    return b''.join((cabecera, *_arrays_lado(bids), *_arrays_lado(asks)))
+
+def decodificar_libro(datos, offset=0):
+    """
+    Lee un libro binario desde 'offset'. Devuelve (libro, offset siguiente).
+    Los arrays son memoryviews sobre 'datos' sin copiar (en hosts little-endian);
+    numpy.frombuffer(libro['bids_ticks'], '<i8') también los lee sin copia.
+    """
+    magia, _, tick_size, lastUpdateId, last_u, n_bids, n_asks = _CABECERA.unpack_from(datos, offset)
+    if magia != b'OBK1':
+        raise ValueError("Formato binario de libro no reconocido")
+    vista = memoryview(datos)
+    offset += _CABECERA.size
+    arrays = []
+    for n, formato in ((n_bids, 'q'), (n_bids, 'd'), (n_asks, 'q'), (n_asks, 'd')):
+        arrays.append(vista[offset:offset + 8 * n].cast(formato))
+        offset += 8 * n
+    libro = {
+        "tick_size": tick_size,
+        "lastUpdateId": lastUpdateId if lastUpdateId != -1 else None,
+        "last_u": last_u if last_u != -1 else None,
+        "bids_ticks": arrays[0],
+        "bids_qty": arrays[1],
+        "asks_ticks": arrays[2],
+        "asks_qty": arrays[3],
+    }
+    return libro, offset
+
+def codificar_lote(libros):
+    """libros: dict symbol -> bytes de codificar_libro"""
+    partes = [_CABECERA_LOTE.pack(b'OBKB', len(libros))]
+    for symbol, datos in libros.items():
+        partes.append(_NOMBRE.pack(symbol.encode('ascii')))
+        partes.append(datos)
+    return b''.join(partes)
+
+def unir_lotes(lotes):
+    """Une varios lotes en uno copiando los libros tal cual, sin separarlos por símbolo"""
+    total = 0
+    for datos in lotes:
+        magia, cantidad = _CABECERA_LOTE.unpack_from(datos, 0)
+        if magia != b'OBKB':
+            raise ValueError("Formato binario de lote no reconocido")
+        total += cantidad
+    cuerpos = (memoryview(datos)[_CABECERA_LOTE.size:] for datos in lotes)
+    return b''.join((_CABECERA_LOTE.pack(b'OBKB', total), *cuerpos))
+
+def decodificar_lote(datos):
+    """Devuelve dict symbol -> libro (ver decodificar_libro)"""
+    magia, cantidad = _CABECERA_LOTE.unpack_from(datos, 0)
+    if magia != b'OBKB':
+        raise ValueError("Formato binario de lote no reconocido")
+    offset = _CABECERA_LOTE.size
+    libros = {}
+    for _ in range(cantidad):
+        symbol = _NOMBRE.unpack_from(datos, offset)[0].rstrip(b'\0').decode('ascii')
+        libros[symbol], offset = decodificar_libro(datos, offset + _NOMBRE.size)
+    return libros
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Libros publicados en memoria compartida para lectores locales (sin HTTP).
+
+Un archivo mapeado por símbolo (<directorio>/<SYMBOL>.ob; en Linux conviene
+/dev/shm para que viva en RAM) con arrays de tamaño fijo, en el orden de
+bytes nativo de la máquina:
+
+    cabecera (64 bytes): magic 'OBSM', versión u32, seq u64, tick_size f64,
+                         lastUpdateId i64, last_u i64 (-1 = None), n_bids u32,
+                         n_asks u32, capacidad u32, inicializado u32, publicado f64 (epoch)
+    cuerpo: ticks bids i64[cap], qty bids f64[cap], ticks asks i64[cap], qty asks f64[cap]
+
+Niveles desde el mejor precio, como en el formato binario de la API.
+Seqlock: el escritor pone seq impar mientras escribe y par al terminar; el
+lector descarta la lectura si seq era impar o cambió entre el principio y el
+final. Hay un único escritor por archivo (el servidor que tiene el símbolo).
+"""
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import deque
+
+VERSION_FORMATO = 1
+_CABECERA = struct.Struct('=4sIQdqqIIIId')
+_SEQ = struct.Struct('=Q')
+_OFFSET_SEQ = 8
+
+def ruta_simbolo(directorio, symbol):
+    return os.path.join(directorio, f"{symbol}.ob")
+
+def tamano_region(capacidad):
+    return _CABECERA.size + 32 * capacidad
+
+def _offsets(capacidad):
+    """Inicio de los cuatro arrays del cuerpo"""
+    base = _CABECERA.size
+    return base, base + 8 * capacidad, base + 16 * capacidad, base + 24 * capacidad
+
+# ---------- ESCRITOR ----------
+
+class RegionLibro:
+    """Región mapeada de un símbolo del lado del escritor"""
+    __slots__ = ('mm', 'seq', 'capacidad', 'offsets', 'version_publicada')
+
+    def __init__(self, directorio, symbol, capacidad):
+        tamano = tamano_region(capacidad)
+        ruta = ruta_simbolo(directorio, symbol)
+        if os.path.exists(ruta) and os.path.getsize(ruta) == tamano:
+            # Se reutiliza el archivo (los lectores que lo tienen mapeado siguen viéndolo)
+            with open(ruta, 'r+b') as f:
+                self.mm = mmap.mmap(f.fileno(), tamano)
+            seq = _SEQ.unpack_from(self.mm, _OFFSET_SEQ)[0]
+            self.seq = seq + (seq & 1)  # Si el escritor anterior murió a mitad de una escritura
+        else:
+            # Tamaño distinto: archivo nuevo y reemplazo atómico (nunca se achica uno mapeado)
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            with open(temporal, 'w+b') as f:
+                f.truncate(tamano)
+            os.replace(temporal, ruta)
+            with open(ruta, 'r+b') as f:
+                self.mm = mmap.mmap(f.fileno(), tamano)
+            self.seq = 0
+        self.capacidad = capacidad
+        self.offsets = _offsets(capacidad)
+        self.version_publicada = None
+        self.escribir(0.0, None, None, (), (), False)
+
+    def escribir(self, tick_size, lastUpdateId, last_u, bids, asks, inicializado):
+        mm, cap = self.mm, self.capacidad
+        bids, asks = bids[:cap], asks[:cap]
+
+        self.seq += 1  # impar: escritura en curso
+        _SEQ.pack_into(mm, _OFFSET_SEQ, self.seq)
+
+        for (tick_off, qty_off), niveles in zip((self.offsets[0:2], self.offsets[2:4]), (bids, asks)):
+            if niveles:
+                ticks, qtys = zip(*niveles)
+                mm[tick_off:tick_off + 8 * len(ticks)] = array('q', ticks).tobytes()
+                mm[qty_off:qty_off + 8 * len(qtys)] = array('d', qtys).tobytes()
+        _CABECERA.pack_into(
+            mm, 0, b'OBSM', VERSION_FORMATO, self.seq, tick_size,
+            lastUpdateId if lastUpdateId is not None else -1,
+            last_u if last_u is not None else -1,
+            len(bids), len(asks), cap, int(inicializado), time.time(),
+        )
+
+        self.seq += 1  # par: contenido consistente
+        _SEQ.pack_into(mm, _OFFSET_SEQ, self.seq)
+
+class PublicadorMemoria:
+    """
+    Publica periódicamente en memoria compartida los libros cuya versión
+    cambió. Cada pasada copia como mucho 'capacidad' niveles por lado desde
+    la vista inmutable del libro, así que no retiene el lock del símbolo.
+    """
+
+    def __init__(self, directorio, order_books, vista_libro, capacidad=5000):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.order_books = order_books
+        self.vista_libro = vista_libro
+        self.capacidad = capacidad
+        self.regiones = {}
+        self.retirados = deque()  # símbolos que salieron del universo (se procesan en la próxima pasada)
+
+    def retirar(self, symbol):
+        """Llamado al quitar el libro de order_books; puede venir de otro hilo"""
+        self.retirados.append(symbol)
+
+    def _borrar_retirados(self):
+        """Marca como no inicializados y borra los archivos de los símbolos retirados"""
+        while self.retirados:
+            symbol = self.retirados.popleft()
+            if symbol in self.order_books:
+                continue  # Volvió a entrar antes de esta pasada
+            region = self.regiones.pop(symbol, None)
+            if region is not None:
+                region.escribir(0.0, None, None, (), (), False)
+                region.mm.close()
+            try:
+                os.unlink(ruta_simbolo(self.directorio, symbol))
+            except FileNotFoundError:
+                pass
+
+    def publicar_cambiados(self):
+        self._borrar_retirados()
+        publicados = 0
+        for symbol, book in list(self.order_books.items()):
+            region = self.regiones.get(symbol)
+            if region is None:
+                region = self.regiones[symbol] = RegionLibro(self.directorio, symbol, self.capacidad)
+            if not book['initialized']:
+                if region.version_publicada is not None:
+                    region.escribir(book['tick_size'], None, None, (), (), False)
+                    region.version_publicada = None
+                continue
+            if region.version_publicada == book['version']:
+                continue
+            vista = self.vista_libro(book)
+            region.escribir(book['tick_size'], vista.lastUpdateId, vista.last_u, vista.bids, vista.asks, True)
+            region.version_publicada = vista.version
+            publicados += 1
+        return publicados
+
+# ---------- LECTOR ----------
+
+class LibroNoDisponible(Exception):
+    pass
+
+class LectorLibros:
+    """
+    Lector para procesos locales. leer() devuelve una copia consistente
+    (un memcpy por array); leer_sin_copia() pasa memoryviews sobre la región
+    a una función y sólo acepta el resultado si el libro no cambió mientras
+    tanto. Los libros tienen el mismo formato de dict que
+    libro_ordenes.decodificar_libro (más 'publicado').
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.regiones = {}
+
+    def simbolos(self):
+        if not os.path.isdir(self.directorio):
+            return []
+        return sorted(nombre[:-3] for nombre in os.listdir(self.directorio) if nombre.endswith('.ob'))
+
+    def _region(self, symbol):
+        ruta = ruta_simbolo(self.directorio, symbol)
+        try:
+            inodo = os.stat(ruta).st_ino
+        except FileNotFoundError:
+            raise LibroNoDisponible(f"{symbol} no está publicado en {self.directorio}")
+        entrada = self.regiones.get(symbol)
+        if entrada is not None and entrada[1] == inodo:
+            return entrada[0]
+        # Primera lectura o el servidor reemplazó el archivo (otra capacidad)
+        if entrada is not None:
+            entrada[0].close()
+        try:
+            with open(ruta, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            raise LibroNoDisponible(f"{symbol} no está publicado en {self.directorio}")
+        self.regiones[symbol] = (mm, inodo)
+        return mm
+
+    def _intentar(self, symbol, copiar, funcion, espera_max):
+        mm = self._region(symbol)
+        limite = None
+        while True:
+            seq = _SEQ.unpack_from(mm, _OFFSET_SEQ)[0]
+            if seq & 1:
+                # Escritura en curso: puede durar más de lo normal si el escritor perdió el GIL
+                if limite is None:
+                    limite = time.perf_counter() + espera_max
+                elif time.perf_counter() > limite:
+                    break
+                time.sleep(0)
+                continue
+            magia, _, _, tick_size, lastUpdateId, last_u, n_bids, n_asks, _, inicializado, publicado = _CABECERA.unpack_from(mm, 0)
+            # La capacidad sale del tamaño del archivo: una cabecera a medio escribir no puede salirse de la región
+            cap = (len(mm) - _CABECERA.size) // 32
+            n_bids, n_asks = min(n_bids, cap), min(n_asks, cap)
+            if magia != b'OBSM' or not inicializado:
+                if _SEQ.unpack_from(mm, _OFFSET_SEQ)[0] != seq:
+                    continue  # Cabecera leída a mitad de una escritura
+                if magia != b'OBSM':
+                    raise LibroNoDisponible(f"{symbol}: región sin formato reconocido")
+                raise LibroNoDisponible(f"{symbol}: order book aún no inicializado")
+            vista = memoryview(mm)
+            vistas = [vista]
+            arrays = []
+            for offset, n, formato in zip(_offsets(cap), (n_bids, n_bids, n_asks, n_asks), 'qdqd'):
+                datos = vista[offset:offset + 8 * n]
+                vistas.append(datos)
+                if copiar:
+                    arrays.append(memoryview(bytes(datos)).cast(formato))
+                else:
+                    arrays.append(datos.cast(formato))
+                    vistas.append(arrays[-1])
+            libro = {
+                "tick_size": tick_size,
+                "lastUpdateId": lastUpdateId if lastUpdateId != -1 else None,
+                "last_u": last_u if last_u != -1 else None,
+                "bids_ticks": arrays[0],
+                "bids_qty": arrays[1],
+                "asks_ticks": arrays[2],
+                "asks_qty": arrays[3],
+                "publicado": publicado,
+            }
+            try:
+                resultado = funcion(libro) if funcion is not None else libro
+            finally:
+                # Sin referencias vivas a la región (si no, el mmap no se puede cerrar)
+                for v in reversed(vistas):
+                    v.release()
+            if _SEQ.unpack_from(mm, _OFFSET_SEQ)[0] == seq:
+                return resultado
+            if limite is None:
+                limite = time.perf_counter() + espera_max
+            elif time.perf_counter() > limite:
+                break
+        raise LibroNoDisponible(f"{symbol}: no se pudo leer una versión consistente")
+
+    def leer(self, symbol, espera_max=0.1):
+        """Copia consistente del libro publicado"""
+        return self._intentar(symbol, True, None, espera_max)
+
+    def leer_sin_copia(self, symbol, funcion, espera_max=0.1):
+        """
+        Aplica funcion(libro) sobre memoryviews de la región (sin copiar) y
+        devuelve su resultado si no hubo escrituras en el medio; si no, reintenta.
+        La función no debe guardar referencias a los arrays.
+        """
+        return self._intentar(symbol, False, funcion, espera_max)
+
+    def cerrar(self):
+        for mm, _ in self.regiones.values():
+            mm.close()
+        self.regiones.clear()
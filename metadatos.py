@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Metadatos de los símbolos para el analizador: tickSize y precio actual.
+
+/fapi/v1/exchangeInfo trae todos los contratos en una sola respuesta de
+varios MB, así que se descarga una vez, se guarda en disco y se reutiliza
+mientras no venza el TTL (el tickSize casi nunca cambia). Los precios se
+piden en bloque al ticker de todos los símbolos. Si el servidor de order
+books está corriendo, /symbols/metadata da tickSize y mid de todos sus
+símbolos en una sola petición y Binance sólo se consulta por los que falten.
+"""
+import json
+import os
+import threading
+import time
+
+import requests
+
+REST_URL = os.environ.get("OB_REST_URL", "https://fapi.binance.com")
+CACHE_RUTA = os.environ.get("OB_METADATOS_CACHE", "metadatos_simbolos.json")
+CACHE_TTL = float(os.environ.get("OB_METADATOS_TTL", 6 * 3600))  # segundos
+
+def tick_sizes_exchange_info(exchange_info):
+    """symbol -> tickSize del PRICE_FILTER de cada contrato"""
+    tick_sizes = {}
+    for s in exchange_info["symbols"]:
+        for f in s["filters"]:
+            if f["filterType"] == "PRICE_FILTER":
+                tick_sizes[s["symbol"]] = float(f["tickSize"])
+    return tick_sizes
+
+class CacheMetadatos:
+    """Cache de tickSizes (memoria + disco con TTL) compartida por todo el analizador"""
+
+    def __init__(self, ruta=CACHE_RUTA, ttl=CACHE_TTL, rest_url=REST_URL, sesion=None):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.rest_url = rest_url
+        self.sesion = sesion or requests.Session()
+        self.lock = threading.Lock()
+        self.tick_sizes_binance = {}
+        self.descargado = 0.0  # epoch de la descarga de exchangeInfo en uso
+        self.peticiones = 0
+
+    def _get(self, url, **kwargs):
+        self.peticiones += 1
+        return self.sesion.get(url, **kwargs)
+
+    def _leer_disco(self):
+        try:
+            with open(self.ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            return datos["tick_sizes"], float(datos["descargado"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _guardar_disco(self):
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        try:
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump({"descargado": self.descargado, "tick_sizes": self.tick_sizes_binance}, f)
+            os.replace(temporal, self.ruta)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar la cache de metadatos en {self.ruta}: {e}")
+
+    def tick_sizes(self):
+        """Todos los tickSizes de Binance: memoria, disco o (vencidos) una descarga de exchangeInfo"""
+        with self.lock:
+            if self.tick_sizes_binance and time.time() - self.descargado < self.ttl:
+                return self.tick_sizes_binance
+            disco = self._leer_disco()
+            if disco is not None and time.time() - disco[1] < self.ttl:
+                self.tick_sizes_binance, self.descargado = disco
+                return self.tick_sizes_binance
+            try:
+                resp = self._get(f"{self.rest_url}/fapi/v1/exchangeInfo", timeout=10)
+                self.tick_sizes_binance = tick_sizes_exchange_info(resp.json())
+                self.descargado = time.time()
+                self._guardar_disco()
+            except Exception as e:
+                print(f"Error al obtener exchangeInfo: {e}")
+                # Mejor una copia vencida que nada
+                if not self.tick_sizes_binance and disco is not None:
+                    self.tick_sizes_binance, self.descargado = disco
+            return self.tick_sizes_binance
+
+    def precios(self):
+        """Último precio de todos los símbolos (una petición al ticker sin symbol)"""
+        try:
+            resp = self._get(f"{self.rest_url}/fapi/v1/ticker/price", timeout=5)
+            return {el["symbol"]: float(el["price"]) for el in resp.json()}
+        except Exception as e:
+            print(f"Error al obtener precios: {e}")
+            return {}
+
+    def del_servidor(self, base_url):
+        """symbol -> {'tick_size', 'mid', 'initialized'} del servidor de order books ({} si no responde)"""
+        try:
+            resp = self._get(f"{base_url}/symbols/metadata", timeout=5)
+            if resp.status_code == 200:
+                return resp.json()["symbols"]
+        except Exception as e:
+            print(f"Error al obtener metadatos del servidor: {e}")
+        return {}
+
+    def cargar(self, symbols, base_url="http://localhost:8000"):
+        """
+        (tick_sizes, precios) de los símbolos pedidos. Primero el servidor (una
+        petición); los que falten o no tengan mid salen de Binance: tickSize de
+        la cache de exchangeInfo y precio del ticker de todos los símbolos.
+        """
+        tick_sizes, precios = {}, {}
+        for symbol, meta in self.del_servidor(base_url).items():
+            if meta.get("tick_size"):
+                tick_sizes[symbol] = meta["tick_size"]
+            if meta.get("mid"):
+                precios[symbol] = meta["mid"]
+
+        if any(s not in tick_sizes for s in symbols):
+            todos = self.tick_sizes()
+            tick_sizes.update({s: todos[s] for s in symbols if s not in tick_sizes and s in todos})
+        if any(s not in precios for s in symbols):
+            todos = self.precios()
+            precios.update({s: todos[s] for s in symbols if s not in precios and s in todos})
+
+        return ({s: tick_sizes[s] for s in symbols if s in tick_sizes},
+                {s: precios[s] for s in symbols if s in precios})
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas de ingesta por símbolo en formato de exposición de Prometheus.
+
+Pensadas para el camino caliente: contadores como enteros y floats
+planos, e histogramas de buckets fijos (un bisect + dos sumas por
+observación). Cada símbolo sólo lo escribe su conexión (bajo su lock),
+así que no hace falta sincronización extra; la excepción es serializacion,
+que se observa desde la API y con peticiones simultáneas puede perder
+alguna cuenta.
+"""
+from bisect import bisect_left
+
+# Buckets en segundos
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKETS_APLICACION = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+BUCKETS_SNAPSHOT = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SERIALIZACION = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+class Histograma:
+    __slots__ = ('limites', 'cuentas', 'suma')
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)  # el último es +Inf
+        self.suma = 0.0
+
+    def observar(self, valor):
+        self.cuentas[bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+
+class MetricasSimbolo:
+    """Contadores e histogramas de un símbolo"""
+    __slots__ = ('mensajes', 'resyncs', 'recortados', 'latencia', 'aplicacion', 'snapshot', 'serializacion')
+
+    def __init__(self):
+        self.mensajes = 0    # mensajes recibidos (aplicados o al buffer)
+        self.resyncs = 0     # discontinuidades que obligaron a pedir otro snapshot
+        self.recortados = 0  # niveles eliminados por la política de retención
+        self.latencia = Histograma(BUCKETS_LATENCIA)      # E del evento -> aplicado
+        self.aplicacion = Histograma(BUCKETS_APLICACION)  # duración de apply_order_book_update
+        self.snapshot = Histograma(BUCKETS_SNAPSHOT)      # descarga de /fapi/v1/depth
+        self.serializacion = Histograma(BUCKETS_SERIALIZACION)  # libro -> JSON/binario en la API
+
+# ---------- EXPOSICIÓN ----------
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Exposicion:
+    """Arma el texto de /metrics agrupando las muestras de cada métrica"""
+
+    def __init__(self):
+        self.familias = {}  # nombre -> (tipo, ayuda, líneas)
+
+    def _familia(self, nombre, tipo, ayuda):
+        familia = self.familias.get(nombre)
+        if familia is None:
+            familia = self.familias[nombre] = (tipo, ayuda, [])
+        return familia[2]
+
+    def valor(self, nombre, tipo, ayuda, valor, symbol=None):
+        etiqueta = f'{{symbol="{symbol}"}}' if symbol is not None else ""
+        self._familia(nombre, tipo, ayuda).append(f"{nombre}{etiqueta} {_numero(valor)}")
+
+    def histograma(self, nombre, ayuda, hist, symbol):
+        lineas = self._familia(nombre, "histogram", ayuda)
+        acumulado = 0
+        for limite, cuenta in zip(hist.limites, hist.cuentas):
+            acumulado += cuenta
+            lineas.append(f'{nombre}_bucket{{symbol="{symbol}",le="{limite}"}} {acumulado}')
+        acumulado += hist.cuentas[-1]
+        lineas.append(f'{nombre}_bucket{{symbol="{symbol}",le="+Inf"}} {acumulado}')
+        lineas.append(f'{nombre}_sum{{symbol="{symbol}"}} {_numero(hist.suma)}')
+        lineas.append(f'{nombre}_count{{symbol="{symbol}"}} {acumulado}')
+
+    def texto(self):
+        partes = []
+        for nombre, (tipo, ayuda, lineas) in self.familias.items():
+            partes.append(f"# HELP {nombre} {ayuda}")
+            partes.append(f"# TYPE {nombre} {tipo}")
+            partes.extend(lineas)
+        return "\n".join(partes) + "\n"
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Simulador local de Binance Futures para pruebas de carga y de larga duración.
+
+Sirve en un solo puerto lo que usa "Order book v2.py":
+- /stream?streams=...@depth@100ms   streams combinados de profundidad (WebSocket,
+                                     admite SUBSCRIBE/UNSUBSCRIBE en caliente)
+- /fapi/v1/depth                     snapshots coherentes con los diffs enviados
+- /fapi/v1/exchangeInfo              símbolos sintéticos con su tickSize
+- /fapi/v1/ticker/24hr               tickers que pasan el filtro de volumen/precio
+- /fapi/v1/ticker/price              último precio de todos los símbolos (o de uno)
+
+Cada símbolo tiene un libro real que evoluciona con un random walk del mid;
+los diffs llevan U/u/pu correctos. Control en caliente:
+- POST /control/gap?symbol=X         el próximo diff de X (o de todos) se pierde
+- POST /control/desconectar?conexion=N   cierra una conexión (o todas)
+- POST /control/volumen?symbol=X&volumen=V  cambia el quoteVolume del ticker (entra o sale del filtro)
+- GET  /control/estado
+
+Uso:
+    python simulador_binance.py --simbolos 300 --intervalo-ms 100
+    OB_WS_URL=ws://127.0.0.1:9000 OB_REST_URL=http://127.0.0.1:9000 python "Order book v2.py"
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import time
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+
+from libro_ordenes import decimales_tick
+
+TICK_SIZES = (0.0001, 0.001, 0.01)
+NIVELES_POR_LADO = 1000
+# Mensajes pendientes por conexión antes de cortarla por lenta (como hace Binance)
+MAX_PENDIENTES_CONEXION = 10_000
+
+class SimboloSimulado:
+    """Libro sintético de un símbolo y su secuencia de updates (U/u/pu)"""
+
+    def __init__(self, symbol, tick_size, rnd):
+        self.symbol = symbol
+        self.stream = f"{symbol.lower()}@depth@100ms"
+        self.tick_size = tick_size
+        self.decimales = decimales_tick(tick_size)
+        self.rnd = rnd
+        self.mid = rnd.randint(int(0.5 / tick_size), int(30 / tick_size))  # en ticks, precio < 40
+        self.bids = {self.mid - i: self.qty() for i in range(1, NIVELES_POR_LADO + 1)}
+        self.asks = {self.mid + i: self.qty() for i in range(0, NIVELES_POR_LADO)}
+        self.u = rnd.randint(1_000_000, 9_000_000)
+        self.perder_siguiente = False
+        self.volumen = 1_000_000_000
+
+    def qty(self):
+        return round(self.rnd.expovariate(1 / 500), 3) + 0.001
+
+    def precio(self, tick):
+        return f"{tick * self.tick_size:.{self.decimales}f}"
+
+    def siguiente_diff(self, niveles):
+        """Avanza el libro y devuelve el evento depthUpdate (aplicado ya al libro)"""
+        rnd = self.rnd
+        b, a = {}, {}
+
+        # Random walk del mid (bids < mid <= asks): el nivel que queda cruzado se elimina
+        paso = rnd.choice((-1, 0, 0, 0, 1))
+        if paso == 1:
+            if self.asks.pop(self.mid, None) is not None:
+                a[self.mid] = 0
+            self.mid += 1
+        elif paso == -1:
+            self.mid -= 1
+            if self.bids.pop(self.mid, None) is not None:
+                b[self.mid] = 0
+
+        for _ in range(niveles):
+            distancia = int(rnd.expovariate(1 / 30))
+            es_bid = rnd.random() < 0.5
+            tick = self.mid - 1 - distancia if es_bid else self.mid + distancia
+            lado, cambios = (self.bids, b) if es_bid else (self.asks, a)
+            if tick in lado and rnd.random() < 0.3:
+                del lado[tick]
+                cambios[tick] = 0
+            else:
+                lado[tick] = cambios[tick] = self.qty()
+
+        # Binance agrupa varios updates en cada evento: u - U + 1 de ellos
+        pu = self.u
+        U = pu + 1
+        self.u = pu + rnd.randint(1, 5)
+        ahora = int(time.time() * 1000)
+        return {
+            "e": "depthUpdate", "E": ahora, "T": ahora, "s": self.symbol,
+            "U": U, "u": self.u, "pu": pu,
+            "b": [[self.precio(t), "0" if q == 0 else f"{q:.3f}"] for t, q in b.items()],
+            "a": [[self.precio(t), "0" if q == 0 else f"{q:.3f}"] for t, q in a.items()],
+        }
+
+    def snapshot(self, limit):
+        bids = sorted(self.bids.items(), reverse=True)[:limit]
+        asks = sorted(self.asks.items())[:limit]
+        return {
+            "lastUpdateId": self.u,
+            "E": int(time.time() * 1000),
+            "T": int(time.time() * 1000),
+            "bids": [[self.precio(t), f"{q:.3f}"] for t, q in bids],
+            "asks": [[self.precio(t), f"{q:.3f}"] for t, q in asks],
+        }
+
+class Simulador:
+    def __init__(self, n_simbolos, intervalo_ms, niveles, prob_gap, prob_desconexion, semilla):
+        rnd = random.Random(semilla)
+        self.simbolos = {}
+        for i in range(n_simbolos):
+            symbol = f"SIM{i:04d}USDT"
+            self.simbolos[symbol] = SimboloSimulado(symbol, rnd.choice(TICK_SIZES), random.Random(rnd.random()))
+        self.por_stream = {s.stream: s for s in self.simbolos.values()}
+        self.intervalo = intervalo_ms / 1000
+        self.niveles = niveles
+        self.prob_gap = prob_gap                  # por evento
+        self.prob_desconexion = prob_desconexion  # por conexión y por segundo
+        self.rnd = rnd
+        self.conexiones = {}  # id -> (websocket, cola, streams)
+        self.siguiente_id = 0
+        self.estadisticas = {"eventos": 0, "enviados": 0, "gaps": 0, "desconexiones": 0, "snapshots": 0, "atraso_max_ms": 0.0}
+        self.peso_minuto = [0, int(time.time() // 60)]
+
+    async def generar(self):
+        """Un diff por símbolo suscripto cada intervalo, repartido a las conexiones"""
+        proximo = time.perf_counter()
+        while True:
+            proximo += self.intervalo
+            suscriptos = {}
+            for cid, (_, cola, streams) in list(self.conexiones.items()):
+                for stream in streams:
+                    suscriptos.setdefault(stream, []).append(cola)
+
+            for stream, colas in suscriptos.items():
+                sim = self.por_stream[stream]
+                data = sim.siguiente_diff(self.niveles)
+                self.estadisticas["eventos"] += 1
+                if sim.perder_siguiente or (self.prob_gap and self.rnd.random() < self.prob_gap):
+                    sim.perder_siguiente = False
+                    self.estadisticas["gaps"] += 1
+                    continue
+                mensaje = json.dumps({"stream": stream, "data": data})
+                for cola in colas:
+                    cola.put_nowait(mensaje)
+
+            if self.prob_desconexion:
+                for cid in list(self.conexiones):
+                    if self.rnd.random() < self.prob_desconexion * self.intervalo:
+                        await self.desconectar(cid)
+
+            atraso = time.perf_counter() - proximo
+            if atraso > 0:
+                # No da abasto con el intervalo: se registra y se sigue sin acumular
+                self.estadisticas["atraso_max_ms"] = max(self.estadisticas["atraso_max_ms"], round(atraso * 1000, 1))
+                proximo = time.perf_counter()
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(-atraso)
+
+    async def atender(self, websocket, streams):
+        cid = self.siguiente_id
+        self.siguiente_id += 1
+        cola = asyncio.Queue()
+        self.conexiones[cid] = (websocket, cola, [s for s in streams if s in self.por_stream])
+        print(f"🔌 Conexión {cid}: {len(self.conexiones[cid][2])} streams")
+        receptor = asyncio.create_task(self.recibir(cid, websocket, cola))
+        try:
+            while True:
+                if cola.qsize() > MAX_PENDIENTES_CONEXION:
+                    print(f"🐢 Conexión {cid} demasiado lenta, se cierra")
+                    break
+                mensaje = await cola.get()
+                if mensaje is None:
+                    break  # El cliente cerró la conexión
+                await websocket.send_text(mensaje)
+                self.estadisticas["enviados"] += 1
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            receptor.cancel()
+            self.conexiones.pop(cid, None)
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass
+
+    async def recibir(self, cid, websocket, cola):
+        """SUBSCRIBE/UNSUBSCRIBE como en Binance: {"method", "params", "id"} -> {"result": null, "id"}"""
+        try:
+            while True:
+                pedido = json.loads(await websocket.receive_text())
+                conexion = self.conexiones.get(cid)
+                if conexion is None:
+                    return
+                streams = conexion[2]
+                params = [p for p in pedido.get("params", []) if p in self.por_stream]
+                if pedido.get("method") == "SUBSCRIBE":
+                    streams.extend(p for p in params if p not in streams)
+                elif pedido.get("method") == "UNSUBSCRIBE":
+                    streams[:] = [s for s in streams if s not in params]
+                print(f"🔁 Conexión {cid}: {pedido.get('method')} {len(params)} streams ({len(streams)} en total)")
+                cola.put_nowait(json.dumps({"result": None, "id": pedido.get("id")}))
+        except (WebSocketDisconnect, RuntimeError, ValueError):
+            cola.put_nowait(None)
+
+    async def desconectar(self, cid):
+        conexion = self.conexiones.pop(cid, None)
+        if conexion is None:
+            return False
+        self.estadisticas["desconexiones"] += 1
+        print(f"✂️ Desconectando conexión {cid}")
+        try:
+            await conexion[0].close(code=1001)
+        except RuntimeError:
+            pass
+        return True
+
+    def usar_peso(self, peso):
+        minuto = int(time.time() // 60)
+        if minuto != self.peso_minuto[1]:
+            self.peso_minuto = [0, minuto]
+        self.peso_minuto[0] += peso
+        return self.peso_minuto[0]
+
+def crear_app(sim):
+    @contextlib.asynccontextmanager
+    async def ciclo_de_vida(app):
+        tareas = [asyncio.create_task(sim.generar()), asyncio.create_task(reportar(sim))]
+        yield
+        for tarea in tareas:
+            tarea.cancel()
+
+    app = FastAPI(lifespan=ciclo_de_vida)
+
+    @app.websocket("/stream")
+    async def stream(websocket: WebSocket, streams: str = ""):
+        await websocket.accept()
+        await sim.atender(websocket, streams.split('/'))
+
+    @app.get("/fapi/v1/depth")
+    async def depth(symbol: str, limit: int = 1000):
+        s = sim.simbolos.get(symbol)
+        if s is None:
+            return JSONResponse({"code": -1121, "msg": "Invalid symbol."}, status_code=400)
+        sim.estadisticas["snapshots"] += 1
+        usado = sim.usar_peso(20 if limit > 500 else 10)
+        return Response(json.dumps(s.snapshot(limit)), media_type="application/json",
+                        headers={"X-MBX-USED-WEIGHT-1M": str(usado)})
+
+    @app.get("/fapi/v1/exchangeInfo")
+    async def exchange_info():
+        return {"symbols": [
+            {"symbol": s.symbol, "contractType": "PERPETUAL", "quoteAsset": "USDT", "status": "TRADING",
+             "filters": [{"filterType": "PRICE_FILTER", "tickSize": f"{s.tick_size:.{s.decimales}f}"}]}
+            for s in sim.simbolos.values()
+        ]}
+
+    @app.get("/fapi/v1/ticker/24hr")
+    async def ticker():
+        return [{"symbol": s.symbol, "lastPrice": s.precio(s.mid), "quoteVolume": str(s.volumen)}
+                for s in sim.simbolos.values()]
+
+    @app.get("/fapi/v1/ticker/price")
+    async def ticker_precio(symbol: Optional[str] = None):
+        if symbol is not None:
+            s = sim.simbolos.get(symbol)
+            if s is None:
+                return JSONResponse({"code": -1121, "msg": "Invalid symbol."}, status_code=400)
+            return {"symbol": s.symbol, "price": s.precio(s.mid)}
+        return [{"symbol": s.symbol, "price": s.precio(s.mid)} for s in sim.simbolos.values()]
+
+    @app.post("/control/gap")
+    async def gap(symbol: Optional[str] = None):
+        objetivo = [sim.simbolos[symbol]] if symbol in sim.simbolos else list(sim.simbolos.values())
+        for s in objetivo:
+            s.perder_siguiente = True
+        return {"gaps": len(objetivo)}
+
+    @app.post("/control/desconectar")
+    async def desconectar(conexion: Optional[int] = None):
+        ids = [conexion] if conexion is not None else list(sim.conexiones)
+        cerradas = [cid for cid in ids if await sim.desconectar(cid)]
+        return {"desconectadas": cerradas}
+
+    @app.post("/control/volumen")
+    async def volumen(symbol: str, volumen: float):
+        s = sim.simbolos.get(symbol)
+        if s is None:
+            return JSONResponse({"error": "Símbolo desconocido"}, status_code=404)
+        s.volumen = volumen
+        return {"symbol": symbol, "volumen": volumen}
+
+    @app.get("/control/estado")
+    async def estado():
+        return {"simbolos": len(sim.simbolos), "conexiones": len(sim.conexiones), **sim.estadisticas}
+
+    return app
+
+async def reportar(sim, cada=10):
+    anterior = dict(sim.estadisticas)
+    while True:
+        await asyncio.sleep(cada)
+        e = sim.estadisticas
+        print(f"📊 {len(sim.conexiones)} conexiones | {(e['eventos'] - anterior['eventos']) / cada:,.0f} eventos/s | "
+              f"{(e['enviados'] - anterior['enviados']) / cada:,.0f} enviados/s | gaps {e['gaps']} | "
+              f"snapshots {e['snapshots']} | atraso máx {e['atraso_max_ms']}ms")
+        anterior = dict(e)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulador local de Binance Futures (streams de profundidad + REST)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=9000)
+    parser.add_argument("--simbolos", type=int, default=300)
+    parser.add_argument("--intervalo-ms", type=float, default=100, help="ms entre diffs de cada símbolo")
+    parser.add_argument("--niveles", type=int, default=10, help="niveles cambiados por diff")
+    parser.add_argument("--prob-gap", type=float, default=0.0, help="probabilidad de perder cada diff")
+    parser.add_argument("--prob-desconexion", type=float, default=0.0, help="probabilidad por conexión y por segundo")
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    sim = Simulador(args.simbolos, args.intervalo_ms, args.niveles, args.prob_gap, args.prob_desconexion, args.semilla)
+    print(f"🚀 Simulador con {args.simbolos} símbolos en http://{args.host}:{args.puerto} "
+          f"(diff cada {args.intervalo_ms}ms, {args.niveles} niveles)")
+    uvicorn.run(crear_app(sim), host=args.host, port=args.puerto, log_level="warning")
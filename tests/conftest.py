@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Fixtures comunes: el servidor ("Order book v2.py") se carga como módulo, uno nuevo por test"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+def cargar_servidor(nombre="order_book_v2"):
+    """Importa "Order book v2.py" (el nombre tiene espacios) con el entorno OB_* actual"""
+    spec = importlib.util.spec_from_file_location(nombre, os.path.join(RAIZ, "Order book v2.py"))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nombre] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+@pytest.fixture
+def servidor():
+    modulo = cargar_servidor()
+    yield modulo
+    sys.modules.pop(modulo.__name__, None)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalencia de la agrupación (agrupacion.py) con el cálculo original del
+analizador: rangos, volumen, moda y promedio ponderado, por numpy, por el
+bucle de Python sin numpy y por los agregados incrementales del servidor.
+"""
+import random
+from collections import defaultdict
+
+import pytest
+
+import agrupacion
+from agrupacion import AgregadoRangos, LadoAgrupable, agrupar_niveles
+from libro_ordenes import LadoLibro, decimales_tick
+
+# ---------- REFERENCIA: cálculo original del analizador ----------
+
+def decimales_por_valor(valor):
+    s = f"{valor:.10f}".rstrip('0')
+    return len(s.split('.')[1]) if '.' in s else 0
+
+def agrupar_precio_manual(price, agrupacion):
+    agrupado = (price // agrupacion) * agrupacion
+    decimales = decimales_por_valor(agrupacion)
+    return round(agrupado, decimales)
+
+def calcular_precio_moda(price_count, tick, decimales_tick):
+    """Encuentra el precio con mayor volumen"""
+    if not price_count:
+        return 0
+    precio_max = max(price_count.items(), key=lambda x: x[1])[0]
+    return round(round(precio_max / tick) * tick, decimales_tick)
+
+def calcular_precio_promedio_ponderado(price_count, tick, decimales_tick):
+    """Calcula el promedio ponderado"""
+    if not price_count:
+        return 0
+    total_qty = sum(price_count.values())
+    weighted_avg = sum(p * q for p, q in price_count.items()) / total_qty
+    return round(round(weighted_avg / tick) * tick, decimales_tick)
+
+def rangos_referencia(niveles, tick, step, top=None):
+    """Rangos de un lado {precio: qty} como los armaba el analizador, en el formato de agrupacion"""
+    rangos = defaultdict(lambda: {'total_qty': 0, 'price_count': {}})
+    for price, qty in niveles.items():
+        range_key = agrupar_precio_manual(price, step)
+        rangos[range_key]['total_qty'] += qty
+        rangos[range_key]['price_count'][price] = qty
+    ordenados = sorted(rangos.items(), key=lambda x: x[1]['total_qty'], reverse=True)
+    dec = decimales_por_valor(tick)
+    return [
+        {
+            "precio": clave,
+            "total_qty": datos['total_qty'],
+            "moda": calcular_precio_moda(datos['price_count'], tick, dec),
+            "vwap": calcular_precio_promedio_ponderado(datos['price_count'], tick, dec),
+        }
+        for clave, datos in ordenados
+    ][:top]
+
+# ---------- DATOS ----------
+
+TICK_SIZES = (0.0001, 0.01, 0.1)
+STEPS = {0.0001: (0.001, 0.01), 0.01: (0.1, 1.0, 0.05), 0.1: (1.0, 10.0)}
+
+def lado_aleatorio(rnd, tick_size, es_bid, n=400):
+    """{precio: qty} desde el mejor precio, con precios y cantidades como los del servidor"""
+    dec = decimales_tick(tick_size)
+    mid = rnd.randint(5000, 300000)
+    ticks = rnd.sample(range(1, 3 * n), n)
+    ticks = sorted((mid - t for t in ticks), reverse=True) if es_bid else sorted(mid + t for t in ticks)
+    return {round(t * tick_size, dec): round(rnd.expovariate(1 / 50), 3) + 0.001 for t in ticks}
+
+def casos():
+    rnd = random.Random(7)
+    for tick_size in TICK_SIZES:
+        for es_bid in (True, False):
+            niveles = lado_aleatorio(rnd, tick_size, es_bid)
+            for step in STEPS[tick_size]:
+                yield tick_size, es_bid, niveles, step
+
+def comparar(obtenido, esperado, tick_size, exacto=True):
+    assert [r["precio"] for r in obtenido] == [r["precio"] for r in esperado]
+    assert [r["moda"] for r in obtenido] == [r["moda"] for r in esperado]
+    if exacto:
+        assert obtenido == esperado
+    else:
+        # Otro orden de suma: el volumen difiere en el último bit y el vwap a lo sumo en un tick
+        for o, e in zip(obtenido, esperado):
+            assert o["total_qty"] == pytest.approx(e["total_qty"], rel=1e-9)
+            assert o["vwap"] == pytest.approx(e["vwap"], abs=tick_size * 1.001)
+
+# ---------- TESTS ----------
+
+@pytest.mark.skipif(agrupacion.np is None, reason="requiere numpy")
+def test_lado_agrupable_numpy_igual_a_la_referencia():
+    for tick_size, _, niveles, step in casos():
+        lado = LadoAgrupable(niveles, tick_size)
+        comparar(lado.agrupar(step), rangos_referencia(niveles, tick_size, step), tick_size)
+        comparar(lado.agrupar(step, top=6), rangos_referencia(niveles, tick_size, step, top=6), tick_size)
+
+def test_lado_agrupable_sin_numpy_igual_a_la_referencia(monkeypatch):
+    monkeypatch.setattr(agrupacion, "np", None)
+    for tick_size, _, niveles, step in casos():
+        lado = LadoAgrupable(niveles, tick_size)
+        comparar(lado.agrupar(step, top=6), rangos_referencia(niveles, tick_size, step, top=6), tick_size)
+
+def test_agrupar_niveles_igual_a_la_referencia():
+    for tick_size, _, niveles, step in casos():
+        ticks = [(round(p / tick_size), q) for p, q in niveles.items()]
+        comparar(agrupar_niveles(ticks, tick_size, step), rangos_referencia(niveles, tick_size, step), tick_size)
+
+def test_agregado_incremental_igual_a_la_referencia():
+    rnd = random.Random(11)
+    for tick_size, es_bid, niveles, step in casos():
+        dec = decimales_tick(tick_size)
+        lado = LadoLibro(es_bid)
+        for precio, qty in niveles.items():
+            lado.actualizar(round(precio / tick_size), qty)
+        agregado = AgregadoRangos(tick_size, step, es_bid)
+        agregado.reconstruir(lado.items())
+
+        # Diffs aleatorios cerca del mejor precio: altas, cambios y bajas de niveles
+        mejor = lado.mejor()[0]
+        for _ in range(2000):
+            tick = mejor + (-1 if es_bid else 1) * rnd.randint(0, 1200)
+            qty = 0.0 if rnd.random() < 0.3 else round(rnd.expovariate(1 / 50), 3) + 0.001
+            agregado.aplicar(tick, lado.actualizar(tick, qty), qty)
+
+        actual = {round(t * tick_size, dec): q for t, q in lado.items()}
+        comparar(agregado.top(6, lado), rangos_referencia(actual, tick_size, step, top=6), tick_size, exacto=False)
+
+def test_agregado_incremental_sin_deriva():
+    """Tras muchos diffs las sumas incrementales son exactamente las de reconstruir()"""
+    rnd = random.Random(3)
+    tick_size, step = 0.001, 0.05
+    lado = LadoLibro(es_bid=False)
+    agregado = AgregadoRangos(tick_size, step, es_bid=False)
+    for _ in range(100_000):
+        tick = 20_000 + rnd.randint(0, 2000)
+        # Cantidades con decimales que no son exactos en binario (0.1, 0.3...)
+        qty = 0.0 if rnd.random() < 0.4 else rnd.randint(1, 10**6) / 1000
+        agregado.aplicar(tick, lado.actualizar(tick, qty), qty)
+
+    recalculado = AgregadoRangos(tick_size, step, es_bid=False)
+    recalculado.reconstruir(lado.items())
+    assert agregado.rangos == recalculado.rangos
+    assert list(agregado.ranking) == list(recalculado.ranking)
+    assert agregado.top(10, lado) == recalculado.top(10, lado)
+
+    # Vaciar un rango lo saca del ranking: no queda un resto que compita en el top
+    idx = agregado.top(1)[0]["precio"]
+    for tick, qty in lado.items():
+        if round(tick * tick_size, 3) // step * step == pytest.approx(idx):
+            agregado.aplicar(tick, lado.actualizar(tick, 0.0), 0.0)
+    assert all(r["precio"] != idx for r in agregado.top(len(agregado.rangos)))
+    assert all(e[0] > 0 for e in agregado.rangos.values())
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Endpoints REST del servidor sobre libros cargados a mano"""
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture
+def cliente(servidor):
+    servidor.cargar_universo(["AAAUSDT"], {"AAAUSDT": 0.01})
+    servidor.procesar_snapshot("AAAUSDT", {"lastUpdateId": 10, "bids": [["10.00", "1"], ["9.99", "2"], ["9.50", "3"]], "asks": []})
+    return TestClient(servidor.app)
+
+def test_bps_con_un_solo_lado(cliente):
+    # Sin asks no hay mid ni ventana: se devuelve el lado que hay
+    r = cliente.get("/orderbooks/AAAUSDT", params={"bps": 50})
+    assert r.status_code == 200
+    assert r.json()["bids"] == {"10.00": 1.0, "9.99": 2.0, "9.50": 3.0}
+    assert r.json()["asks"] == {}
+
+    r = cliente.get("/orderbooks/AAAUSDT", params={"bps": 50, "depth": 2})
+    assert list(r.json()["bids"]) == ["10.00", "9.99"]
+
+    r = cliente.get("/orderbooks", params={"symbols": "AAAUSDT", "bps": 20})
+    assert r.status_code == 200
+    assert len(r.json()["orderbooks"]["AAAUSDT"]["bids"]) == 3
+
+def test_agrupado_con_step_registrado(cliente):
+    r = cliente.post("/orderbooks/AAAUSDT/steps", params={"step": 0.1})
+    assert r.status_code == 200
+    registrado = cliente.get("/orderbooks/AAAUSDT/grouped", params={"step": 0.1}).json()
+    cliente.delete("/orderbooks/AAAUSDT/steps", params={"step": 0.1})
+    al_vuelo = cliente.get("/orderbooks/AAAUSDT/grouped", params={"step": 0.1}).json()
+    assert registrado["bids"] and registrado["bids"] == al_vuelo["bids"]
+
+def test_agrupado_valida_parametros(cliente):
+    for params in ({"step": 0.1, "top": -1}, {"step": 0.1, "top": 0}, {"step": 0}, {"step": -0.1}):
+        assert cliente.get("/orderbooks/AAAUSDT/grouped", params=params).status_code == 422
+    cliente.post("/orderbooks/AAAUSDT/steps", params={"step": 0.1})
+    assert cliente.get("/orderbooks/AAAUSDT/grouped", params={"step": 0.1, "top": -1}).status_code == 422
+    assert len(cliente.get("/orderbooks/AAAUSDT/grouped", params={"step": 0.1, "top": 1}).json()["bids"]) == 1
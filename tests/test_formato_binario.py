@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Formato binario de libros y lotes (libro_ordenes)"""
+from libro_ordenes import codificar_libro, codificar_lote, decodificar_lote, unir_lotes
+
+def libro(tick_size, n, last_u):
+    bids = [(1000 - i, 1.5 + i) for i in range(n)]
+    asks = [(1001 + i, 2.5 + i) for i in range(n)]
+    return codificar_libro(tick_size, bids, asks, last_u - 10, last_u)
+
+def test_unir_lotes_equivale_a_un_solo_lote():
+    a = {"AAAUSDT": libro(0.01, 3, 100), "BBBUSDT": libro(0.1, 0, 200)}
+    b = {"CCCUSDT": libro(0.001, 5, 300)}
+
+    unido = unir_lotes([codificar_lote(a), codificar_lote(b), codificar_lote({})])
+    assert unido == codificar_lote({**a, **b})
+
+    libros = decodificar_lote(unido)
+    assert list(libros) == ["AAAUSDT", "BBBUSDT", "CCCUSDT"]
+    assert libros["CCCUSDT"]["last_u"] == 300
+    assert list(libros["CCCUSDT"]["asks_ticks"]) == [1001, 1002, 1003, 1004, 1005]
+    assert unir_lotes([]) == codificar_lote({})
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducción de una grabación chica por reproducir(): puente del buffer con
+el snapshot, discontinuidad (gap) y desborde del buffer con pedido de resync
+y resync completado.
+La huella de los libros tiene que ser siempre la misma.
+"""
+import gzip
+import json
+
+from conftest import cargar_servidor
+
+# Huella de huella_libros() al terminar GRABACION completa
+HUELLA_ESPERADA = "b07204ee692275e5a7c3e67254a4c3e37783a200"
+
+META = {"coins": ["AAAUSDT", "BBBUSDT"], "tick_sizes": {"AAAUSDT": 0.01, "BBBUSDT": 0.1}}
+
+def evento(symbol, U, u, pu, bids=(), asks=()):
+    """Mensaje combinado de depth tal como llega del websocket"""
+    return json.dumps({
+        "stream": f"{symbol.lower()}@depth@100ms",
+        "data": {"e": "depthUpdate", "E": 1700000000000 + u, "s": symbol,
+                 "U": U, "u": u, "pu": pu, "b": list(bids), "a": list(asks)},
+    })
+
+def snapshot(lastUpdateId, bids, asks):
+    return json.dumps({"lastUpdateId": lastUpdateId, "bids": bids, "asks": asks})
+
+GRABACION = [
+    ("meta", "", json.dumps(META)),
+    # AAAUSDT: tres eventos esperan en el buffer; el snapshot (100) queda entre el primero y el segundo
+    ("ws", "", evento("AAAUSDT", 90, 95, 89, bids=[["10.00", "1"]])),
+    ("ws", "", evento("AAAUSDT", 96, 101, 95, bids=[["10.01", "2"]], asks=[["10.05", "1"]])),
+    ("ws", "", evento("AAAUSDT", 102, 104, 101, asks=[["10.06", "3"]])),
+    ("snap", "AAAUSDT", snapshot(100, [["10.00", "5"], ["9.99", "1"]], [["10.05", "4"], ["10.07", "2"]])),
+    ("ws", "", evento("AAAUSDT", 105, 106, 104, bids=[["9.99", "0"]])),
+    # BBBUSDT: snapshot con el buffer vacío y eventos en vivo
+    ("snap", "BBBUSDT", snapshot(200, [["50.0", "1"]], [["50.2", "1"]])),
+    ("ws", "", evento("BBBUSDT", 199, 203, 198, bids=[["50.1", "2"]])),
+    ("ws", "", evento("BBBUSDT", 204, 205, 203, asks=[["50.2", "0"], ["50.3", "4"]])),
+    # Gap: pu=209 no continúa last_u=205
+    ("ws", "", evento("BBBUSDT", 210, 212, 209, bids=[["50.0", "0"]])),
+    ("ws", "", evento("BBBUSDT", 213, 214, 212, asks=[["50.4", "1"]])),
+    # Resync: el snapshot nuevo (211) queda cubierto por el primer evento del buffer
+    ("snap", "BBBUSDT", snapshot(211, [["50.0", "3"], ["49.9", "1"]], [["50.3", "4"]])),
+]
+
+# Hasta antes del snapshot del resync
+INDICE_RESYNC = len(GRABACION) - 1
+
+def escribir_grabacion(directorio, lineas):
+    """Archivo con el formato de grabacion.Grabador: timestamp, tipo, symbol y payload separados por tabs"""
+    ruta = directorio / "grabacion_20240101_00.tsv.gz"
+    with gzip.open(ruta, "wt", encoding="utf-8") as f:
+        for i, (tipo, symbol, payload) in enumerate(lineas):
+            f.write(f"{1704067200 + i * 0.1:.6f}\t{tipo}\t{symbol}\t{payload}\n")
+    return str(ruta)
+
+def niveles(servidor, symbol):
+    book = servidor.order_books[symbol]
+    a_precio = book['tick_size']
+    return ({round(tick * a_precio, 8): qty for tick, qty in book['bids'].items()},
+            {round(tick * a_precio, 8): qty for tick, qty in book['asks'].items()})
+
+def test_puente_del_buffer(servidor, tmp_path):
+    servidor.cargar_universo(*servidor.leer_meta(escribir_grabacion(tmp_path, GRABACION)))
+    resumen = servidor.reproducir(escribir_grabacion(tmp_path, GRABACION[:6]))
+
+    book = servidor.order_books["AAAUSDT"]
+    assert resumen["snapshots"] == 1
+    assert book['initialized'] and not book['first_event_after_snapshot']
+    assert book['last_u'] == 106
+    assert len(book['buffer']) == 0
+    # El evento u=95 (anterior al snapshot) se descartó; los que cruzan lastUpdateId se aplicaron
+    bids, asks = niveles(servidor, "AAAUSDT")
+    assert bids == {10.01: 2.0, 10.0: 5.0}
+    assert asks == {10.05: 1.0, 10.06: 3.0, 10.07: 2.0}
+
+def test_gap_pide_resync(servidor, tmp_path):
+    ruta = escribir_grabacion(tmp_path, GRABACION[:INDICE_RESYNC])
+    servidor.cargar_universo(*servidor.leer_meta(ruta))
+    resumen = servidor.reproducir(ruta)
+
+    book = servidor.order_books["BBBUSDT"]
+    assert resumen["resyncs"] == 1
+    assert book['metricas'].resyncs == 1
+    assert not book['initialized']
+    # El evento que delató el gap y el siguiente esperan el snapshot nuevo
+    assert [e['u'] for e in book['buffer']] == [212, 214]
+    assert "BBBUSDT" in servidor.programador.activos
+    # El otro símbolo no se entera
+    assert servidor.order_books["AAAUSDT"]['initialized']
+
+def test_resync_completo_y_huella(servidor, tmp_path):
+    ruta = escribir_grabacion(tmp_path, GRABACION)
+    servidor.cargar_universo(*servidor.leer_meta(ruta))
+    resumen = servidor.reproducir(ruta)
+
+    assert resumen["mensajes"] == 8
+    assert resumen["snapshots"] == 3
+    assert resumen["inicializados"] == 2
+    assert resumen["resyncs"] == 1
+
+    book = servidor.order_books["BBBUSDT"]
+    assert book['initialized'] and book['last_u'] == 214
+    bids, asks = niveles(servidor, "BBBUSDT")
+    assert bids == {49.9: 1.0}
+    assert asks == {50.3: 4.0, 50.4: 1.0}
+
+    assert resumen["huella"] == servidor.huella_libros() == HUELLA_ESPERADA
+
+def test_desborde_del_buffer_pide_resync(monkeypatch, tmp_path):
+    monkeypatch.setenv("OB_BUFFER_MAX_EVENTOS", "2")
+    servidor = cargar_servidor()
+    ruta = escribir_grabacion(tmp_path, GRABACION[:4])
+    servidor.cargar_universo(*servidor.leer_meta(ruta))
+    resumen = servidor.reproducir(ruta)
+
+    buffer = servidor.order_books["AAAUSDT"]['buffer']
+    assert buffer.desbordado and buffer.descartados == 1
+    assert [e['u'] for e in buffer] == [101, 104]
+    assert resumen["resyncs"] == 1
+    assert "AAAUSDT" in servidor.programador.activos
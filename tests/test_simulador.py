@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Ingesta contra simulador_binance.py: los streams combinados se enrutan a su
+libro, al caer una conexión sólo se resincronizan los símbolos que viajaban
+en ella y, en modo multi-proceso, los shards se reparten el peso de la IP.
+"""
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+from conftest import RAIZ, cargar_servidor
+
+N_SIMBOLOS = 4
+STREAMS_POR_CONEXION = 2
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def esperar(condicion, timeout=20, cada=0.1):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if condicion():
+            return True
+        time.sleep(cada)
+    return condicion()
+
+def responde(url):
+    try:
+        return requests.get(url, timeout=1).status_code == 200
+    except requests.RequestException:
+        return False
+
+@contextlib.contextmanager
+def proceso(argumentos, url_listo, env=None):
+    """Lanza un proceso de la raíz del repo y espera a que url_listo responda"""
+    p = subprocess.Popen([sys.executable, *argumentos], cwd=RAIZ, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        assert esperar(lambda: responde(url_listo), timeout=30), f"{argumentos[0]} no arrancó"
+        yield p
+    finally:
+        p.terminate()
+        p.wait(timeout=15)
+
+def lanzar_simulador(n_simbolos):
+    puerto = puerto_libre()
+    url = f"http://127.0.0.1:{puerto}"
+    args = ["simulador_binance.py", "--puerto", str(puerto), "--simbolos", str(n_simbolos), "--intervalo-ms", "50"]
+    return url, proceso(args, f"{url}/control/estado")
+
+@pytest.fixture
+def simulador():
+    url, sim = lanzar_simulador(N_SIMBOLOS)
+    with sim:
+        yield url
+
+@pytest.fixture
+def ingesta(simulador, monkeypatch):
+    """Servidor en modo hilos conectado al simulador, con los snapshots iniciales ya cargados"""
+    monkeypatch.setenv("OB_WS_URL", simulador.replace("http://", "ws://"))
+    monkeypatch.setenv("OB_REST_URL", simulador)
+    monkeypatch.setenv("OB_STREAMS_POR_CONEXION", str(STREAMS_POR_CONEXION))
+    monkeypatch.setenv("OB_MODO_INGESTA", "hilos")
+    servidor = cargar_servidor()
+
+    info = requests.get(f"{simulador}/fapi/v1/exchangeInfo", timeout=5).json()
+    servidor.cargar_universo(
+        [s["symbol"] for s in info["symbols"]],
+        {s["symbol"]: float(s["filters"][0]["tickSize"]) for s in info["symbols"]})
+    conexiones = servidor.GestorConexiones(servidor.coins)
+    conexiones.iniciar()
+    servidor.programador.iniciar()
+    servidor.solicitar_snapshots_pendientes()
+    assert esperar(lambda: all(b['initialized'] for b in servidor.order_books.values()))
+
+    yield servidor, conexiones
+
+    # Grupos vacíos: los hilos de conexión terminan en vez de reconectar
+    with conexiones.lock:
+        for grupo in conexiones.grupos:
+            grupo.clear()
+    for ws in list(conexiones.conexiones.values()):
+        ws.close()
+    sys.modules.pop(servidor.__name__, None)
+
+def test_streams_combinados_enrutan(ingesta, simulador):
+    servidor, conexiones = ingesta
+    assert len(conexiones.grupos) == N_SIMBOLOS // STREAMS_POR_CONEXION
+    assert requests.get(f"{simulador}/control/estado", timeout=5).json()["conexiones"] == len(conexiones.grupos)
+
+    inicial = {s: b['metricas'].mensajes for s, b in servidor.order_books.items()}
+    time.sleep(1)
+    precios = {p["symbol"]: float(p["price"]) for p in requests.get(f"{simulador}/fapi/v1/ticker/price", timeout=5).json()}
+
+    for symbol, book in servidor.order_books.items():
+        # Cada libro recibe sus propios diffs: la secuencia pu/u encadena sin resyncs
+        assert book['metricas'].mensajes > inicial[symbol]
+        assert book['metricas'].resyncs == 0
+        assert book['initialized']
+        vista = servidor.vista_libro(book)
+        mejor_bid = vista.bids[0][0] * book['tick_size']
+        mejor_ask = vista.asks[0][0] * book['tick_size']
+        assert mejor_bid < mejor_ask
+        # Y el libro es el del símbolo: el mid coincide con el precio del simulador
+        assert abs((mejor_bid + mejor_ask) / 2 - precios[symbol]) <= 5 * book['tick_size']
+
+def test_reconexion_resincroniza_solo_su_grupo(ingesta, simulador):
+    servidor, conexiones = ingesta
+    ids_snapshot = {s: b['lastUpdateId'] for s, b in servidor.order_books.items()}
+
+    # El simulador numera las conexiones en el orden en que se abrieron
+    r = requests.post(f"{simulador}/control/desconectar", params={"conexion": 0}, timeout=5)
+    assert r.json()["desconectadas"] == [0]
+
+    caida = conexiones.grupos[0]
+    assert esperar(lambda: all(servidor.order_books[s]['lastUpdateId'] != ids_snapshot[s] for s in caida), timeout=30)
+    assert esperar(lambda: all(b['initialized'] for b in servidor.order_books.values()))
+
+    # Sólo los símbolos de la conexión caída pidieron un snapshot nuevo
+    for symbol, book in servidor.order_books.items():
+        if symbol not in caida:
+            assert book['lastUpdateId'] == ids_snapshot[symbol]
+            assert book['initialized']
+    estado = requests.get(f"{simulador}/control/estado", timeout=5).json()
+    assert estado["conexiones"] == len(conexiones.grupos)
+    assert estado["desconexiones"] == 1
+
+def test_cubo_reparte_el_peso_usado_de_la_ip():
+    # Uno de 4 shards: capacidad 500 de un límite de IP de 2000
+    servidor = cargar_servidor()
+    cubo = servidor.CuboTokens(500, 2000)
+    cubo.sincronizar(500)
+    # Quedan 1500 para la IP, a este shard le toca la cuarta parte
+    assert 370 < cubo.tokens <= 375
+    assert cubo.reservar(servidor.PESO_SNAPSHOT) == 0
+    # Proceso único: el header se compara contra su propia capacidad
+    cubo = servidor.CuboTokens(2000)
+    cubo.sincronizar(500)
+    assert 1495 < cubo.tokens <= 1500
+
+def test_shards_arrancan_sin_agotar_el_peso():
+    """80 snapshots (1600 de peso) entran en el límite de 2000 aunque cada shard tenga la mitad"""
+    n_simbolos = 80
+    url_sim, sim = lanzar_simulador(n_simbolos)
+    puerto = puerto_libre()
+    env = dict(os.environ, OB_WS_URL=url_sim.replace("http://", "ws://"), OB_REST_URL=url_sim,
+               OB_SHARDS="2", OB_PUERTO=str(puerto), OB_HOST="127.0.0.1",
+               OB_VOLUMEN_MIN="0", OB_UNIVERSO_INTERVALO="0", OB_PESO_MAX_MINUTO="2000")
+    url = f"http://127.0.0.1:{puerto}"
+    with sim, proceso(["Order book v2.py"], f"{url}/shards", env=env):
+        def inicializados():
+            try:
+                return len(requests.get(f"{url}/symbols", timeout=5).json()["initialized"])
+            except (requests.RequestException, ValueError):
+                return 0
+        # 5s de acumulación de eventos y después los snapshots sin esperas del cubo
+        assert esperar(lambda: inicializados() == n_simbolos, timeout=20, cada=0.5)
+        estado = requests.get(f"{url_sim}/control/estado", timeout=5).json()
+        assert estado["snapshots"] == n_simbolos
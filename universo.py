@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Universo de símbolos monitoreados: contratos PERPETUAL en USDT activos que
+pasan el filtro de volumen (quoteVolume de 24h) y de precio.
+
+Sólo el filtro y la consulta a Binance; qué hacer con los cambios (crear o
+liberar libros, suscribir streams) lo decide el servidor.
+"""
+
+def filtrar_universo(exchange_info, tickers, volumen_min, precio_max, actuales=(), histeresis=1.0):
+    """
+    Devuelve (coins, tick_sizes) con coins en el orden de los tickers.
+    Un símbolo de 'actuales' se mantiene mientras su volumen no baje de
+    volumen_min * histeresis, así los que están en el borde no entran y
+    salen en cada evaluación.
+    """
+    # Contratos PERPETUAL activos en USDT (guardando su tickSize)
+    perpetuos = {}
+    for s in exchange_info['symbols']:
+        if (
+            s['contractType'] == 'PERPETUAL'
+            and s['quoteAsset'] == 'USDT'
+            and s['status'] == 'TRADING'  # activos
+        ):
+            for f in s['filters']:
+                if f['filterType'] == 'PRICE_FILTER':
+                    perpetuos[s['symbol']] = float(f['tickSize'])
+
+    # Cruzar los tickers con los perpetuos válidos
+    actuales = set(actuales)
+    coins = []
+    for el in tickers:
+        symbol = el['symbol']
+        if symbol not in perpetuos:
+            continue
+        minimo = volumen_min * histeresis if symbol in actuales else volumen_min
+        if float(el.get('quoteVolume', 0)) > minimo and float(el.get('lastPrice', 0)) < precio_max:
+            coins.append(symbol)
+    return coins, {symbol: perpetuos[symbol] for symbol in coins}
+
+def consultar_universo(client, volumen_min, precio_max, actuales=(), histeresis=1.0):
+    """exchangeInfo + tickers de 24h (dos peticiones bloqueantes) filtrados con filtrar_universo"""
+    exchange_info = client.futures_exchange_info()
+    tickers = client.futures_ticker()
+    return filtrar_universo(exchange_info, tickers, volumen_min, precio_max, actuales, histeresis)